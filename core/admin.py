@@ -8,14 +8,26 @@ admin.site.register(Patient)
 admin.site.register(Appointment)
 admin.site.register(Ward)
 admin.site.register(Bed)
+admin.site.register(WardCensus)
 admin.site.register(IPDRecord)
+admin.site.register(VitalSign)
+admin.site.register(VitalsAlert)
 admin.site.register(OPDRecord)
 admin.site.register(Medicine)
+admin.site.register(MedicineBatch)
+admin.site.register(StockMovement)
 admin.site.register(PharmacyPrescription)
 admin.site.register(PrescriptionItem)
 admin.site.register(LabTest)
+admin.site.register(LabReferenceRange)
+admin.site.register(LabPanel)
 admin.site.register(LabTestRequest)
+admin.site.register(LabTurnaroundRollup)
 admin.site.register(Bill)
+admin.site.register(BillItem)
+admin.site.register(Payment)
+admin.site.register(RevenueRollup)
+admin.site.register(PerformanceRollup)
 admin.site.register(Attendance)
 admin.site.register(Shift)
 admin.site.register(MedicalReport)
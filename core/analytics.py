@@ -0,0 +1,207 @@
+"""
+Time-bucketed analytics series.
+
+``series(start, end, bucket)`` returns registrations, appointments by
+status, OPD visits, admissions, lab volume and revenue for local
+datetimes ``start`` (inclusive) to ``end`` (exclusive), bucketed by
+hour, day, week (starting Monday) or month. Each metric is one grouped
+``Trunc*`` query; buckets with no rows come back as zero. Appointments
+only have a scheduled date, so hourly series leave them out (an empty
+mapping) rather than pile a day's appointments onto one hour. Revenue
+for day and longer buckets is read from the daily revenue rollups.
+
+Results are cached. Buckets that ended before the current one are
+treated as immutable and cached without expiry. The current and later
+buckets are recomputed after ``ANALYTICS_LIVE_TTL`` seconds.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from datetime import time as dt_time
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDay, TruncHour, TruncMonth, TruncWeek
+from django.utils import timezone
+from .models import (
+    Appointment, Bill, IPDRecord, LabTestRequest, OPDRecord, Patient, Payment, RevenueRollup
+)
+
+TRUNCS = {'hour': TruncHour, 'day': TruncDay, 'week': TruncWeek, 'month': TruncMonth}
+MAX_BUCKETS = 2000
+CACHE_PREFIX = 'analytics:v2'
+
+# name: (queryset, timestamp field, field the series is split by)
+COUNT_METRICS = {
+    'registrations': (Patient.objects.all(), 'registered_date', None),
+    'appointments': (Appointment.objects.all(), 'appointment_date', 'status'),
+    'opd_visits': (OPDRecord.objects.all(), 'visit_date', None),
+    'admissions': (IPDRecord.objects.all(), 'admission_date', None),
+    'lab_requests': (LabTestRequest.objects.all(), 'requested_date', None),
+}
+DATE_FIELDS = {'appointment_date'}
+
+
+class AnalyticsError(ValueError):
+    pass
+
+
+def bucket_floor(moment, bucket):
+    """Start of the bucket holding a naive local datetime"""
+    moment = moment.replace(minute=0, second=0, microsecond=0)
+    if bucket == 'hour':
+        return moment
+    moment = moment.replace(hour=0)
+    if bucket == 'week':
+        return moment - timedelta(days=moment.weekday())
+    if bucket == 'month':
+        return moment.replace(day=1)
+    return moment
+
+
+def next_bucket(moment, bucket):
+    if bucket == 'hour':
+        return moment + timedelta(hours=1)
+    if bucket == 'day':
+        return moment + timedelta(days=1)
+    if bucket == 'week':
+        return moment + timedelta(days=7)
+    return (moment.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def bucket_starts(start, end, bucket):
+    """Naive local bucket starts covering [start, end)"""
+    starts = []
+    current = bucket_floor(start, bucket)
+    while current < end:
+        starts.append(current)
+        if len(starts) > MAX_BUCKETS:
+            raise AnalyticsError(f'Too many {bucket} buckets; choose a shorter range or a larger bucket.')
+        current = next_bucket(current, bucket)
+    return starts
+
+
+def _key(value):
+    """Naive local datetime for a truncated date or datetime"""
+    if isinstance(value, datetime):
+        return timezone.localtime(value).replace(tzinfo=None) if timezone.is_aware(value) else value
+    return datetime.combine(value, dt_time.min)
+
+
+def _grouped(queryset, field, bucket, start, end, split=None, **aggregates):
+    """One grouped query: {(bucket start, split value): aggregates}"""
+    if field in DATE_FIELDS or queryset.model is RevenueRollup:
+        # Only called with day and longer buckets, whose ranges start at midnight
+        truncate = TRUNCS[bucket]
+        lower, upper = start.date(), end.date() if end.time() == dt_time.min else end.date() + timedelta(days=1)
+        queryset = queryset.filter(**{f'{field}__gte': lower, f'{field}__lt': upper})
+    else:
+        truncate = TRUNCS[bucket]
+        queryset = queryset.filter(**{
+            f'{field}__gte': timezone.make_aware(start), f'{field}__lt': timezone.make_aware(end)
+        })
+    group_by = ['period'] + ([split] if split else [])
+    rows = queryset.annotate(period=truncate(field)).values(*group_by).annotate(**aggregates).order_by()
+    return {
+        (_key(row['period']), row[split] if split else None): row for row in rows
+    }
+
+
+def _compute(start, end, bucket):
+    starts = bucket_starts(start, end, bucket)
+    index = {moment: position for position, moment in enumerate(starts)}
+
+    def zeros():
+        return [0] * len(starts)
+
+    result = {}
+    for name, (queryset, field, split) in COUNT_METRICS.items():
+        if bucket == 'hour' and field in DATE_FIELDS:
+            # A date has no hour to bucket by
+            result[name] = {} if split else zeros()
+            continue
+        rows = _grouped(queryset, field, bucket, start, end, split, count=Count('pk'))
+        if split:
+            values = defaultdict(zeros)
+            for (moment, group), row in rows.items():
+                if moment in index:
+                    values[group][index[moment]] += row['count']
+            result[name] = dict(values)
+        else:
+            values = zeros()
+            for (moment, _), row in rows.items():
+                if moment in index:
+                    values[index[moment]] += row['count']
+            result[name] = values
+
+    billed, collected = zeros(), zeros()
+    if bucket == 'hour':
+        sources = (
+            (billed, _grouped(Bill.objects.all(), 'created_at', bucket, start, end, amount=Sum('total_amount'))),
+            (collected, _grouped(Payment.objects.all(), 'received_at', bucket, start, end, amount=Sum('amount'))),
+        )
+        for values, rows in sources:
+            for (moment, _), row in rows.items():
+                if moment in index:
+                    values[index[moment]] += float(row['amount'] or 0)
+    else:
+        rows = _grouped(
+            RevenueRollup.objects.all(), 'day', bucket, start, end,
+            billed=Sum('billed_amount'), collected=Sum('collected_amount')
+        )
+        for (moment, _), row in rows.items():
+            if moment in index:
+                billed[index[moment]] += float(row['billed'] or 0)
+                collected[index[moment]] += float(row['collected'] or 0)
+    result['revenue_billed'] = billed
+    result['revenue_collected'] = collected
+    return [moment.isoformat() for moment in starts], result
+
+
+def _cached(start, end, bucket, timeout):
+    key = f'{CACHE_PREFIX}:{bucket}:{start.isoformat()}:{end.isoformat()}'
+    value = cache.get(key)
+    if value is None:
+        value = _compute(start, end, bucket)
+        cache.set(key, value, timeout)
+    return value
+
+
+def _merge(parts):
+    labels, merged = [], {}
+    for part_labels, part in parts:
+        labels += part_labels
+        for name, values in part.items():
+            if isinstance(values, dict):
+                target = merged.setdefault(name, {})
+                for group in set(target) | set(values):
+                    target[group] = (
+                        target.get(group, [0] * (len(labels) - len(part_labels)))
+                        + values.get(group, [0] * len(part_labels))
+                    )
+            else:
+                merged[name] = merged.get(name, []) + values
+    return labels, merged
+
+
+def series(start, end, bucket='day', now=None):
+    """
+    Analytics series for naive local datetimes [start, end).
+
+    Returns ``{'bucket', 'buckets': [ISO bucket starts], 'series': {...}}``
+    where split metrics (appointments) map each status to a list.
+    """
+    if bucket not in TRUNCS:
+        raise AnalyticsError(f'Unknown bucket {bucket!r}; use hour, day, week or month.')
+    if end <= start:
+        raise AnalyticsError('The end of the range must be after its start.')
+    start = bucket_floor(start, bucket)
+    bucket_starts(start, end, bucket)
+
+    current = bucket_floor(timezone.localtime(now).replace(tzinfo=None), bucket)
+    parts = []
+    if start < current:
+        parts.append(_cached(start, min(end, current), bucket, None))
+    if end > current:
+        parts.append(_cached(max(start, current), end, bucket, getattr(settings, 'ANALYTICS_LIVE_TTL', 60)))
+    labels, values = _merge(parts)
+    return {'bucket': bucket, 'buckets': labels, 'series': values}
@@ -0,0 +1,107 @@
+"""
+Staff attendance marking and the monthly attendance matrix.
+
+``mark()`` writes any number of attendance entries with a single
+INSERT ... ON CONFLICT (user, date) DO UPDATE, so marking a whole role
+for a day costs one query however many staff there are.
+
+``monthly_matrix()`` reads a month of attendance in one query into a
+dense staff × day array of status codes. Per-person and per-day totals
+are taken from the array, and the template gets rows and cells it can
+render in order without per-cell lookups.
+"""
+import calendar
+from datetime import date, timedelta
+import numpy as np
+from django.contrib.auth.models import User
+from . import coverage
+from .models import Attendance
+
+# Cell codes in the matrix; 0 is "not marked"
+STATUSES = [status for status, _ in Attendance.STATUS_CHOICES]
+CODES = {status: code for code, status in enumerate(STATUSES, start=1)}
+ABBREVIATIONS = {'present': 'P', 'absent': 'A', 'half_day': 'H', 'leave': 'L'}
+
+
+def staff_members(role=None):
+    staff = User.objects.filter(profile__isnull=False).select_related('profile')
+    if role:
+        staff = staff.filter(profile__role=role)
+    return staff.order_by('profile__role', 'first_name', 'last_name', 'pk')
+
+
+def mark(entries):
+    """
+    Upsert attendance in one query.
+
+    ``entries`` are dicts with ``user_id``, ``date`` and ``status`` and
+    optionally ``check_in_time``, ``check_out_time`` and ``notes``.
+    Returns the number of entries written.
+    """
+    records = []
+    for entry in entries:
+        if entry['status'] not in CODES:
+            raise ValueError(f"Unknown attendance status {entry['status']!r}.")
+        records.append(Attendance(
+            user_id=entry['user_id'],
+            date=entry['date'],
+            status=entry['status'],
+            check_in_time=entry.get('check_in_time') or None,
+            check_out_time=entry.get('check_out_time') or None,
+            notes=entry.get('notes', '')
+        ))
+    Attendance.objects.bulk_create(
+        records,
+        update_conflicts=True,
+        unique_fields=['user', 'date'],
+        update_fields=['status', 'check_in_time', 'check_out_time', 'notes'],
+        batch_size=500
+    )
+    coverage.days_changed({record.date for record in records})
+    return len(records)
+
+
+def monthly_matrix(month, role=None):
+    """
+    Attendance for the calendar month containing ``month``.
+
+    Returns a dict with ``days`` (dates), ``rows`` (``{'user', 'cells',
+    'totals'}`` per staff member, cells being ``(status, abbreviation)``,
+    empty when not marked) and ``day_totals`` (staff present or on a
+    half day, per day).
+    """
+    first = month.replace(day=1)
+    day_count = calendar.monthrange(first.year, first.month)[1]
+    days = [first + timedelta(days=offset) for offset in range(day_count)]
+    staff = list(staff_members(role))
+    position = {user.pk: index for index, user in enumerate(staff)}
+
+    codes = np.zeros((len(staff), day_count), dtype=np.int8)
+    marked = Attendance.objects.filter(date__gte=first, date__lte=days[-1], user__profile__isnull=False)
+    if role:
+        marked = marked.filter(user__profile__role=role)
+    for user_id, day, status in marked.values_list('user_id', 'date', 'status'):
+        codes[position[user_id], day.day - 1] = CODES.get(status, 0)
+
+    # Count of each code per person: column k is the number of days with code k
+    counts = np.stack([(codes == code).sum(axis=1) for code in range(len(STATUSES) + 1)], axis=1)
+    cell_labels = [('', '')] + [(status, ABBREVIATIONS[status]) for status in STATUSES]
+    rows = [
+        {
+            'user': user,
+            'cells': [cell_labels[code] for code in codes[index].tolist()],
+            'totals': {status: int(counts[index, CODES[status]]) for status in STATUSES},
+        }
+        for index, user in enumerate(staff)
+    ]
+    attending = ((codes == CODES['present']) | (codes == CODES['half_day'])).sum(axis=0)
+    return {'days': days, 'rows': rows, 'day_totals': attending.tolist()}
+
+
+def parse_month(value, default=None):
+    """``date`` for a ``YYYY-MM`` string, or ``default`` if it is empty or invalid"""
+    try:
+        year, month = (int(part) for part in value.split('-'))
+        return date(year, month, 1)
+    except (AttributeError, ValueError):
+        return default
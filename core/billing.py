@@ -0,0 +1,351 @@
+"""
+Bill composition from OPD visits and IPD stays.
+
+A bill is built from what is already on record: the doctor's
+consultation fee, the ward's daily charge for each night of an IPD stay,
+the encounter's prescriptions, and the patient's lab requests made
+during the encounter (the visit's day for OPD, admission to discharge
+for IPD). Each source becomes ``BillItem`` lines, and the prescriptions
+and lab requests are linked to the bill so they are never charged twice.
+
+Charges for any number of encounters are gathered with the same handful
+of queries, so billing every discharge of a day costs no more round
+trips than billing one.
+
+Payments are appended to the ``Payment`` ledger and applied to the
+bill's ``amount_paid``, ``balance`` and ``status`` with a single
+conditional UPDATE in the same transaction, so concurrent payments never
+overwrite each other. ``reconcile_bills()`` re-derives those columns
+from the ledger.
+"""
+import random
+import string
+from collections import defaultdict
+from datetime import datetime, timedelta
+from datetime import time as dt_time
+from decimal import Decimal
+from django.db import IntegrityError, transaction
+from django.db.models import Case, DecimalField, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from . import revenue
+from .models import Bill, BillItem, IPDRecord, LabTestRequest, Payment, PharmacyPrescription
+
+
+class BillingError(Exception):
+    pass
+
+
+def new_bill_number():
+    return 'BILL' + ''.join(random.choices(string.digits, k=8))
+
+
+def length_of_stay(admission_date, discharge_date):
+    """Nights between the local admission and discharge dates, at least one"""
+    nights = (timezone.localdate(discharge_date) - timezone.localdate(admission_date)).days
+    return max(nights, 1)
+
+
+def _item(category, description, unit_price, quantity=1):
+    return BillItem(
+        category=category, description=description[:200], quantity=quantity,
+        unit_price=unit_price, amount=unit_price * quantity
+    )
+
+
+def _window(encounter, ipd, now):
+    """Lab requests made in [start, end) belong to the encounter"""
+    if ipd:
+        return encounter.admission_date, encounter.discharge_date or now
+    start = timezone.make_aware(datetime.combine(timezone.localdate(encounter.visit_date), dt_time.min))
+    return start, start + timedelta(days=1)
+
+
+def charge_lines(encounters, now=None):
+    """
+    Charge lines for a list of OPD or IPD records (not mixed).
+
+    The records must come with ``doctor__user`` (and for IPD
+    ``bed__ward``) selected. Prescriptions and lab requests for all of
+    them are read in one query each. Returns ``{encounter pk: {'items',
+    'prescription_ids', 'lab_request_ids'}}``.
+    """
+    now = now or timezone.now()
+    charges = {
+        encounter.pk: {'items': [], 'prescription_ids': [], 'lab_request_ids': []}
+        for encounter in encounters
+    }
+    if not encounters:
+        return charges
+    ipd = isinstance(encounters[0], IPDRecord)
+
+    windows = defaultdict(list)
+    for encounter in encounters:
+        items = charges[encounter.pk]['items']
+        items.append(_item(
+            'consultation', f'Consultation - Dr. {encounter.doctor.user.get_full_name()}',
+            encounter.doctor.consultation_fee
+        ))
+        if ipd and encounter.bed:
+            ward = encounter.bed.ward
+            items.append(_item(
+                'room', f'{ward.ward_name} ({ward.ward_type}), bed {encounter.bed.bed_number}',
+                ward.charge_per_day, length_of_stay(encounter.admission_date, encounter.discharge_date or now)
+            ))
+        windows[encounter.patient_id].append((*_window(encounter, ipd, now), encounter.pk))
+
+    link = 'ipd_record' if ipd else 'opd_record'
+    prescriptions = PharmacyPrescription.objects.filter(
+        **{f'{link}__in': list(charges)}, bill__isnull=True
+    ).exclude(status='cancelled').order_by('pk').values_list('pk', f'{link}_id', 'prescription_number', 'total_amount')
+    for pk, encounter_id, number, total_amount in prescriptions:
+        charges[encounter_id]['items'].append(_item('medicine', f'Prescription {number}', total_amount))
+        charges[encounter_id]['prescription_ids'].append(pk)
+
+    all_windows = [window for patient_windows in windows.values() for window in patient_windows]
+    lab_requests = LabTestRequest.objects.filter(
+        patient_id__in=list(windows),
+        requested_date__gte=min(start for start, _, _ in all_windows),
+        requested_date__lt=max(end for _, end, _ in all_windows),
+        bill__isnull=True
+    ).exclude(status='cancelled').order_by('pk').values_list(
+        'pk', 'patient_id', 'requested_date', 'test__test_name', 'price'
+    )
+    # One line per test and price, e.g. "Complete Blood Count x 2"
+    lab_lines = defaultdict(list)
+    for pk, patient_id, requested_date, test_name, price in lab_requests:
+        for start, end, encounter_id in windows[patient_id]:
+            if start <= requested_date < end:
+                lab_lines[encounter_id, test_name, price].append(pk)
+                break
+    for (encounter_id, test_name, price), request_ids in lab_lines.items():
+        charges[encounter_id]['items'].append(_item('lab', test_name, price, len(request_ids)))
+        charges[encounter_id]['lab_request_ids'].extend(request_ids)
+    return charges
+
+
+def outstanding_charges(encounters, now=None):
+    """
+    ``charge_lines()`` less what earlier bills of the encounters covered.
+
+    Prescriptions and lab requests on earlier bills are never charged
+    again; this also drops a consultation already billed and the nights
+    already charged, with one more query.
+    """
+    charges = charge_lines(encounters, now)
+    if not encounters:
+        return charges
+    link = 'ipd_record' if isinstance(encounters[0], IPDRecord) else 'opd_record'
+    billed = BillItem.objects.filter(
+        **{f'bill__{link}__in': list(charges)}, category__in=('consultation', 'room')
+    ).values_list(f'bill__{link}', 'category').annotate(quantity=Sum('quantity')).order_by()
+    covered = defaultdict(dict)
+    for encounter_id, category, quantity in billed:
+        covered[encounter_id][category] = quantity
+
+    for encounter_id, quantities in covered.items():
+        items = []
+        for item in charges[encounter_id]['items']:
+            if item.category in quantities:
+                item.quantity -= quantities[item.category]
+                item.amount = item.unit_price * item.quantity
+            if item.quantity > 0:
+                items.append(item)
+        charges[encounter_id]['items'] = items
+    return charges
+
+
+def _link_to_bills(model, ids_by_bill):
+    """Point each source row at its bill in a single UPDATE"""
+    whens = [When(pk__in=ids, then=Value(bill_id)) for bill_id, ids in ids_by_bill.items() if ids]
+    if whens:
+        model.objects.filter(pk__in=[pk for ids in ids_by_bill.values() for pk in ids]).update(
+            bill_id=Case(*whens, output_field=IntegerField())
+        )
+
+
+def _compose_bills(encounters, created_by=None, discount=0, tax=0, other_charges=0, final=False):
+    """
+    Bill every not-yet-billed encounter in the queryset in one transaction.
+
+    With ``final``, encounters that already have bills are billed too,
+    for whatever those bills did not cover (see
+    ``outstanding_charges()``); encounters with nothing left are skipped.
+    """
+    ipd = encounters.model is IPDRecord
+    related = ['doctor__user', 'bed__ward'] if ipd else ['doctor__user']
+    with transaction.atomic():
+        if not final:
+            encounters = encounters.filter(bill__isnull=True)
+        encounters = list(encounters.select_related(*related).select_for_update(of=('self',)))
+        if final:
+            charges = outstanding_charges(encounters)
+            encounters = [encounter for encounter in encounters if charges[encounter.pk]['items']]
+        else:
+            charges = charge_lines(encounters)
+
+        bills = []
+        for encounter in encounters:
+            items = charges[encounter.pk]['items']
+            if other_charges:
+                items.append(_item('other', 'Other charges', Decimal(other_charges)))
+            totals = defaultdict(Decimal)
+            for item in items:
+                totals[item.category] += item.amount
+            bill = Bill(
+                bill_number=new_bill_number(),
+                patient_id=encounter.patient_id,
+                consultation_fee=totals['consultation'],
+                room_charges=totals['room'],
+                medicine_charges=totals['medicine'],
+                lab_charges=totals['lab'],
+                other_charges=totals['other'],
+                discount=Decimal(discount),
+                tax=Decimal(tax),
+                created_by=created_by,
+                **{'ipd_record' if ipd else 'opd_record': encounter}
+            )
+            # bulk_create() skips save(), which normally fills these in
+            bill.calculate_totals()
+            bills.append(bill)
+        Bill.objects.bulk_create(bills)
+        revenue.bills_changed([(None, revenue.bill_state(bill)) for bill in bills])
+
+        for bill, encounter in zip(bills, encounters):
+            for item in charges[encounter.pk]['items']:
+                item.bill = bill
+        BillItem.objects.bulk_create(
+            [item for encounter in encounters for item in charges[encounter.pk]['items']], batch_size=500
+        )
+        _link_to_bills(PharmacyPrescription, {
+            bill.pk: charges[encounter.pk]['prescription_ids'] for bill, encounter in zip(bills, encounters)
+        })
+        _link_to_bills(LabTestRequest, {
+            bill.pk: charges[encounter.pk]['lab_request_ids'] for bill, encounter in zip(bills, encounters)
+        })
+    return bills
+
+
+def compose_bill(patient, encounter, created_by=None, discount=0, tax=0, other_charges=0):
+    """Create the itemized bill for one OPDRecord or IPDRecord of ``patient``"""
+    if encounter.patient_id != patient.pk:
+        raise BillingError('The encounter belongs to another patient.')
+    bills = _compose_bills(
+        type(encounter).objects.filter(pk=encounter.pk), created_by,
+        discount=discount, tax=tax, other_charges=other_charges
+    )
+    if not bills:
+        number = getattr(encounter, 'ipd_number', None) or encounter.opd_number
+        raise BillingError(f'{number} has already been billed.')
+    return bills[0]
+
+
+def compose_final_bills(stays, created_by=None):
+    """Final bills for the IPD stays in an IPDRecord queryset, covering whatever earlier bills left out"""
+    return _compose_bills(stays, created_by, final=True)
+
+
+def compose_discharge_bills(day=None, created_by=None):
+    """Bill every IPD stay discharged on ``day`` (local date, default today) that has no bill yet"""
+    day = day or timezone.localdate()
+    start = timezone.make_aware(datetime.combine(day, dt_time.min))
+    return _compose_bills(
+        IPDRecord.objects.filter(
+            status='discharged',
+            discharge_date__gte=start,
+            discharge_date__lt=start + timedelta(days=1)
+        ),
+        created_by
+    )
+
+
+def _replayed_payment(bill_id, idempotency_key):
+    """The payment already recorded under ``idempotency_key`` for this bill, if any"""
+    existing = Payment.objects.filter(idempotency_key=idempotency_key).first()
+    if existing and existing.bill_id != int(bill_id):
+        raise BillingError('This payment was already recorded against another bill.')
+    return existing
+
+
+def record_payment(bill_id, amount, method, user=None, idempotency_key=None):
+    """
+    Append a payment and apply it to the bill atomically.
+
+    The bill is updated with ``F()`` expressions guarded by
+    ``balance >= amount``, so an overpayment, including one made
+    concurrently, is rejected. A repeated ``idempotency_key`` returns the
+    payment already recorded against this bill; a key already used on
+    another bill raises ``BillingError``. Returns ``(payment, created)``.
+    """
+    amount = Decimal(amount)
+    if amount <= 0:
+        raise BillingError('Payment amount must be positive.')
+    if method not in dict(Bill.PAYMENT_METHOD_CHOICES):
+        raise BillingError('Please select a payment method.')
+    if idempotency_key:
+        existing = _replayed_payment(bill_id, idempotency_key)
+        if existing:
+            return existing, False
+
+    try:
+        with transaction.atomic():
+            payment = Payment.objects.create(
+                bill_id=bill_id, method=method, amount=amount, received_by=user,
+                idempotency_key=idempotency_key or None
+            )
+            before = Bill.objects.select_for_update().filter(pk=bill_id).values_list(
+                'created_at', 'payment_method', 'status', 'total_amount'
+            ).first()
+            updated = Bill.objects.filter(pk=bill_id, balance__gte=amount).update(
+                amount_paid=F('amount_paid') + amount,
+                balance=F('balance') - amount,
+                # Evaluated against the row before the update
+                status=Case(When(balance=amount, then=Value('paid')), default=Value('partial')),
+                payment_method=method,
+                updated_at=timezone.now()
+            )
+            if not updated:
+                raise BillingError('Payment exceeds the balance due.')
+            after = Bill.objects.filter(pk=bill_id).values_list(
+                'created_at', 'payment_method', 'status', 'total_amount'
+            ).get()
+            revenue.bills_changed([(before, after)])
+            revenue.payment_recorded(payment)
+    except IntegrityError:
+        if idempotency_key:
+            # The same form was submitted concurrently and the other request won
+            return _replayed_payment(bill_id, idempotency_key), False
+        raise
+    return payment, True
+
+
+def reconcile_bills(apply=True):
+    """
+    Compare every bill's ``amount_paid`` with its ledger total.
+
+    Mismatches are found in one grouped query and, with ``apply``,
+    corrected (with ``balance`` and ``status``) in one bulk update.
+    Returns the list of ``(bill_number, recorded, ledger)`` mismatches.
+    """
+    mismatched = list(Bill.objects.annotate(
+        ledger_paid=Coalesce(Sum('payments__amount'), Value(Decimal(0)), output_field=DecimalField())
+    ).exclude(amount_paid=F('ledger_paid')).values_list(
+        'pk', 'bill_number', 'amount_paid', 'ledger_paid', 'created_at', 'payment_method', 'status', 'total_amount'
+    ))
+    if apply and mismatched:
+        bills, changes = [], []
+        now = timezone.now()
+        for pk, _, _, ledger_paid, created_at, method, status, total_amount in mismatched:
+            balance = total_amount - ledger_paid
+            new_status = Bill.status_for(balance, ledger_paid)
+            bills.append(Bill(
+                pk=pk, amount_paid=ledger_paid, balance=balance, status=new_status, updated_at=now
+            ))
+            changes.append((
+                (created_at, method, status, total_amount),
+                (created_at, method, new_status, total_amount)
+            ))
+        with transaction.atomic():
+            Bill.objects.bulk_update(bills, ['amount_paid', 'balance', 'status', 'updated_at'], batch_size=500)
+            revenue.bills_changed(changes)
+    return [(number, amount_paid, ledger_paid) for _, number, amount_paid, ledger_paid, *_ in mismatched]
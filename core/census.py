@@ -0,0 +1,172 @@
+"""
+IPD census, bed-days, occupancy and average length of stay per ward.
+
+``WardCensus`` holds one row per ward and local day on which patients
+were admitted to or discharged from the ward. A row stores that day's
+admissions, its discharges, the nights of the stays that ended
+(for ALOS), and the midnight census: patients still in the ward at the
+end of the day. Days without events are not stored, because their
+census is the one of the last row before them.
+
+Period figures come from a sweep over those event rows. Between two
+events the census is constant, so bed-days for any range is a sum of
+census × days over at most one row per event day. A year of a busy
+ward is a few hundred rows, and the daily census is never rebuilt by
+scanning stays.
+
+``record_admission()`` and ``record_discharge()`` keep the rows current
+as patients come and go. ``rebuild_census()`` recomputes every row from
+``IPDRecord`` with the same sweep, e.g. after stays are edited.
+"""
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.utils import timezone
+from . import billing
+from .models import IPDRecord, Ward, WardCensus
+
+
+def census_rows(stays):
+    """
+    Event rows from stays by a sweep over admissions and discharges.
+
+    ``stays`` yields ``(ward_id, admitted_day, discharged_day or None,
+    nights)``. Returns ``{(ward_id, day): [admissions, discharges,
+    census, discharged_days]}``. The work is one pass over the stays
+    plus sorting the distinct event days.
+    """
+    events = defaultdict(lambda: [0, 0, 0])
+    for ward_id, admitted, discharged, nights in stays:
+        events[ward_id, admitted][0] += 1
+        if discharged is not None:
+            event = events[ward_id, discharged]
+            event[1] += 1
+            event[2] += nights
+
+    rows = {}
+    census = defaultdict(int)
+    for ward_id, day in sorted(events):
+        admissions, discharges, discharged_days = events[ward_id, day]
+        census[ward_id] += admissions - discharges
+        rows[ward_id, day] = [admissions, discharges, census[ward_id], discharged_days]
+    return rows
+
+
+def period_stats(rows, start, end, opening=0, beds=0):
+    """
+    Sweep one ward's event rows over local dates ``start`` to ``end`` inclusive.
+
+    ``rows`` are ``(day, admissions, discharges, census,
+    discharged_days)`` in day order, all within the range. ``opening``
+    is the census at the end of the day before ``start``.
+    """
+    census, current = opening, start
+    bed_days = admissions = discharges = discharged_days = 0
+    for day, day_admissions, day_discharges, day_census, day_discharged_days in rows:
+        # The days since the last event had the census that event left
+        bed_days += census * (day - current).days
+        census, current = day_census, day
+        admissions += day_admissions
+        discharges += day_discharges
+        discharged_days += day_discharged_days
+    bed_days += census * ((end - current).days + 1)
+
+    days = (end - start).days + 1
+    return {
+        'census': census,
+        'bed_days': bed_days,
+        'admissions': admissions,
+        'discharges': discharges,
+        'occupancy': 100 * bed_days / (beds * days) if beds else None,
+        'alos': discharged_days / discharges if discharges else None,
+    }
+
+
+def _stay(ward_id, admission_date, discharge_date):
+    nights = billing.length_of_stay(admission_date, discharge_date) if discharge_date else 0
+    return (
+        ward_id,
+        timezone.localdate(admission_date),
+        timezone.localdate(discharge_date) if discharge_date else None,
+        nights,
+    )
+
+
+def rebuild_census():
+    """Recompute every census row from the IPD records; returns the number of rows"""
+    stays = IPDRecord.objects.filter(bed__isnull=False).values_list(
+        'bed__ward_id', 'admission_date', 'discharge_date'
+    ).iterator(chunk_size=5000)
+    rows = census_rows(_stay(*stay) for stay in stays)
+    census = [
+        WardCensus(
+            ward_id=ward_id, day=day, admissions=admissions, discharges=discharges,
+            census=count, discharged_days=discharged_days
+        )
+        for (ward_id, day), (admissions, discharges, count, discharged_days) in rows.items()
+    ]
+    with transaction.atomic():
+        WardCensus.objects.all().delete()
+        WardCensus.objects.bulk_create(census, batch_size=1000)
+    return len(census)
+
+
+def _apply(ward_id, day, census, **counts):
+    """Add an event on ``day`` and shift the census of that and every later row"""
+    with transaction.atomic():
+        # Serializes census writes per ward
+        Ward.objects.select_for_update().filter(pk=ward_id).first()
+        opening = WardCensus.objects.filter(ward_id=ward_id, day__lt=day).order_by('-day').values_list(
+            'census', flat=True
+        ).first() or 0
+        row, _ = WardCensus.objects.get_or_create(ward_id=ward_id, day=day, defaults={'census': opening})
+        WardCensus.objects.filter(pk=row.pk).update(**{name: F(name) + value for name, value in counts.items()})
+        WardCensus.objects.filter(ward_id=ward_id, day__gte=day).update(census=F('census') + census)
+
+
+def record_admission(ipd_record):
+    ward_id, admission_date = IPDRecord.objects.filter(pk=ipd_record.pk).values_list(
+        'bed__ward_id', 'admission_date'
+    ).get()
+    if ward_id:
+        _apply(ward_id, timezone.localdate(admission_date), 1, admissions=1)
+
+
+def record_discharge(ipd_record):
+    record_discharges([ipd_record.pk])
+
+
+def record_discharges(ipd_ids):
+    """Count discharged stays, one census update per ward and day"""
+    events = defaultdict(lambda: [0, 0])
+    for stay in IPDRecord.objects.filter(
+        pk__in=ipd_ids, bed__isnull=False, discharge_date__isnull=False
+    ).values_list('bed__ward_id', 'admission_date', 'discharge_date'):
+        ward_id, _, day, nights = _stay(*stay)
+        events[ward_id, day][0] += 1
+        events[ward_id, day][1] += nights
+    # Sorted, so concurrent writers lock wards in the same order
+    for (ward_id, day), (discharges, nights) in sorted(events.items()):
+        _apply(ward_id, day, -discharges, discharges=discharges, discharged_days=nights)
+
+
+def ward_stats(start, end):
+    """
+    ``period_stats()`` for every ward over local dates ``start`` to ``end`` inclusive.
+
+    Two queries: the event rows in the range, and each ward with its
+    opening census.
+    """
+    rows = defaultdict(list)
+    for ward_id, *row in WardCensus.objects.filter(day__gte=start, day__lte=end).order_by(
+        'ward_id', 'day'
+    ).values_list('ward_id', 'day', 'admissions', 'discharges', 'census', 'discharged_days'):
+        rows[ward_id].append(row)
+
+    wards = Ward.objects.annotate(opening=Subquery(
+        WardCensus.objects.filter(ward=OuterRef('pk'), day__lt=start).order_by('-day').values('census')[:1]
+    )).values_list('pk', 'opening', 'total_beds')
+    return {
+        pk: period_stats(rows[pk], start, end, opening or 0, beds)
+        for pk, opening, beds in wards
+    }
@@ -0,0 +1,344 @@
+"""
+Columnar snapshots of the ``core`` tables for offline analysis.
+
+Every model (including many-to-many link tables) is exported to
+``<directory>/<db_table>/part-*.npz``: compressed NumPy archives with
+one typed array per column, which ``numpy.load()`` or
+``pandas.DataFrame(dict(numpy.load(path)))`` read without parsing.
+Columns keep their types:
+
+* integers and foreign keys are ``int64``, with a ``<column>__null``
+  mask for nullable columns;
+* decimals are ``int64`` scaled by ``10 ** scale``, so no precision is
+  lost (the scale is in the manifest);
+* datetimes are ``datetime64[us]`` in UTC, dates ``datetime64[D]`` and
+  times ``timedelta64[us]`` since midnight, with NaT for null;
+* fields with choices are ``int16`` codes into ``<column>__categories``
+  (the choice keys first, in declaration order, then any other values
+  found), with -1 for null; the labels are in the manifest.
+
+``manifest.json`` records each table's columns, partitions and export
+mode:
+
+* ``incremental`` tables are those with ``updated_at``. A run appends
+  partitions of the rows inserted or updated since the watermark, so a
+  changed row appears again in a later partition and the last copy is
+  current. Each run also writes the table's current primary keys to
+  ``<db_table>/ids-<run>.npy`` (``ids`` in the manifest); rows whose key
+  is missing from it were deleted. Writes that bypass ``updated_at``
+  (a ``QuerySet.update()`` that does not set it, including
+  ``on_delete=SET_NULL``) are not seen until the row changes again.
+* ``snapshot`` tables are all the others (for example lab requests,
+  batches, beds, attendance, shifts, the rollups and many-to-many
+  links): their rows change in place without a timestamp, so every run
+  exports them in full and the new partitions replace the old ones once
+  the table is complete.
+
+``read_table()`` applies both rules and returns the current rows. Rows
+are read in keyset-paginated chunks and each chunk becomes its own
+partition, so memory use depends on the chunk size, not on the table.
+"""
+import json
+import os
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+import numpy as np
+from django.apps import apps
+from django.db.models import Q
+from django.utils import timezone
+
+MANIFEST = 'manifest.json'
+CHUNK_SIZE = 50000
+RUN_FORMAT = '%Y%m%dT%H%M%S%f'
+WATERMARK_FIELD = 'updated_at'
+
+KINDS = {
+    'AutoField': 'int', 'BigAutoField': 'int', 'SmallAutoField': 'int',
+    'IntegerField': 'int', 'BigIntegerField': 'int', 'SmallIntegerField': 'int',
+    'PositiveIntegerField': 'int', 'PositiveBigIntegerField': 'int', 'PositiveSmallIntegerField': 'int',
+    'DecimalField': 'decimal',
+    'FloatField': 'float',
+    'BooleanField': 'bool',
+    'DateTimeField': 'datetime',
+    'DateField': 'date',
+    'TimeField': 'time',
+    'JSONField': 'json',
+}
+
+
+def _kind(field):
+    if field.choices:
+        return 'category'
+    if field.is_relation:
+        return _kind(field.target_field)
+    return KINDS.get(field.get_internal_type(), 'str')
+
+
+def table_schema(model):
+    """Column descriptions for a model, as stored in the manifest"""
+    columns = []
+    for field in model._meta.concrete_fields:
+        column = {'name': field.attname, 'type': _kind(field), 'nullable': field.null}
+        if column['type'] == 'decimal':
+            column['scale'] = field.decimal_places
+        elif column['type'] == 'category':
+            column['choices'] = [[key, str(label)] for key, label in field.flatchoices]
+        columns.append(column)
+    return columns
+
+
+def watermark_field(model):
+    """``updated_at`` for tables exported incrementally, None for tables snapshotted in full"""
+    names = {field.name for field in model._meta.concrete_fields}
+    return WATERMARK_FIELD if WATERMARK_FIELD in names else None
+
+
+# Encoding and decoding of one column
+
+def _utc(value):
+    return value.astimezone(dt_timezone.utc).replace(tzinfo=None) if timezone.is_aware(value) else value
+
+
+def encode_column(column, values):
+    """``{array name: ndarray}`` for one column of a chunk"""
+    name, kind = column['name'], column['type']
+    nulls = [value is None for value in values]
+    arrays = {}
+    if kind == 'category':
+        categories = [key for key, _ in column['choices']]
+        positions = {key: position for position, key in enumerate(categories)}
+        for value in values:
+            if value is not None and value not in positions:
+                positions[value] = len(categories)
+                categories.append(value)
+        arrays[name] = np.array([-1 if value is None else positions[value] for value in values], dtype=np.int16)
+        arrays[f'{name}__categories'] = np.array(categories)
+        return arrays
+    if kind == 'int':
+        arrays[name] = np.array([0 if value is None else value for value in values], dtype=np.int64)
+    elif kind == 'decimal':
+        scale = Decimal(1).scaleb(column['scale'])
+        arrays[name] = np.array(
+            [0 if value is None else int((value * scale).to_integral_value()) for value in values], dtype=np.int64
+        )
+    elif kind == 'float':
+        arrays[name] = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+    elif kind == 'bool':
+        arrays[name] = np.array([bool(value) for value in values], dtype=bool)
+    elif kind == 'datetime':
+        return {name: np.array([_utc(value) if value else None for value in values], dtype='datetime64[us]')}
+    elif kind == 'date':
+        return {name: np.array(values, dtype='datetime64[D]')}
+    elif kind == 'time':
+        arrays[name] = np.array([
+            None if value is None else timedelta(
+                hours=value.hour, minutes=value.minute, seconds=value.second, microseconds=value.microsecond
+            )
+            for value in values
+        ], dtype='timedelta64[us]')
+        return arrays
+    elif kind == 'json':
+        arrays[name] = np.array(['' if value is None else json.dumps(value) for value in values], dtype=str)
+    else:
+        arrays[name] = np.array(['' if value is None else str(value) for value in values], dtype=str)
+    if column['nullable'] and kind != 'float':
+        arrays[f'{name}__null'] = np.array(nulls, dtype=bool)
+    return arrays
+
+
+def decode_column(column, arrays):
+    """Python values (Decimal, aware datetime, None, ...) for one column of a partition"""
+    name, kind = column['name'], column['type']
+    data = arrays[name]
+    if kind == 'category':
+        categories = arrays[f'{name}__categories'].tolist()
+        return [None if code < 0 else categories[code] for code in data.tolist()]
+    if kind in ('datetime', 'date'):
+        values = data.tolist()
+        if kind == 'datetime':
+            values = [value and value.replace(tzinfo=dt_timezone.utc) for value in values]
+        return values
+    if kind == 'time':
+        return [None if value is None else (datetime.min + value).time() for value in data.tolist()]
+    if kind == 'float':
+        return [None if np.isnan(value) else value for value in data.tolist()]
+    if kind == 'decimal':
+        values = [Decimal(value).scaleb(-column['scale']) for value in data.tolist()]
+    elif kind == 'json':
+        values = [json.loads(value) if value else None for value in data.tolist()]
+    else:
+        values = data.tolist()
+    nulls = arrays.get(f'{name}__null')
+    if nulls is not None:
+        values = [None if null else value for value, null in zip(values, nulls.tolist())]
+    return values
+
+
+# Manifest
+
+def read_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {'tables': {}}
+    with open(path) as manifest:
+        return json.load(manifest)
+
+
+def _write_atomic(path, write):
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as output:
+        write(output)
+    os.replace(temporary, path)
+
+
+def _write_manifest(directory, manifest):
+    _write_atomic(
+        os.path.join(directory, MANIFEST),
+        lambda output: output.write(json.dumps(manifest, indent=2).encode())
+    )
+
+
+def _parse_watermark(value, field):
+    if value is None or field is None:
+        return value
+    return datetime.fromisoformat(value)
+
+
+def _remove(directory, names):
+    for name in names:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+
+# Export
+
+def _chunks(model, field, watermark, last_pk, chunk_size):
+    """Rows after (watermark, pk) in keyset order, ``chunk_size`` at a time"""
+    attnames = [f.attname for f in model._meta.concrete_fields]
+    order = [field, 'pk'] if field else ['pk']
+    while True:
+        queryset = model._default_manager.order_by(*order)
+        if field and watermark is not None:
+            queryset = queryset.filter(Q(**{f'{field}__gt': watermark}) | Q(**{field: watermark, 'pk__gt': last_pk}))
+        elif last_pk is not None:
+            queryset = queryset.filter(pk__gt=last_pk)
+        rows = list(queryset.values_list(*attnames)[:chunk_size])
+        if not rows:
+            return
+        last = dict(zip(attnames, rows[-1]))
+        watermark, last_pk = (last[field] if field else None), last[model._meta.pk.attname]
+        yield rows, watermark, last_pk
+        if len(rows) < chunk_size:
+            return
+
+
+def _write_partition(directory, table, columns, rows, run, number):
+    arrays = {}
+    for column, values in zip(columns, zip(*rows)):
+        arrays.update(encode_column(column, list(values)))
+    name = f'{table}/part-{run}-{number:05d}.npz'
+    _write_atomic(os.path.join(directory, name), lambda output: np.savez_compressed(output, **arrays))
+    return {'file': name, 'rows': len(rows)}
+
+
+def _export_incremental(directory, model, state, manifest, chunk_size, run):
+    table, field = model._meta.db_table, state['watermark_field']
+    exported = 0
+    chunks = _chunks(model, field, _parse_watermark(state['watermark'], field), state['last_pk'], chunk_size)
+    for number, (rows, watermark, last_pk) in enumerate(chunks):
+        state['partitions'].append(_write_partition(directory, table, state['columns'], rows, run, number))
+        state['watermark'] = watermark.isoformat()
+        state['last_pk'] = last_pk
+        # Saved after every partition, so an interrupted run resumes where it stopped
+        _write_manifest(directory, manifest)
+        exported += len(rows)
+
+    # The current keys, so readers can drop deleted rows
+    ids = np.array(model._default_manager.order_by('pk').values_list('pk', flat=True), dtype=np.int64)
+    name = f'{table}/ids-{run}.npy'
+    _write_atomic(os.path.join(directory, name), lambda output: np.save(output, ids))
+    previous, state['ids'] = state.get('ids'), name
+    _write_manifest(directory, manifest)
+    if previous and previous != name:
+        _remove(directory, [previous])
+    return exported
+
+
+def _export_snapshot(directory, model, state, manifest, chunk_size, run):
+    table = model._meta.db_table
+    # Partitions of a snapshot an earlier run did not finish
+    _remove(directory, [partition['file'] for partition in state.pop('pending', [])])
+    state['pending'] = []
+    exported = 0
+    for number, (rows, _, _) in enumerate(_chunks(model, None, None, None, chunk_size)):
+        state['pending'].append(_write_partition(directory, table, state['columns'], rows, run, number))
+        _write_manifest(directory, manifest)
+        exported += len(rows)
+    previous, state['partitions'] = state['partitions'], state.pop('pending')
+    _write_manifest(directory, manifest)
+    _remove(directory, [partition['file'] for partition in previous])
+    return exported
+
+
+def export_table(directory, model, manifest, chunk_size=CHUNK_SIZE, run=None):
+    """Export one model as its mode requires (see the module docstring); returns the number of rows written"""
+    table = model._meta.db_table
+    field = watermark_field(model)
+    mode = 'incremental' if field else 'snapshot'
+    state = manifest['tables'].setdefault(table, {'partitions': [], 'watermark': None, 'last_pk': None})
+    if state.get('mode', mode) != mode or state.get('watermark_field', field) != field:
+        # Exported another way before; start this table over
+        _remove(directory, [partition['file'] for partition in state['partitions'] + state.pop('pending', [])])
+        _remove(directory, [state.pop('ids')] if state.get('ids') else [])
+        state.update(partitions=[], watermark=None, last_pk=None)
+    state.update(
+        model=model._meta.label, mode=mode, watermark_field=field,
+        pk=model._meta.pk.attname, columns=table_schema(model)
+    )
+    os.makedirs(os.path.join(directory, table), exist_ok=True)
+
+    run = run or timezone.now().strftime(RUN_FORMAT)
+    if field:
+        return _export_incremental(directory, model, state, manifest, chunk_size, run)
+    return _export_snapshot(directory, model, state, manifest, chunk_size, run)
+
+
+def export_all(directory, chunk_size=CHUNK_SIZE, models=None):
+    """Export every ``core`` table; returns ``{db_table: rows written}``"""
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory)
+    if models is None:
+        models = apps.get_app_config('core').get_models(include_auto_created=True)
+    run = timezone.now().strftime(RUN_FORMAT)
+    counts = {}
+    for model in models:
+        counts[model._meta.db_table] = export_table(directory, model, manifest, chunk_size, run)
+    _write_manifest(directory, manifest)
+    return counts
+
+
+def read_table(directory, table):
+    """
+    The current rows of a table as ``{column: [python values]}``.
+
+    For incremental tables only the last exported copy of each row is
+    kept, and rows deleted since are dropped.
+    """
+    state = read_manifest(directory)['tables'][table]
+    result = {column['name']: [] for column in state['columns']}
+    for partition in state['partitions']:
+        with np.load(os.path.join(directory, partition['file'])) as arrays:
+            for column in state['columns']:
+                if column['name'] in arrays:
+                    result[column['name']] += decode_column(column, arrays)
+                else:
+                    # Added by a migration after this partition was written
+                    result[column['name']] += [None] * partition['rows']
+    if state.get('ids'):
+        live = set(np.load(os.path.join(directory, state['ids'])).tolist())
+        latest = {pk: position for position, pk in enumerate(result[state['pk']])}
+        keep = sorted(position for pk, position in latest.items() if pk in live)
+        result = {name: [values[position] for position in keep] for name, values in result.items()}
+    return result
@@ -0,0 +1,157 @@
+"""
+Staff coverage index: who is on duty, and which shifts are short.
+
+Each local day has one cache entry mapping ``(shift_type, role)`` to the
+staff rostered on that shift who are on duty and those marked absent or
+on leave in ``Attendance``. The minimum per shift and role (the roster's
+ward-based requirements) is cached under its own key. "Who is on duty
+now" and "gaps for the next 7 days" are dictionary lookups in entries
+fetched with one ``get_many()``, so dashboards do not query shifts or
+attendance.
+
+Entries are rebuilt incrementally: saving or deleting a ``Shift`` or
+``Attendance`` row rebuilds the entries of its days (the old one too
+when it moved) after the transaction commits, with two queries for any
+number of days. Bulk writes from ``roster.generate_roster()`` and
+``attendance.mark()`` do the same for the days they wrote, and ward
+changes drop the cached minimums. A missing entry (cold or evicted
+cache) is built on first read. Entries expire after ``COVERAGE_TTL``
+seconds, which bounds how long two overlapping rebuilds can leave one
+stale.
+
+The rebuild only reaches the cache of the process that made the write.
+With no ``CACHES`` configured Django uses the per-process local-memory
+cache, so other workers keep serving their own entries until
+``COVERAGE_TTL`` runs out. Deployments with several workers should point
+``CACHES`` at a shared backend (database, Redis or Memcached) to see
+changes straight away.
+"""
+from collections import defaultdict
+from datetime import date, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from . import roster
+from .models import Attendance, Shift
+
+REQUIRED_KEY = 'coverage:required'
+OFF_DUTY = ('absent', 'leave')
+
+
+def _key(day):
+    return f'coverage:{day.isoformat()}'
+
+
+def _timeout():
+    return getattr(settings, 'COVERAGE_TTL', 300)
+
+
+def _name(first_name, last_name, username):
+    return f'{first_name} {last_name}'.strip() or username
+
+
+def current_shift(now=None):
+    """``(local date, shift type)`` of the shift running at ``now``; a night belongs to the day it starts"""
+    now = timezone.localtime(now)
+    moment = now.time()
+    for shift_type, (start, end) in roster.SHIFT_TIMES.items():
+        if start <= moment < end or (end <= start and moment >= start):
+            return now.date(), shift_type
+        if end <= start and moment < end:
+            return now.date() - timedelta(days=1), shift_type
+
+
+def build(days):
+    """
+    Entries for ``days`` from the database, in two queries.
+
+    Returns ``{day: {(shift_type, role): {'on_duty': [names], 'absent':
+    [names]}}}``.
+    """
+    days = sorted(days)
+    entries = {day: defaultdict(lambda: {'on_duty': [], 'absent': []}) for day in days}
+    away = set(Attendance.objects.filter(date__in=days, status__in=OFF_DUTY).values_list('user_id', 'date'))
+    for user_id, day, shift_type, role, first_name, last_name, username in Shift.objects.filter(
+        shift_date__in=days, user__profile__isnull=False
+    ).order_by('user__first_name', 'user__last_name', 'user_id').values_list(
+        'user_id', 'shift_date', 'shift_type', 'user__profile__role',
+        'user__first_name', 'user__last_name', 'user__username'
+    ):
+        cell = entries[day][shift_type, role]
+        cell['absent' if (user_id, day) in away else 'on_duty'].append(_name(first_name, last_name, username))
+    return {day: dict(cells) for day, cells in entries.items()}
+
+
+def refresh(days):
+    """Rebuild and cache the entries for ``days``"""
+    if days:
+        cache.set_many({_key(day): entry for day, entry in build(days).items()}, _timeout())
+
+
+def days_changed(days):
+    """Rebuild the entries for ``days`` once the current transaction commits"""
+    days = {day if isinstance(day, date) else date.fromisoformat(str(day)) for day in days if day}
+    if days:
+        transaction.on_commit(lambda: refresh(days))
+
+
+def requirements_changed():
+    transaction.on_commit(lambda: cache.delete(REQUIRED_KEY))
+
+
+def entries(days):
+    """Cached entries for ``days``, building any that are missing"""
+    keys = {_key(day): day for day in days}
+    found = cache.get_many(list(keys) + [REQUIRED_KEY])
+    required = found.pop(REQUIRED_KEY, None)
+    if required is None:
+        required = {
+            (roster.SHIFT_TYPES[code - 1], role): count for (code, role), count in roster.requirements().items()
+        }
+        cache.set(REQUIRED_KEY, required, _timeout())
+    missing = [day for key, day in keys.items() if key not in found]
+    if missing:
+        built = build(missing)
+        cache.set_many({_key(day): entry for day, entry in built.items()}, _timeout())
+        found.update({_key(day): entry for day, entry in built.items()})
+    return {day: found[key] for key, day in keys.items()}, required
+
+
+def _row(entry, required, shift_type, role):
+    cell = entry.get((shift_type, role), {'on_duty': [], 'absent': []})
+    minimum = required.get((shift_type, role), 0)
+    return {
+        'role': role,
+        'on_duty': cell['on_duty'],
+        'absent': cell['absent'],
+        'required': minimum,
+        'missing': max(minimum - len(cell['on_duty']), 0),
+    }
+
+
+def on_duty(now=None):
+    """The running shift's date, type and one row per rostered role with who is on duty and what is missing"""
+    day, shift_type = current_shift(now)
+    found, required = entries([day])
+    return {
+        'day': day,
+        'shift_type': shift_type,
+        'label': dict(Shift.SHIFT_CHOICES)[shift_type],
+        'rows': [_row(found[day], required, shift_type, role) for role in roster.ROLES],
+    }
+
+
+def gaps(start=None, days=7):
+    """Shifts short of their minimum from ``start`` (today) for ``days`` days, as rows with ``day`` and ``shift_type``"""
+    start = start or timezone.localdate()
+    found, required = entries([start + timedelta(days=offset) for offset in range(days)])
+    result = []
+    for day, entry in found.items():
+        for shift_type in roster.SHIFT_TYPES:
+            for role in roster.ROLES:
+                row = _row(entry, required, shift_type, role)
+                if row['missing']:
+                    row.update(day=day, shift_type=shift_type)
+                    result.append(row)
+    return result
@@ -0,0 +1,138 @@
+"""
+Reorder point forecasting from dispensing history.
+
+Daily dispensed quantities for the whole catalogue are read with one
+aggregated query into a dense (medicines x days) NumPy array. A
+moving-average demand level, day-of-week seasonality and demand
+variability are then computed for every medicine in a single
+vectorized pass and turned into suggested reorder points and order
+quantities.
+"""
+import numpy as np
+from datetime import datetime, time, timedelta
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .models import Medicine, PrescriptionItem
+from . import stock_alerts
+
+HISTORY_DAYS = 730
+MOVING_AVERAGE_DAYS = 28
+LEAD_TIME_DAYS = 7
+REVIEW_PERIOD_DAYS = 30
+# z-score for a ~95% cycle service level
+SERVICE_LEVEL_Z = 1.65
+
+
+def load_daily_demand(history_days=HISTORY_DAYS, end_date=None):
+    """
+    Return ``(medicine_ids, start_date, demand)`` where ``demand`` is a
+    float32 (medicines x days) array of dispensed units, oldest day first.
+    """
+    end_date = end_date or timezone.localdate()
+    start_date = end_date - timedelta(days=history_days - 1)
+    # Bound on raw datetimes rather than __date so the index stays usable
+    window_start = timezone.make_aware(datetime.combine(start_date, time.min))
+    window_end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min))
+    medicine_ids = np.array(Medicine.objects.order_by('pk').values_list('pk', flat=True), dtype=np.int64)
+
+    rows = list(PrescriptionItem.objects.filter(
+        prescription__status='dispensed',
+        prescription__dispensed_date__gte=window_start,
+        prescription__dispensed_date__lt=window_end
+    ).annotate(
+        day=TruncDate('prescription__dispensed_date')
+    ).values_list('medicine_id', 'day').annotate(units=Sum('quantity')).order_by())
+
+    demand = np.zeros((len(medicine_ids), history_days), dtype=np.float32)
+    if rows:
+        ids, days, units = zip(*rows)
+        row_index = np.searchsorted(medicine_ids, np.array(ids, dtype=np.int64))
+        day_index = (np.array(days, dtype='datetime64[D]') - np.datetime64(start_date, 'D')).astype(np.int64)
+        np.add.at(demand, (row_index, day_index), np.array(units, dtype=np.float32))
+    return medicine_ids, start_date, demand
+
+
+def forecast_reorder_points(demand, start_date, lead_time=LEAD_TIME_DAYS,
+                            review_period=REVIEW_PERIOD_DAYS, window=MOVING_AVERAGE_DAYS,
+                            z=SERVICE_LEVEL_Z):
+    """
+    Vectorized forecast over a (medicines x days) demand array.
+
+    Returns ``(daily_forecast, reorder_points, order_quantities)``, one
+    entry per medicine.
+    """
+    n_days = demand.shape[1]
+    window = min(window, n_days)
+    weekdays = (start_date.weekday() + np.arange(n_days)) % 7
+
+    # Day-of-week seasonal index: mean demand on each weekday relative
+    # to the overall mean. Medicines with no history stay flat at 1.
+    one_hot = np.zeros((n_days, 7), dtype=np.float32)
+    one_hot[np.arange(n_days), weekdays] = 1.0
+    weekday_means = (demand @ one_hot) / np.maximum(one_hot.sum(axis=0), 1)
+    overall_mean = demand.mean(axis=1, keepdims=True)
+    seasonal = np.divide(weekday_means, overall_mean,
+                         out=np.ones_like(weekday_means), where=overall_mean > 0)
+
+    # Deseasonalized moving-average level over the recent window
+    recent = demand[:, -window:]
+    recent_factor = seasonal[:, weekdays[-window:]].mean(axis=1)
+    level = np.divide(recent.mean(axis=1), recent_factor,
+                      out=np.zeros(len(demand), dtype=np.float32), where=recent_factor > 0)
+
+    # Expected demand over the upcoming lead time and review period
+    def horizon_factor(days):
+        upcoming = (weekdays[-1] + 1 + np.arange(days)) % 7
+        return seasonal[:, upcoming].sum(axis=1)
+
+    lead_time_demand = level * horizon_factor(lead_time)
+    review_demand = level * horizon_factor(review_period)
+
+    safety_stock = z * recent.std(axis=1) * np.sqrt(lead_time)
+    reorder_points = np.ceil(lead_time_demand + safety_stock).astype(np.int64)
+    order_quantities = np.ceil(review_demand).astype(np.int64)
+    return level * seasonal.mean(axis=1), reorder_points, order_quantities
+
+
+def update_reorder_suggestions(history_days=HISTORY_DAYS, apply=False, **options):
+    """
+    Forecast the whole catalogue and store the suggestions on each medicine.
+
+    With ``apply=True`` the suggested reorder point also replaces
+    ``reorder_level``, except for medicines with nothing dispensed in the
+    history window, whose configured level is kept. Returns the number
+    of medicines updated.
+    """
+    medicine_ids, start_date, demand = load_daily_demand(history_days)
+    if not len(medicine_ids):
+        return 0
+    _, reorder_points, order_quantities = forecast_reorder_points(demand, start_date, **options)
+
+    now = timezone.now()
+    medicines = [
+        Medicine(
+            pk=int(pk),
+            suggested_reorder_level=int(point),
+            suggested_reorder_quantity=int(quantity),
+            forecast_updated_at=now,
+            updated_at=now
+        )
+        for pk, point, quantity in zip(medicine_ids, reorder_points, order_quantities)
+    ]
+    fields = ['suggested_reorder_level', 'suggested_reorder_quantity', 'forecast_updated_at', 'updated_at']
+    if apply:
+        # A zero forecast from no history says nothing; keep the configured level
+        dispensed = demand.sum(axis=1) > 0
+        applied = [medicine for medicine, has_history in zip(medicines, dispensed) if has_history]
+        for medicine in applied:
+            medicine.reorder_level = medicine.suggested_reorder_level
+
+    with transaction.atomic():
+        Medicine.objects.bulk_update(medicines, fields, batch_size=500)
+        if apply:
+            Medicine.objects.bulk_update(applied, ['reorder_level'], batch_size=500)
+            # bulk_update skips post_save, so low-stock alerts are re-evaluated here
+            stock_alerts.rebuild_alerts()
+    return len(medicines)
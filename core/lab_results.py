@@ -0,0 +1,359 @@
+"""
+Structured lab results and abnormal-result flagging.
+
+``LabTest.normal_range`` stays free text for display, and is parsed into
+``LabReferenceRange`` rows with numeric bounds. A range can be limited to
+one sex and an age band, and critical limits can be given alongside, e.g.::
+
+    M: 13.5-17.5 g/dL; F: 12.0-15.5 g/dL; Child (1-12y): 11-13.5 g/dL
+    70-110 mg/dL; Critical: <40, >400
+    <200 mg/dL
+
+Each saved request gets a numeric result (entered, or the first number in
+the result text) and a flag from the most specific matching range. The
+historical re-flag job does the same matching over NumPy arrays.
+"""
+import re
+import numpy as np
+from decimal import Decimal, InvalidOperation
+from django.db import transaction
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .models import LabReferenceRange, LabTest, LabTestRequest, Patient
+
+NUMBER = r'\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d*\.\d+|\d+'
+
+SEGMENT_SPLIT_RE = re.compile(r'[;\n|]+|,\s+(?=[A-Za-z])')
+BETWEEN_RE = re.compile(rf'^(?P<low>{NUMBER})\s*(?:-|–|—|to)\s*(?P<high>{NUMBER})\s*(?P<unit>.*)$', re.I)
+UPPER_RE = re.compile(rf'^(?:<=?|≤|up\s*to|below|less\s+than)\s*(?P<high>{NUMBER})\s*(?P<unit>.*)$', re.I)
+LOWER_RE = re.compile(rf'^(?:>=?|≥|above|over|more\s+than|greater\s+than)\s*(?P<low>{NUMBER})\s*(?P<unit>.*)$', re.I)
+CRITICAL_RE = re.compile(rf'(?P<op>[<>≤≥])=?\s*(?P<value>{NUMBER})')
+RESULT_NUMBER_RE = re.compile(rf'(?<![\d.,])-?(?:{NUMBER})')
+
+YEARS = r'\s*(?:y|yr|yrs|years?)\b'
+AGE_BAND_RE = re.compile(rf'(\d+)\s*(?:-|–|to)\s*(\d+){YEARS}', re.I)
+AGE_UNDER_RE = re.compile(rf'(?:<|under|below)\s*(\d+){YEARS}', re.I)
+AGE_OVER_RE = re.compile(rf'(>=|≥|>|over|above)\s*(\d+){YEARS}|(\d+)\s*\+{YEARS}', re.I)
+
+SEX_WORDS = {
+    'm': 'M', 'male': 'M', 'males': 'M', 'man': 'M', 'men': 'M',
+    'f': 'F', 'female': 'F', 'females': 'F', 'woman': 'F', 'women': 'F',
+}
+# Age bands implied by a word: (min_age, max_age)
+AGE_WORDS = {
+    'adult': (18, None), 'adults': (18, None), 'elderly': (65, None),
+    'child': (None, 18), 'children': (None, 18), 'pediatric': (None, 18), 'paediatric': (None, 18),
+    'infant': (None, 1), 'newborn': (None, 1), 'neonate': (None, 1),
+}
+CRITICAL_WORDS = {'critical', 'panic'}
+
+RESULT_LIMIT = Decimal('1e8')
+
+
+def _number(text):
+    return Decimal(text.replace(',', ''))
+
+
+def _words(text):
+    return re.findall(r'[a-z]+', text.lower())
+
+
+def _split_qualifier(segment):
+    """Split "M: 13-17 g/dL" or "Male 13-17 g/dL" into qualifier and range text"""
+    if ':' in segment:
+        qualifier, expression = segment.rsplit(':', 1)
+        return qualifier.strip(), expression.strip()
+    qualifier = []
+    tokens = segment.split()
+    while tokens and tokens[0].strip('(),').lower() in SEX_WORDS.keys() | AGE_WORDS.keys() | CRITICAL_WORDS:
+        qualifier.append(tokens.pop(0))
+    return ' '.join(qualifier), ' '.join(tokens)
+
+
+def _parse_qualifier(qualifier):
+    sex, min_age, max_age = '', None, None
+    for word in _words(qualifier):
+        if word in SEX_WORDS:
+            sex = SEX_WORDS[word]
+        elif word in AGE_WORDS:
+            min_age, max_age = AGE_WORDS[word]
+
+    band = AGE_BAND_RE.search(qualifier)
+    under = AGE_UNDER_RE.search(qualifier)
+    over = AGE_OVER_RE.search(qualifier)
+    if band:
+        min_age, max_age = int(band.group(1)), int(band.group(2)) + 1
+    elif under:
+        min_age, max_age = None, int(under.group(1))
+    elif over:
+        if over.group(3):
+            min_age = int(over.group(3))
+        else:
+            min_age = int(over.group(2)) + (over.group(1) in ('>', 'over', 'above'))
+        max_age = None
+    return sex, min_age, max_age
+
+
+def parse_normal_range(text):
+    """
+    Parse a free-text normal range into a list of range dicts.
+
+    Each dict has ``sex``, ``min_age``, ``max_age``, ``low``, ``high``,
+    ``critical_low``, ``critical_high`` and ``unit``. Critical limits
+    apply to every range of the test. Unrecognised segments are ignored,
+    so text that cannot be parsed yields an empty list.
+    """
+    ranges = []
+    critical_low = critical_high = None
+    for segment in SEGMENT_SPLIT_RE.split(text or ''):
+        segment = segment.strip()
+        if not segment:
+            continue
+        qualifier, expression = _split_qualifier(segment)
+
+        if CRITICAL_WORDS & set(_words(qualifier)) or CRITICAL_WORDS & set(_words(expression)):
+            for match in CRITICAL_RE.finditer(expression):
+                if match.group('op') in '<≤':
+                    critical_low = _number(match.group('value'))
+                else:
+                    critical_high = _number(match.group('value'))
+            continue
+
+        match = BETWEEN_RE.match(expression) or UPPER_RE.match(expression) or LOWER_RE.match(expression)
+        if not match:
+            continue
+        bounds = match.groupdict()
+        sex, min_age, max_age = _parse_qualifier(qualifier)
+        ranges.append({
+            'sex': sex,
+            'min_age': min_age,
+            'max_age': max_age,
+            'low': _number(bounds['low']) if bounds.get('low') else None,
+            'high': _number(bounds['high']) if bounds.get('high') else None,
+            'unit': bounds['unit'].strip(' .,()')[:30],
+        })
+
+    for reference in ranges:
+        reference['critical_low'] = critical_low
+        reference['critical_high'] = critical_high
+    return ranges
+
+
+def parse_numeric_result(text):
+    """First number in a free-text result, or None"""
+    match = RESULT_NUMBER_RE.search(text or '')
+    if not match:
+        return None
+    try:
+        value = _number(match.group())
+    except InvalidOperation:
+        return None
+    if abs(value) >= RESULT_LIMIT:
+        return None
+    return value.quantize(Decimal('0.0001'))
+
+
+def sync_reference_ranges(test):
+    """Replace a test's reference ranges with those parsed from its normal_range"""
+    with transaction.atomic():
+        LabReferenceRange.objects.filter(test=test).delete()
+        LabReferenceRange.objects.bulk_create([
+            LabReferenceRange(test=test, **reference)
+            for reference in parse_normal_range(test.normal_range)
+        ])
+
+
+def sync_all_reference_ranges():
+    for test in LabTest.objects.only('normal_range'):
+        sync_reference_ranges(test)
+    return LabReferenceRange.objects.count()
+
+
+def age_on(date_of_birth, on_date):
+    """Age in whole years"""
+    return on_date.year - date_of_birth.year - (
+        (on_date.month, on_date.day) < (date_of_birth.month, date_of_birth.day)
+    )
+
+
+def _specificity(reference):
+    # An age band outranks a sex-only range, so paediatric ranges win for children
+    return 2 * (reference.min_age is not None) + 2 * (reference.max_age is not None) + bool(reference.sex)
+
+
+def select_range(ranges, sex, age):
+    """The most specific range matching a patient; ties go to the lowest pk"""
+    candidates = [
+        reference for reference in ranges
+        if reference.sex in ('', sex)
+        and (reference.min_age is None or age >= reference.min_age)
+        and (reference.max_age is None or age < reference.max_age)
+    ]
+    return min(candidates, key=lambda reference: (-_specificity(reference), reference.pk), default=None)
+
+
+def classify(value, reference):
+    if (reference.critical_low is not None and value < reference.critical_low) or (
+        reference.critical_high is not None and value > reference.critical_high
+    ):
+        return 'critical'
+    if reference.low is not None and value < reference.low:
+        return 'low'
+    if reference.high is not None and value > reference.high:
+        return 'high'
+    return 'normal'
+
+
+def flag_request(lab_request):
+    """
+    Fill in the numeric result, unit and flag of a request before it is saved.
+
+    The numeric result is taken from the result text when none was entered.
+    """
+    if lab_request.numeric_result is None:
+        lab_request.numeric_result = parse_numeric_result(lab_request.result)
+    if lab_request.numeric_result is None:
+        lab_request.flag = ''
+        return
+
+    sex, date_of_birth = Patient.objects.filter(
+        pk=lab_request.patient_id
+    ).values_list('gender', 'date_of_birth').get()
+    on_date = timezone.localdate(lab_request.requested_date) if lab_request.requested_date else timezone.localdate()
+    reference = select_range(
+        list(LabReferenceRange.objects.filter(test_id=lab_request.test_id)),
+        sex,
+        age_on(date_of_birth, on_date)
+    )
+    if reference is None:
+        lab_request.flag = ''
+        lab_request.result_unit = ''
+        return
+    lab_request.flag = classify(Decimal(lab_request.numeric_result), reference)
+    lab_request.result_unit = reference.unit
+
+
+# Vectorized re-flagging
+
+def ages_in_years(births, on_dates):
+    """Whole-year ages for two datetime64[D] arrays"""
+    def split(days):
+        years = days.astype('datetime64[Y]').astype(np.int64) + 1970
+        months = days.astype('datetime64[M]').astype(np.int64) % 12 + 1
+        day_of_month = (days - days.astype('datetime64[M]')).astype(np.int64) + 1
+        return years, months * 100 + day_of_month
+
+    birth_years, birth_days = split(births)
+    years, month_days = split(on_dates)
+    return years - birth_years - (month_days < birth_days)
+
+
+def _bound(value):
+    return np.nan if value is None else float(value)
+
+
+def assign_reference_ranges(test_ids, sexes, ages, ranges):
+    """
+    Match every result row to its most specific reference range.
+
+    Returns ``(bounds, matched)``: a float (rows x 4) array of low, high,
+    critical low and critical high (NaN where absent), and the index into
+    ``ranges`` of each row's range, -1 where none applies. Ranges are
+    applied least specific first so more specific ones overwrite them,
+    each touching only the rows of its own test.
+    """
+    bounds = np.full((len(test_ids), 4), np.nan)
+    matched = np.full(len(test_ids), -1, dtype=np.int64)
+    order = np.argsort(test_ids, kind='stable')
+    sorted_tests = test_ids[order]
+
+    for index in sorted(range(len(ranges)), key=lambda i: (_specificity(ranges[i]), -ranges[i].pk)):
+        reference = ranges[index]
+        start, stop = np.searchsorted(sorted_tests, [reference.test_id, reference.test_id + 1])
+        rows = order[start:stop]
+        if reference.sex:
+            rows = rows[sexes[rows] == reference.sex]
+        if reference.min_age is not None:
+            rows = rows[ages[rows] >= reference.min_age]
+        if reference.max_age is not None:
+            rows = rows[ages[rows] < reference.max_age]
+        bounds[rows] = [
+            _bound(reference.low), _bound(reference.high),
+            _bound(reference.critical_low), _bound(reference.critical_high)
+        ]
+        matched[rows] = index
+    return bounds, matched
+
+
+def compute_flags(values, bounds, matched):
+    low, high, critical_low, critical_high = bounds.T
+    # Comparisons against NaN are False, so missing bounds never trigger
+    return np.select(
+        [matched < 0, (values < critical_low) | (values > critical_high), values < low, values > high],
+        ['', 'critical', 'low', 'high'],
+        default='normal'
+    )
+
+
+def _backfill_numeric_results(chunk_size):
+    pending = LabTestRequest.objects.filter(numeric_result__isnull=True).exclude(result='')
+    updates = []
+    for pk, result in pending.values_list('pk', 'result').iterator(chunk_size=chunk_size):
+        value = parse_numeric_result(result)
+        if value is not None:
+            updates.append(LabTestRequest(pk=pk, numeric_result=value))
+    LabTestRequest.objects.bulk_update(updates, ['numeric_result'], batch_size=500)
+    return len(updates)
+
+
+def reflag_results(chunk_size=2000):
+    """
+    Re-flag every stored result against the current reference ranges.
+
+    Numeric results missing from older rows are parsed from the result
+    text first. Matching and flagging then run over NumPy arrays for all
+    results at once and only rows whose flag or unit changed are written.
+    Returns ``(checked, changed)``.
+    """
+    with transaction.atomic():
+        _backfill_numeric_results(chunk_size)
+        cleared = LabTestRequest.objects.filter(numeric_result__isnull=True).exclude(flag='').update(
+            flag='', result_unit=''
+        )
+
+        rows = list(LabTestRequest.objects.filter(
+            numeric_result__isnull=False
+        ).annotate(
+            on_date=TruncDate('requested_date')
+        ).values_list(
+            'pk', 'test_id', 'patient__gender', 'patient__date_of_birth', 'on_date',
+            'numeric_result', 'flag', 'result_unit'
+        ))
+        if not rows:
+            return 0, cleared
+
+        pks, test_ids, sexes, births, on_dates, values, old_flags, old_units = zip(*rows)
+        ages = ages_in_years(np.array(births, dtype='datetime64[D]'), np.array(on_dates, dtype='datetime64[D]'))
+        ranges = list(LabReferenceRange.objects.all())
+        bounds, matched = assign_reference_ranges(
+            np.array(test_ids, dtype=np.int64), np.array(sexes), ages, ranges
+        )
+        flags = compute_flags(np.array(values, dtype=np.float64), bounds, matched)
+        # Index -1 picks the trailing '' for rows without a range
+        units = np.array([reference.unit for reference in ranges] + [''], dtype=object)[matched]
+
+        changed = np.nonzero((flags != np.array(old_flags)) | (units != np.array(old_units, dtype=object)))[0]
+        LabTestRequest.objects.bulk_update(
+            [LabTestRequest(pk=pks[i], flag=str(flags[i]), result_unit=units[i]) for i in changed],
+            ['flag', 'result_unit'],
+            batch_size=500
+        )
+    return len(rows), len(changed) + cleared
+
+
+def abnormal_results(doctor):
+    """Abnormal results of a doctor's lab requests, newest first"""
+    return LabTestRequest.objects.filter(
+        doctor=doctor,
+        flag__in=LabTestRequest.ABNORMAL_FLAGS
+    ).select_related('patient', 'test').order_by('-completed_date')
@@ -0,0 +1,185 @@
+"""
+Laboratory worklist.
+
+Pending ``LabTestRequest`` rows form one queue per test type, worked in
+priority order and then oldest request first. A technician takes a
+request with a conditional ``pending -> in_progress`` update that also
+records them as the technician, so two technicians can never claim the
+same sample: whichever update lands second matches no row.
+
+Orders are entered in one go: any mix of individual tests and
+predefined panels becomes one ``LabTestRequest`` per test, inserted with
+a single ``bulk_create`` under a shared order number and priced from
+``LabTest.price`` at the time of ordering.
+"""
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+from .models import LabPanel, LabTest, LabTestRequest
+
+# Queue heads read per round trip in claim_next()
+CLAIM_ATTEMPTS = 5
+
+
+class LabError(Exception):
+    pass
+
+
+class RequestNotPending(LabError):
+    pass
+
+
+class NotClaimedByUser(LabError):
+    pass
+
+
+def create_order(order_number, patient_id, doctor_id, test_ids=(), panel_ids=(), priority=3):
+    """
+    Create one request per test for the given tests and panels.
+
+    A test ordered both on its own and as part of a panel is requested
+    once. Panel membership and test prices are each read with a single
+    query and the requests are inserted with one ``bulk_create``, so the
+    query count does not depend on the size of the order.
+    """
+    test_ids = [int(pk) for pk in test_ids]
+    panel_ids = [int(pk) for pk in panel_ids]
+
+    # test -> panel it was ordered through (None when ordered directly)
+    ordered = dict.fromkeys(test_ids)
+    for panel_id, test_id in LabPanel.tests.through.objects.filter(
+        labpanel_id__in=panel_ids
+    ).order_by('labpanel_id', 'labtest_id').values_list('labpanel_id', 'labtest_id'):
+        ordered.setdefault(test_id, panel_id)
+    if not ordered:
+        raise LabError('Select at least one test or panel.')
+
+    prices = dict(LabTest.objects.filter(pk__in=ordered).values_list('pk', 'price'))
+    missing = ordered.keys() - prices.keys()
+    if missing:
+        raise LabError(f'Unknown lab test(s): {sorted(missing)}')
+
+    requests = [
+        LabTestRequest(
+            request_number=f'{order_number}-{index}',
+            order_number=order_number,
+            patient_id=patient_id,
+            doctor_id=doctor_id,
+            test_id=test_id,
+            panel_id=panel_id,
+            price=prices[test_id],
+            priority=priority,
+            status='pending'
+        )
+        for index, (test_id, panel_id) in enumerate(ordered.items(), start=1)
+    ]
+    with transaction.atomic():
+        LabTestRequest.objects.bulk_create(requests)
+    return requests
+
+
+def lab_charges(**filters):
+    """Total price of the matching requests, leaving out cancelled ones"""
+    return LabTestRequest.objects.filter(**filters).exclude(
+        status='cancelled'
+    ).aggregate(total=Sum('price', default=0))['total']
+
+
+def worklist(test_id=None):
+    """Pending requests in queue order, optionally for a single test"""
+    queue = LabTestRequest.objects.filter(status='pending')
+    if test_id:
+        queue = queue.filter(test_id=test_id)
+    return queue.select_related('patient', 'doctor__user', 'test').order_by('priority', 'requested_date', 'pk')
+
+
+def queue_counts():
+    """Pending requests per test, from one grouped query"""
+    counts = dict(LabTestRequest.objects.filter(
+        status='pending'
+    ).values_list('test_id').annotate(total=Count('pk')).order_by())
+    tests = LabTest.objects.filter(pk__in=counts).order_by('test_name')
+    return [(test, counts[test.pk]) for test in tests]
+
+
+def claim_request(request_id, user):
+    """
+    Claim a pending request for ``user``.
+
+    Raises RequestNotPending if the request was already claimed,
+    completed or cancelled.
+    """
+    claimed = LabTestRequest.objects.filter(
+        pk=request_id,
+        status='pending'
+    ).update(status='in_progress', technician=user, claimed_date=timezone.now())
+    if not claimed:
+        raise RequestNotPending(f'Lab request {request_id} is no longer pending.')
+    return LabTestRequest.objects.get(pk=request_id)
+
+
+def claim_next(user, test_id=None):
+    """
+    Claim the request at the head of a queue.
+
+    Reads a few candidates from the head of the queue and claims the
+    first one no other technician has taken in the meantime. Returns
+    the claimed request, or None when the queue is empty.
+    """
+    candidates = LabTestRequest.objects.filter(status='pending')
+    if test_id:
+        candidates = candidates.filter(test_id=test_id)
+    head = candidates.order_by('priority', 'requested_date', 'pk').values_list('pk', flat=True)
+
+    while True:
+        request_ids = list(head[:CLAIM_ATTEMPTS])
+        if not request_ids:
+            return None
+        for request_id in request_ids:
+            try:
+                return claim_request(request_id, user)
+            except RequestNotPending:
+                continue
+
+
+def _unattended():
+    """In-progress requests nobody can finish: no technician, or one whose account was deactivated"""
+    return Q(technician__isnull=True) | Q(technician__is_active=False)
+
+
+def is_unattended(lab_request):
+    return lab_request.status == 'in_progress' and (
+        lab_request.technician_id is None or not lab_request.technician.is_active
+    )
+
+
+def take_over_request(request_id, user):
+    """Claim an unattended in-progress request for ``user``"""
+    taken = LabTestRequest.objects.filter(_unattended(), pk=request_id, status='in_progress').update(
+        technician=user, claimed_date=timezone.now()
+    )
+    if not taken:
+        raise NotClaimedByUser(f'Lab request {request_id} is assigned to another technician.')
+
+
+def release_request(request_id, user, any_technician=False):
+    """
+    Hand an in-progress request back to the queue.
+
+    Technicians can release their own requests and unattended ones;
+    ``any_technician`` (for admins) releases whoever holds it.
+    """
+    requests = LabTestRequest.objects.filter(pk=request_id, status='in_progress')
+    if not any_technician:
+        requests = requests.filter(Q(technician=user) | _unattended())
+    released = requests.update(status='pending', technician=None, claimed_date=None)
+    if not released:
+        raise NotClaimedByUser(f'Lab request {request_id} is not claimed by you.')
+
+
+def my_open_work(user):
+    """In-progress requests claimed by ``user``, read along the (technician, status) index"""
+    return LabTestRequest.objects.filter(
+        technician=user,
+        status='in_progress'
+    ).select_related('patient', 'doctor__user', 'test').order_by('priority', 'claimed_date')
@@ -0,0 +1,74 @@
+import random
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from core.census import census_rows, period_stats
+
+
+class Command(BaseCommand):
+    help = 'Time the census sweep on synthetic admissions against a per-day scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--admissions', type=int, default=1000000)
+        parser.add_argument('--wards', type=int, default=20)
+        parser.add_argument('--days', type=int, default=3650, help='Length of the admission history')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        first = date(2015, 1, 1)
+        last = first + timedelta(days=options['days'] - 1)
+        wards = options['wards']
+
+        started = time.perf_counter()
+        stays = []
+        for _ in range(options['admissions']):
+            admitted = first + timedelta(days=rng.randrange(options['days']))
+            nights = min(int(rng.expovariate(1 / 5)), 60)
+            discharged = admitted + timedelta(days=nights)
+            stays.append((rng.randrange(wards), admitted, discharged if discharged <= last else None, max(nights, 1)))
+        self.stdout.write(f'Generated {len(stays)} admission(s) in {time.perf_counter() - started:.2f} s.')
+
+        started = time.perf_counter()
+        rows = census_rows(stays)
+        self.report('Sweep into census rows', time.perf_counter() - started,
+                    f'{len(stays)} admissions, {len(rows)} rows')
+
+        by_ward = defaultdict(list)
+        for (ward_id, day), row in sorted(rows.items()):
+            by_ward[ward_id].append((day, *row))
+        window_start = last - timedelta(days=29)
+        for label, start in (('Period stats, whole history', first), ('Period stats, last 30 days', window_start)):
+            started = time.perf_counter()
+            results = {}
+            for ward_id, ward_rows in by_ward.items():
+                opening = 0
+                for row in ward_rows:
+                    if row[0] >= start:
+                        break
+                    opening = row[3]
+                results[ward_id] = period_stats(
+                    [row for row in ward_rows if row[0] >= start], start, last, opening, beds=100
+                )
+            self.report(label, time.perf_counter() - started, f'{wards} wards')
+
+        # The scan the sweep replaces: count the stays in the ward on each day
+        ward_stays = [stay for stay in stays if stay[0] == 0]
+        started = time.perf_counter()
+        bed_days = sum(
+            1
+            for offset in range(30)
+            for _, admitted, discharged, _ in ward_stays
+            if admitted <= window_start + timedelta(days=offset) and (
+                discharged is None or discharged > window_start + timedelta(days=offset)
+            )
+        )
+        elapsed = time.perf_counter() - started
+        self.report('Per-day scan, one ward, last 30 days', elapsed, f'{len(ward_stays)} stays')
+        if bed_days != results[0]['bed_days']:
+            raise CommandError(f"Sweep gave {results[0]['bed_days']} bed-days, the scan {bed_days}.")
+        self.stdout.write(self.style.SUCCESS(f'Sweep and scan agree: {bed_days} bed-days in ward 0.'))
+
+    def report(self, label, elapsed, detail):
+        self.stdout.write(f'{label}: {elapsed * 1000:.1f} ms ({detail})')
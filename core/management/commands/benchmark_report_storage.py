@@ -0,0 +1,59 @@
+import os
+import tempfile
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from core.storage import CHUNK_SIZE, ContentAddressedStorage, HashedUploadedFile, file_response
+
+
+class Command(BaseCommand):
+    help = 'Measure upload, dedup and download throughput of the content-addressed report store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb', type=int, default=500)
+
+    def handle(self, *args, **options):
+        size = options['size_mb'] * 1024 * 1024
+        block = os.urandom(CHUNK_SIZE)
+
+        with tempfile.TemporaryDirectory() as location:
+            storage = ContentAddressedStorage(location=location)
+
+            def upload():
+                # Feed the file as the upload handler would, chunk by chunk
+                started = time.perf_counter()
+                upload = HashedUploadedFile('scan.dcm', 'application/dicom', size, None,
+                                            temp_dir=storage.temp_dir)
+                for _ in range(size // CHUNK_SIZE):
+                    upload.write(block)
+                upload.file.flush()
+                name = storage.save('scan.dcm', upload)
+                upload.close()
+                return name, time.perf_counter() - started
+
+            name, elapsed = upload()
+            self.report('Upload', size, elapsed)
+            duplicate, elapsed = upload()
+            self.report('Duplicate upload (deduplicated)', size, elapsed)
+            if duplicate != name:
+                raise CommandError('Duplicate upload was not deduplicated.')
+
+            field_file = type('StoredFile', (), {'name': name, 'path': storage.path(name)})()
+            factory = RequestFactory()
+            for label, headers in (
+                ('Full download', {}),
+                ('Range download (second half)', {'Range': f'bytes={size // 2}-'}),
+            ):
+                response = file_response(factory.get('/', headers=headers), field_file)
+                started = time.perf_counter()
+                received = sum(len(chunk) for chunk in response.streaming_content)
+                elapsed = time.perf_counter() - started
+                response.close()
+                self.report(f'{label} [{response.status_code}]', received, elapsed)
+
+            blobs = sum(len(files) for path, _, files in os.walk(os.path.join(location, 'blobs'))
+                        if not path.endswith('tmp'))
+            self.stdout.write(f'{blobs} blob(s) stored for 2 uploads.')
+
+    def report(self, label, size, elapsed):
+        self.stdout.write(f'{label}: {size / 2**20:.0f} MB in {elapsed:.2f} s ({size / 2**20 / elapsed:.0f} MB/s)')
@@ -0,0 +1,70 @@
+import random
+import time
+from django.core.management.base import BaseCommand, CommandError
+from core.roster import FORBIDDEN, MAX_CONSECUTIVE_DAYS, NIGHT, OFF, Roster, ward_requirements
+
+
+class Command(BaseCommand):
+    help = 'Time the roster solver on synthetic staff, wards and leave'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--staff', type=int, default=1000)
+        parser.add_argument('--days', type=int, default=30)
+        parser.add_argument('--doctors', type=float, default=0.25, help='Share of the staff who are doctors')
+        parser.add_argument('--wards', type=int, default=24)
+        parser.add_argument('--leave', type=float, default=0.03, help='Share of staff days on leave')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        days = options['days']
+        doctors = int(options['staff'] * options['doctors'])
+        roles = ['doctor'] * doctors + ['nurse'] * (options['staff'] - doctors)
+        wards = [
+            (rng.choice(['ICU', 'Emergency', 'Private', 'General', 'General']), rng.randrange(10, 41))
+            for _ in range(options['wards'])
+        ]
+        required = ward_requirements(wards)
+        leave = {
+            (i, d) for i in range(len(roles)) for d in range(days) if rng.random() < options['leave']
+        }
+
+        roster = Roster(roles, days, required, leave)
+        started = time.perf_counter()
+        roster.greedy()
+        greedy = time.perf_counter() - started
+        short = sum(missing for *_, missing in roster.deficits())
+        self.stdout.write(f'Greedy pass: {greedy * 1000:.1f} ms, {short} staff-shift(s) short')
+
+        started = time.perf_counter()
+        repaired = roster.repair()
+        balanced = roster.balance()
+        search = time.perf_counter() - started
+        short = sum(missing for *_, missing in roster.deficits())
+        self.stdout.write(
+            f'Local search: {search * 1000:.1f} ms, {repaired} repair and {balanced} balancing move(s), '
+            f'{short} staff-shift(s) short'
+        )
+
+        # Check the rules on the result independently of the solver
+        for i, row in enumerate(roster.grid):
+            run = 0
+            for d, code in enumerate(row):
+                if (i, d) in leave and code != -1:
+                    raise CommandError(f'Staff {i} rostered on leave on day {d}.')
+                if d and (row[d - 1], code) in FORBIDDEN:
+                    raise CommandError(f'Staff {i} has too little rest before day {d}.')
+                if code == NIGHT and d >= 3 and row[d - 3:d] == [NIGHT] * 3:
+                    raise CommandError(f'Staff {i} has too many nights in a row at day {d}.')
+                run = run + 1 if code > OFF else 0
+                if run > MAX_CONSECUTIVE_DAYS:
+                    raise CommandError(f'Staff {i} works too many days in a row at day {d}.')
+        loads = {}
+        for role in ('nurse', 'doctor'):
+            counts = [roster.load[i] for i in roster.staff[role]]
+            if counts:
+                loads[role] = f'{min(counts)}-{max(counts)}'
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(roles)} staff × {days} days in {(greedy + search):.2f} s; '
+            f'{sum(roster.load)} shifts; shifts per person {loads}.'
+        ))
@@ -0,0 +1,16 @@
+from datetime import date
+from django.core.management.base import BaseCommand
+from core.billing import compose_discharge_bills
+
+
+class Command(BaseCommand):
+    help = 'Create itemized bills for every IPD discharge of a day that has not been billed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat, default=None,
+                            help='Discharge date (YYYY-MM-DD), default today')
+
+    def handle(self, *args, **options):
+        bills = compose_discharge_bills(options['date'])
+        total = sum(bill.total_amount for bill in bills)
+        self.stdout.write(self.style.SUCCESS(f'Created {len(bills)} bill(s) totalling {total:.2f}.'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from core import performance
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the doctor performance cube for days changed since the last run (run nightly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild every day')
+
+    def handle(self, *args, **options):
+        if options['full']:
+            count = performance.rebuild()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt the performance cube: {count} fact row(s).'))
+            return
+        days, count = performance.rebuild_stale()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {days} changed day(s): {count} fact row(s).'))
@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand
+from core.columnar import CHUNK_SIZE, export_all
+
+
+class Command(BaseCommand):
+    help = 'Export every core table to a columnar snapshot directory, appending changes where tables allow it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Snapshot directory; created on the first run')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help='Rows read and written per partition')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        counts = export_all(options['directory'], chunk_size=options['chunk_size'])
+        for table, count in counts.items():
+            if count:
+                self.stdout.write(f'{table}: {count} row(s)')
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {sum(counts.values())} row(s) from {len(counts)} table(s) to "
+            f"{options['directory']} in {time.perf_counter() - started:.2f} s."
+        ))
@@ -0,0 +1,33 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from core.invoices import bills_between, invoice_data, stream_invoice_zip
+from core.models import Bill
+
+
+class Command(BaseCommand):
+    help = 'Render invoice PDFs for a date range or list of bills into a zip file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Path of the zip file to write')
+        parser.add_argument('--start', type=date.fromisoformat)
+        parser.add_argument('--end', type=date.fromisoformat)
+        parser.add_argument('--ids', type=lambda value: [int(pk) for pk in value.split(',')],
+                            help='Comma-separated bill ids')
+        parser.add_argument('--workers', type=int, default=None)
+
+    def handle(self, *args, **options):
+        if options['ids']:
+            bills = Bill.objects.filter(pk__in=options['ids'])
+        elif options['start']:
+            bills = bills_between(options['start'], options['end'] or options['start'])
+        else:
+            raise CommandError('Give --start/--end or --ids.')
+
+        stats = {}
+        with open(options['output'], 'wb') as output:
+            for chunk in stream_invoice_zip(invoice_data(bills), workers=options['workers'], stats=stats):
+                output.write(chunk)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {stats['count']} invoice(s) to {options['output']} in {stats['seconds']:.2f} s "
+            f"({stats['per_second']:.0f} invoices/s)."
+        ))
@@ -0,0 +1,30 @@
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from core.roster import generate_roster
+
+
+class Command(BaseCommand):
+    help = 'Generate nurse and doctor shifts for a period, keeping shifts already rostered'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First day (YYYY-MM-DD), tomorrow by default')
+        parser.add_argument('--days', type=int, default=30)
+        parser.add_argument('--dry-run', action='store_true', help='Solve without saving the shifts')
+
+    def handle(self, *args, **options):
+        try:
+            start = date.fromisoformat(options['start']) if options['start'] else timezone.localdate() + timedelta(days=1)
+        except ValueError:
+            raise CommandError(f"Invalid start date {options['start']!r}.")
+        if options['days'] < 1:
+            raise CommandError('--days must be at least 1.')
+
+        result = generate_roster(start, options['days'], save=not options['dry_run'])
+        for day, shift_type, role, missing in result['deficits']:
+            self.stdout.write(self.style.WARNING(f'{day}: {shift_type} is {missing} {role}(s) short'))
+        verb = 'Would create' if options['dry_run'] else 'Created'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {len(result['shifts'])} shift(s) from {start} for {options['days']} day(s) "
+            f"({result['moves']} local search move(s))."
+        ))
@@ -0,0 +1,48 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from core import thumbnails
+from core.models import MedicalReport, UserProfile
+
+
+class Command(BaseCommand):
+    help = 'Render missing thumbnails and previews for profile pictures and medical reports'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None)
+
+    def handle(self, *args, **options):
+        sources = {}
+        moved = 0
+        for model, field in ((UserProfile, 'profile_picture'), (MedicalReport, 'report_file')):
+            for record in model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True}):
+                field_file = getattr(record, field)
+                if not thumbnails.content_digest(field_file):
+                    # Uploaded before the blob store: re-save it there so it gets a content hash
+                    if not field_file.storage.exists(field_file.name):
+                        continue
+                    with field_file.storage.open(field_file.name) as content:
+                        field_file.save(field_file.name.rsplit('/', 1)[-1], File(content), save=False)
+                    model.objects.filter(pk=record.pk).update(**{field: field_file.name})
+                    moved += 1
+                if all(thumbnails.thumbnail_file(field_file, size) for size in thumbnails.SIZES):
+                    continue
+                # One render per distinct content
+                sources[thumbnails.content_digest(field_file)] = field_file
+
+        started = time.perf_counter()
+        rendered = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            futures = [
+                executor.submit(thumbnails.render_thumbnails, field_file.path, thumbnails.output_dir(digest))
+                for digest, field_file in sources.items()
+            ]
+            for future in as_completed(futures):
+                rendered += bool(future.result())
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {moved} file(s) into the blob store; rendered {rendered} of {len(sources)} '
+            f'source(s) in {elapsed:.2f} s.'
+        ))
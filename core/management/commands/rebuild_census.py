@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from core.census import rebuild_census
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily ward census from the IPD records'
+
+    def handle(self, *args, **options):
+        count = rebuild_census()
+        self.stdout.write(self.style.SUCCESS(f'Wrote {count} ward census row(s).'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+from core import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text index over OPD/IPD clinical notes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError('Clinical full-text search requires the SQLite backend.')
+
+        opd_count, ipd_count = search.rebuild_index(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {opd_count} OPD and {ipd_count} IPD record(s).'
+        ))
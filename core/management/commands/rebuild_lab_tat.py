@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from core.lab_tat import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the hourly and daily lab turnaround rollups from completed requests'
+
+    def handle(self, *args, **options):
+        count = rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(f'Wrote {count} turnaround rollup row(s).'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from core.revenue import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily revenue rollups from bills and payments'
+
+    def handle(self, *args, **options):
+        count = rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(f'Wrote {count} revenue rollup row(s).'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from core.billing import reconcile_bills
+
+
+class Command(BaseCommand):
+    help = "Re-derive every bill's amount paid, balance and status from the payment ledger"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report mismatches without fixing them')
+
+    def handle(self, *args, **options):
+        mismatched = reconcile_bills(apply=not options['dry_run'])
+        for bill_number, recorded, ledger in mismatched:
+            self.stdout.write(f'{bill_number}: recorded {recorded:.2f}, ledger {ledger:.2f}')
+        action = 'found' if options['dry_run'] else 'corrected'
+        self.stdout.write(self.style.SUCCESS(f'{len(mismatched)} bill(s) {action}.'))
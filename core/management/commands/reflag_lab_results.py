@@ -0,0 +1,52 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from core.lab_results import (
+    assign_reference_ranges, compute_flags, reflag_results, sync_all_reference_ranges
+)
+from core.models import LabReferenceRange
+
+
+class Command(BaseCommand):
+    help = 'Re-parse lab reference ranges and re-flag all stored lab results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--benchmark', type=int, metavar='RESULTS',
+                            help='Flag RESULTS synthetic results in memory instead of the database')
+
+    def handle(self, *args, **options):
+        if options['benchmark']:
+            self.benchmark(options['benchmark'])
+            return
+
+        ranges = sync_all_reference_ranges()
+        checked, changed = reflag_results()
+        self.stdout.write(self.style.SUCCESS(
+            f'Parsed {ranges} reference range(s); checked {checked} result(s), {changed} flag(s) changed.'
+        ))
+
+    def benchmark(self, results, tests=200):
+        rng = np.random.default_rng(0)
+        # Per test: an adult range per sex and a paediatric range
+        ranges = []
+        for test_id in range(1, tests + 1):
+            for sex, min_age, max_age in (('M', 18, None), ('F', 18, None), ('', None, 18)):
+                ranges.append(LabReferenceRange(
+                    pk=len(ranges) + 1, test_id=test_id, sex=sex, min_age=min_age, max_age=max_age,
+                    low=10, high=20, critical_low=5, critical_high=30
+                ))
+        test_ids = rng.integers(1, tests + 1, size=results)
+        sexes = rng.choice(np.array(['M', 'F', 'O']), size=results)
+        ages = rng.integers(0, 90, size=results)
+        values = rng.normal(15, 5, size=results)
+
+        started = time.perf_counter()
+        bounds, matched = assign_reference_ranges(test_ids, sexes, ages, ranges)
+        flags = compute_flags(values, bounds, matched)
+        elapsed = time.perf_counter() - started
+
+        abnormal = np.isin(flags, ['low', 'high', 'critical']).sum()
+        self.stdout.write(
+            f'Flagged {results} results against {len(ranges)} ranges in {elapsed * 1000:.1f} ms '
+            f'({abnormal} abnormal).'
+        )
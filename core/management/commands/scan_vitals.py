@@ -0,0 +1,45 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from core.vitals import (
+    VITAL_FIELDS, DEFAULT_HOURS, DEFAULT_WINDOW,
+    build_vitals_matrix, early_warning_scores, scan_vitals
+)
+
+
+class Command(BaseCommand):
+    help = 'Score recent vitals of admitted IPD patients and publish early-warning alerts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=DEFAULT_HOURS,
+                            help='How far back to load readings')
+        parser.add_argument('--window', type=int, default=DEFAULT_WINDOW,
+                            help='Readings kept per patient')
+        parser.add_argument('--benchmark', type=int, metavar='BEDS',
+                            help='Score synthetic vitals for BEDS patients instead of the database')
+
+    def handle(self, *args, **options):
+        if options['benchmark']:
+            self.benchmark(options['benchmark'], options['window'])
+            return
+
+        count = scan_vitals(hours=options['hours'], window=options['window'])
+        self.stdout.write(self.style.SUCCESS(f'Published {count} vitals alert(s).'))
+
+    def benchmark(self, beds, window):
+        rng = np.random.default_rng(0)
+        normal = np.array([16, 97, 120, 75, 36.8])
+        spread = np.array([4, 2, 15, 12, 0.6])
+        record_ids = np.repeat(np.arange(beds), window)
+        values = normal + spread * rng.standard_normal((beds * window, len(VITAL_FIELDS)))
+        values[rng.random(values.shape) < 0.05] = np.nan
+
+        started = time.perf_counter()
+        patients, matrix = build_vitals_matrix(record_ids, values, window)
+        totals, _, _ = early_warning_scores(matrix)
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f'Scored {len(patients)} beds x {window} readings in {elapsed * 1000:.1f} ms '
+            f'({int((totals >= 5).sum())} at medium risk or above).'
+        )
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from core import stock_alerts
+
+
+class Command(BaseCommand):
+    help = 'Run the daily expiry sweep and write the stock alert digest to the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Re-evaluate every medicine before sweeping')
+        parser.add_argument('--no-sweep', action='store_true', help='Skip the expiry sweep')
+        parser.add_argument('--no-digest', action='store_true', help='Skip writing the digest')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            count = stock_alerts.rebuild_alerts()
+            self.stdout.write(f'Rebuilt alerts: {count} active.')
+
+        if not options['no_sweep']:
+            raised, cleared = stock_alerts.sweep_expiry_alerts()
+            self.stdout.write(f'Expiry sweep: {raised} raised, {cleared} cleared.')
+
+        if not options['no_digest']:
+            count = stock_alerts.send_alert_digest()
+            self.stdout.write(self.style.SUCCESS(f'Digest written with {count} new alert(s).'))
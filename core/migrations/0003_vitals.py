@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:04
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_patient_user'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VitalsAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.IntegerField()),
+                ('risk', models.CharField(choices=[('medium', 'Medium'), ('high', 'High')], max_length=10)),
+                ('summary', models.CharField(blank=True, max_length=200)),
+                ('scanned_at', models.DateTimeField()),
+                ('ipd_record', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='vitals_alert', to='core.ipdrecord')),
+            ],
+            options={
+                'ordering': ['-score', 'ipd_record_id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='VitalSign',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recorded_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('respiratory_rate', models.IntegerField(blank=True, null=True)),
+                ('spo2', models.IntegerField(blank=True, null=True, verbose_name='SpO2 (%)')),
+                ('systolic_bp', models.IntegerField(blank=True, null=True)),
+                ('pulse', models.IntegerField(blank=True, null=True)),
+                ('temperature', models.DecimalField(blank=True, decimal_places=1, max_digits=4, null=True, verbose_name='Temperature (°C)')),
+                ('ipd_record', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vitals', to='core.ipdrecord')),
+                ('recorded_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ipd_record', 'recorded_at'], name='core_vitals_ipd_rec_fc0dea_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:05
+
+from django.db import migrations
+
+
+CREATE_SQL = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS core_clinical_fts USING fts5(
+        symptoms, diagnosis, treatment,
+        source UNINDEXED, record_id UNINDEXED, patient_id UNINDEXED,
+        doctor_id UNINDEXED, note_date UNINDEXED,
+        tokenize='porter unicode61', prefix='3'
+    )
+"""
+
+
+def create_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(CREATE_SQL)
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS core_clinical_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_vitals'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_clinical_fts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('movement_type', models.CharField(choices=[('restock', 'Restock'), ('dispense', 'Dispense'), ('adjustment', 'Adjustment')], max_length=20)),
+                ('quantity', models.IntegerField(help_text='Positive for stock in, negative for stock out')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='core.medicine')),
+                ('prescription', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='core.pharmacyprescription')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['medicine', 'created_at'], name='core_stockm_medicin_54c634_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:09
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def create_opening_batches(apps, schema_editor):
+    """Put each medicine's existing stock in one opening batch, so it stays dispensable"""
+    Medicine = apps.get_model('core', 'Medicine')
+    MedicineBatch = apps.get_model('core', 'MedicineBatch')
+    MedicineBatch.objects.bulk_create([
+        MedicineBatch(
+            medicine_id=pk, batch_number='OPENING', expiry_date=expiry_date,
+            quantity=stock, received_quantity=stock
+        )
+        for pk, stock, expiry_date in Medicine.objects.filter(stock_quantity__gt=0).values_list(
+            'pk', 'stock_quantity', 'expiry_date'
+        )
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_stock_movement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MedicineBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch_number', models.CharField(max_length=50)),
+                ('expiry_date', models.DateField()),
+                ('quantity', models.IntegerField(default=0, help_text='Units remaining in this batch')),
+                ('received_quantity', models.IntegerField(default=0)),
+                ('received_date', models.DateField(default=django.utils.timezone.localdate)),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batches', to='core.medicine')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='stockmovement',
+            name='batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='core.medicinebatch'),
+        ),
+        migrations.AddIndex(
+            model_name='medicinebatch',
+            index=models.Index(fields=['medicine', 'expiry_date'], name='core_medici_medicin_c95254_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='medicinebatch',
+            unique_together={('medicine', 'batch_number')},
+        ),
+        migrations.RunPython(create_opening_batches, migrations.RunPython.noop),
+    ]
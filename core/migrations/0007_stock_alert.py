@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:10
+
+import django.db.models.deletion
+from datetime import timedelta
+from django.db import migrations, models
+from django.db.models import F
+from django.utils import timezone
+
+
+def backfill_stock_alerts(apps, schema_editor):
+    Medicine = apps.get_model('core', 'Medicine')
+    StockAlert = apps.get_model('core', 'StockAlert')
+    horizon = timezone.localdate() + timedelta(days=30)
+
+    alerts = [
+        StockAlert(medicine_id=pk, alert_type='low_stock')
+        for pk in Medicine.objects.filter(
+            stock_quantity__lte=F('reorder_level')
+        ).values_list('pk', flat=True)
+    ]
+    alerts += [
+        StockAlert(medicine_id=pk, alert_type='expiring')
+        for pk in Medicine.objects.filter(
+            expiry_date__lt=horizon, stock_quantity__gt=0
+        ).values_list('pk', flat=True)
+    ]
+    StockAlert.objects.bulk_create(alerts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_medicine_batch'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='medicine',
+            name='expiry_date',
+            field=models.DateField(db_index=True),
+        ),
+        migrations.CreateModel(
+            name='StockAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('alert_type', models.CharField(choices=[('low_stock', 'Low Stock'), ('expiring', 'Expiring Soon')], max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('notified_at', models.DateTimeField(blank=True, null=True)),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_alerts', to='core.medicine')),
+            ],
+            options={
+                'unique_together': {('medicine', 'alert_type')},
+            },
+        ),
+        migrations.RunPython(backfill_stock_alerts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_stock_alert'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicine',
+            name='forecast_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='medicine',
+            name='suggested_reorder_level',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='medicine',
+            name='suggested_reorder_quantity',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='pharmacyprescription',
+            index=models.Index(fields=['status', 'dispensed_date'], name='core_pharma_status_5ee90d_idx'),
+        ),
+    ]
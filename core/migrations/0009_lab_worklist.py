@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_reorder_forecast'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='labtestrequest',
+            name='claimed_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='labtestrequest',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'STAT'), (2, 'Urgent'), (3, 'Routine')], default=3),
+        ),
+        migrations.AddIndex(
+            model_name='labtestrequest',
+            index=models.Index(fields=['test', 'status', 'priority', 'requested_date'], name='core_labtes_test_id_ae8496_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='labtestrequest',
+            index=models.Index(fields=['technician', 'status'], name='core_labtes_technic_7a4cec_idx'),
+        ),
+    ]
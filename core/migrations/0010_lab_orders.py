@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_request_prices(apps, schema_editor):
+    LabTest = apps.get_model('core', 'LabTest')
+    LabTestRequest = apps.get_model('core', 'LabTestRequest')
+    LabTestRequest.objects.update(
+        price=Subquery(LabTest.objects.filter(pk=OuterRef('test_id')).values('price')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_lab_worklist'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='labtestrequest',
+            name='order_number',
+            field=models.CharField(blank=True, db_index=True, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='labtestrequest',
+            name='price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.CreateModel(
+            name='LabPanel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('panel_name', models.CharField(max_length=200)),
+                ('panel_code', models.CharField(max_length=20, unique=True)),
+                ('description', models.TextField(blank=True)),
+                ('tests', models.ManyToManyField(related_name='panels', to='core.labtest')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='labtestrequest',
+            name='panel',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.labpanel'),
+        ),
+        migrations.RunPython(backfill_request_prices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:22
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_lab_orders'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LabReferenceRange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sex', models.CharField(blank=True, choices=[('', 'Any'), ('M', 'Male'), ('F', 'Female')], max_length=1)),
+                ('min_age', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('max_age', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('low', models.DecimalField(blank=True, decimal_places=4, max_digits=12, null=True)),
+                ('high', models.DecimalField(blank=True, decimal_places=4, max_digits=12, null=True)),
+                ('critical_low', models.DecimalField(blank=True, decimal_places=4, max_digits=12, null=True)),
+                ('critical_high', models.DecimalField(blank=True, decimal_places=4, max_digits=12, null=True)),
+                ('unit', models.CharField(blank=True, max_length=30)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='labtestrequest',
+            name='flag',
+            field=models.CharField(blank=True, choices=[('normal', 'Normal'), ('low', 'Low'), ('high', 'High'), ('critical', 'Critical')], max_length=10),
+        ),
+        migrations.AddField(
+            model_name='labtestrequest',
+            name='numeric_result',
+            field=models.DecimalField(blank=True, decimal_places=4, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='labtestrequest',
+            name='result_unit',
+            field=models.CharField(blank=True, max_length=30),
+        ),
+        migrations.AddIndex(
+            model_name='labtestrequest',
+            index=models.Index(fields=['doctor', 'flag', 'completed_date'], name='core_labtes_doctor__ad69b9_idx'),
+        ),
+        migrations.AddField(
+            model_name='labreferencerange',
+            name='test',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reference_ranges', to='core.labtest'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_lab_result_flags'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LabTurnaroundRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hourly'), ('day', 'Daily')], max_length=5)),
+                ('bucket_start', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('total_minutes', models.FloatField(default=0)),
+                ('p50_minutes', models.FloatField(default=0)),
+                ('p90_minutes', models.FloatField(default=0)),
+                ('p99_minutes', models.FloatField(default=0)),
+                ('histogram', models.JSONField(default=list)),
+                ('technician', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='lab_tat_rollups', to=settings.AUTH_USER_MODEL)),
+                ('test', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tat_rollups', to='core.labtest')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'bucket_start'], name='core_labtur_period_5b2b70_idx')],
+                'unique_together': {('period', 'bucket_start', 'test', 'technician')},
+            },
+        ),
+    ]
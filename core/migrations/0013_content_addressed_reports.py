@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:28
+
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_lab_turnaround_rollup'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='labtestrequest',
+            name='report_file',
+            field=models.FileField(blank=True, null=True, storage=core.storage.report_storage, upload_to='lab_reports/'),
+        ),
+        migrations.AlterField(
+            model_name='medicalreport',
+            name='report_file',
+            field=models.FileField(storage=core.storage.report_storage, upload_to='medical_reports/'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:32
+
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_content_addressed_reports'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userprofile',
+            name='profile_picture',
+            field=models.ImageField(blank=True, null=True, storage=core.storage.report_storage, upload_to='profiles/'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_profile_picture_blob_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='labtestrequest',
+            name='bill',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='lab_requests', to='core.bill'),
+        ),
+        migrations.AddField(
+            model_name='pharmacyprescription',
+            name='bill',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='prescriptions', to='core.bill'),
+        ),
+        migrations.CreateModel(
+            name='BillItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(choices=[('consultation', 'Consultation'), ('room', 'Room'), ('medicine', 'Medicine'), ('lab', 'Laboratory'), ('other', 'Other')], max_length=20)),
+                ('description', models.CharField(max_length=200)),
+                ('quantity', models.IntegerField(default=1)),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('bill', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='core.bill')),
+            ],
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:38
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def record_opening_payments(apps, schema_editor):
+    # Amounts paid before the ledger existed become one payment per bill,
+    # so reconciling against the ledger keeps them
+    Bill = apps.get_model('core', 'Bill')
+    Payment = apps.get_model('core', 'Payment')
+    Payment.objects.bulk_create([
+        Payment(
+            bill_id=pk,
+            method=method or 'cash',
+            amount=amount_paid,
+            received_at=updated_at,
+            received_by_id=created_by_id
+        )
+        for pk, method, amount_paid, updated_at, created_by_id in Bill.objects.filter(
+            amount_paid__gt=0
+        ).values_list('pk', 'payment_method', 'amount_paid', 'updated_at', 'created_by_id').iterator()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_bill_items'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Payment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(choices=[('cash', 'Cash'), ('card', 'Card'), ('upi', 'UPI'), ('insurance', 'Insurance')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('idempotency_key', models.CharField(blank=True, max_length=64, null=True, unique=True)),
+                ('bill', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payments', to='core.bill')),
+                ('received_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bill', 'received_at'], name='core_paymen_bill_id_e92bb9_idx')],
+            },
+        ),
+        migrations.RunPython(record_opening_payments, migrations.RunPython.noop),
+    ]
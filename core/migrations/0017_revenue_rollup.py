@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:41
+
+from collections import defaultdict
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_rollups(apps, schema_editor):
+    """Roll up the existing bills and payments, as revenue.rebuild_rollups() does"""
+    Bill = apps.get_model('core', 'Bill')
+    Payment = apps.get_model('core', 'Payment')
+    RevenueRollup = apps.get_model('core', 'RevenueRollup')
+    zero = Decimal('0.00')
+
+    totals = defaultdict(lambda: [0, zero, 0, zero])
+    for day, method, status, count, amount in Bill.objects.annotate(
+        day=TruncDate('created_at')
+    ).values('day', 'payment_method', 'status').annotate(
+        count=Count('pk'), amount=Sum('total_amount')
+    ).values_list('day', 'payment_method', 'status', 'count', 'amount'):
+        totals[day, method, status][:2] = [count, amount]
+    for day, method, count, amount in Payment.objects.annotate(
+        day=TruncDate('received_at')
+    ).values('day', 'method').annotate(
+        count=Count('pk'), amount=Sum('amount')
+    ).values_list('day', 'method', 'count', 'amount'):
+        totals[day, method, ''][2:] = [count, amount]
+
+    RevenueRollup.objects.bulk_create([
+        RevenueRollup(
+            day=day, payment_method=method, status=status, bill_count=bills,
+            billed_amount=billed, payment_count=payments, collected_amount=collected
+        )
+        for (day, method, status), (bills, billed, payments, collected) in totals.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_payment_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevenueRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('payment_method', models.CharField(blank=True, max_length=20)),
+                ('status', models.CharField(blank=True, max_length=20)),
+                ('bill_count', models.IntegerField(default=0)),
+                ('billed_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('payment_count', models.IntegerField(default=0)),
+                ('collected_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'unique_together': {('day', 'payment_method', 'status')},
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models.functions import TruncDate
+
+
+def mark_existing_days_stale(apps, schema_editor):
+    """Queue every day with source rows, so the next build_performance_cube run fills the cube"""
+    days = set(apps.get_model('core', 'Appointment').objects.values_list('appointment_date', flat=True))
+    for model, field in (
+        ('OPDRecord', 'visit_date'), ('IPDRecord', 'admission_date'),
+        ('IPDRecord', 'discharge_date'), ('Bill', 'created_at'),
+    ):
+        days.update(apps.get_model('core', model).objects.filter(**{f'{field}__isnull': False}).annotate(
+            day=TruncDate(field)
+        ).values_list('day', flat=True).distinct())
+    PerformanceStaleDay = apps.get_model('core', 'PerformanceStaleDay')
+    PerformanceStaleDay.objects.bulk_create(
+        [PerformanceStaleDay(day=day) for day in days if day], batch_size=1000, ignore_conflicts=True
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_revenue_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PerformanceStaleDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PerformanceRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('source', models.CharField(choices=[('appointment', 'Appointments'), ('opd', 'OPD Visits'), ('admission', 'IPD Admissions'), ('discharge', 'IPD Discharges'), ('bill', 'Bills')], max_length=20)),
+                ('status', models.CharField(blank=True, max_length=20)),
+                ('record_count', models.IntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('amount_paid', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('stay_days', models.IntegerField(default=0)),
+                ('doctor', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='performance_rollups', to='core.doctor')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['source', 'day'], name='core_perfor_source_b562a7_idx')],
+                'unique_together': {('day', 'doctor', 'source', 'status')},
+            },
+        ),
+        migrations.RunPython(mark_existing_days_stale, migrations.RunPython.noop),
+    ]
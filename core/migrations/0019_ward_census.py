@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:56
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_census(apps, schema_editor):
+    """Census rows for the stays admitted so far, by the same sweep as census.rebuild_census()"""
+    IPDRecord = apps.get_model('core', 'IPDRecord')
+    WardCensus = apps.get_model('core', 'WardCensus')
+
+    # [admissions, discharges, discharged_days] per (ward, local day)
+    events = defaultdict(lambda: [0, 0, 0])
+    for ward_id, admitted, discharged in IPDRecord.objects.filter(bed__isnull=False).values_list(
+        'bed__ward_id', 'admission_date', 'discharge_date'
+    ).iterator(chunk_size=5000):
+        admitted_day = timezone.localdate(admitted)
+        events[ward_id, admitted_day][0] += 1
+        if discharged:
+            discharged_day = timezone.localdate(discharged)
+            event = events[ward_id, discharged_day]
+            event[1] += 1
+            # Nights billed for the stay, at least one
+            event[2] += max((discharged_day - admitted_day).days, 1)
+
+    rows = []
+    census = defaultdict(int)
+    for ward_id, day in sorted(events):
+        admissions, discharges, discharged_days = events[ward_id, day]
+        census[ward_id] += admissions - discharges
+        rows.append(WardCensus(
+            ward_id=ward_id, day=day, admissions=admissions, discharges=discharges,
+            census=census[ward_id], discharged_days=discharged_days
+        ))
+    WardCensus.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_performance_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WardCensus',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('admissions', models.IntegerField(default=0)),
+                ('discharges', models.IntegerField(default=0)),
+                ('census', models.IntegerField(default=0)),
+                ('discharged_days', models.IntegerField(default=0)),
+                ('ward', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='census', to='core.ward')),
+            ],
+            options={
+                'unique_together': {('ward', 'day')},
+            },
+        ),
+        migrations.RunPython(backfill_census, migrations.RunPython.noop),
+    ]
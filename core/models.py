@@ -1,7 +1,8 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
 from decimal import Decimal
+from .storage import report_storage
 
 # User Profile Model
 class UserProfile(models.Model):
@@ -19,7 +20,7 @@ class UserProfile(models.Model):
     phone = models.CharField(max_length=15, blank=True)
     address = models.TextField(blank=True)
     date_of_birth = models.DateField(null=True, blank=True)
-    profile_picture = models.ImageField(upload_to='profiles/', null=True, blank=True)
+    profile_picture = models.ImageField(upload_to='profiles/', storage=report_storage, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -148,6 +149,24 @@ class Bed(models.Model):
         return f"{self.ward.ward_name} - Bed {self.bed_number}"
 
 
+# Admissions, discharges and midnight census per ward on days with events, maintained by core.census
+class WardCensus(models.Model):
+    ward = models.ForeignKey(Ward, on_delete=models.CASCADE, related_name='census')
+    day = models.DateField()
+    admissions = models.IntegerField(default=0)
+    discharges = models.IntegerField(default=0)
+    # Patients in the ward at the end of the day
+    census = models.IntegerField(default=0)
+    # Nights stayed by the patients discharged that day
+    discharged_days = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['ward', 'day']
+    
+    def __str__(self):
+        return f"{self.ward.ward_name} {self.day}: {self.census}"
+
+
 # IPD (In-Patient Department) Model
 class IPDRecord(models.Model):
     STATUS_CHOICES = [
@@ -171,6 +190,44 @@ class IPDRecord(models.Model):
         return f"{self.ipd_number} - {self.patient.get_full_name()}"
 
 
+
+# IPD Vital Signs Model
+class VitalSign(models.Model):
+    ipd_record = models.ForeignKey(IPDRecord, on_delete=models.CASCADE, related_name='vitals')
+    recorded_at = models.DateTimeField(default=timezone.now)
+    respiratory_rate = models.IntegerField(null=True, blank=True)
+    spo2 = models.IntegerField(null=True, blank=True, verbose_name="SpO2 (%)")
+    systolic_bp = models.IntegerField(null=True, blank=True)
+    pulse = models.IntegerField(null=True, blank=True)
+    temperature = models.DecimalField(max_digits=4, decimal_places=1, null=True, blank=True, verbose_name="Temperature (°C)")
+    recorded_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    
+    class Meta:
+        indexes = [models.Index(fields=['ipd_record', 'recorded_at'])]
+    
+    def __str__(self):
+        return f"{self.ipd_record.ipd_number} - {self.recorded_at:%Y-%m-%d %H:%M}"
+
+
+# Vitals Early-Warning Alert Model (rewritten by each vitals scan)
+class VitalsAlert(models.Model):
+    RISK_CHOICES = [
+        ('medium', 'Medium'),
+        ('high', 'High'),
+    ]
+    
+    ipd_record = models.OneToOneField(IPDRecord, on_delete=models.CASCADE, related_name='vitals_alert')
+    score = models.IntegerField()
+    risk = models.CharField(max_length=10, choices=RISK_CHOICES)
+    summary = models.CharField(max_length=200, blank=True)
+    scanned_at = models.DateTimeField()
+    
+    class Meta:
+        ordering = ['-score', 'ipd_record_id']
+    
+    def __str__(self):
+        return f"{self.ipd_record.ipd_number} - {self.score} ({self.get_risk_display()})"
+
 # OPD (Out-Patient Department) Model
 class OPDRecord(models.Model):
     opd_number = models.CharField(max_length=20, unique=True)
@@ -200,7 +257,10 @@ class Medicine(models.Model):
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
     stock_quantity = models.IntegerField(default=0)
     reorder_level = models.IntegerField(default=10)
-    expiry_date = models.DateField()
+    suggested_reorder_level = models.IntegerField(null=True, blank=True)
+    suggested_reorder_quantity = models.IntegerField(null=True, blank=True)
+    forecast_updated_at = models.DateTimeField(null=True, blank=True)
+    expiry_date = models.DateField(db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -214,6 +274,76 @@ class Medicine(models.Model):
         return self.stock_quantity <= self.reorder_level
 
 
+
+
+# Medicine Batch (lot) Model
+class MedicineBatch(models.Model):
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='batches')
+    batch_number = models.CharField(max_length=50)
+    expiry_date = models.DateField()
+    quantity = models.IntegerField(default=0, help_text="Units remaining in this batch")
+    received_quantity = models.IntegerField(default=0)
+    received_date = models.DateField(default=timezone.localdate)
+    
+    class Meta:
+        unique_together = ['medicine', 'batch_number']
+        indexes = [models.Index(fields=['medicine', 'expiry_date'])]
+    
+    def __str__(self):
+        return f"{self.medicine.medicine_name} - Batch {self.batch_number}"
+    
+    def is_expired(self):
+        return self.expiry_date < timezone.now().date()
+
+# Append-only ledger of every change to Medicine.stock_quantity
+class StockMovement(models.Model):
+    MOVEMENT_TYPE_CHOICES = [
+        ('restock', 'Restock'),
+        ('dispense', 'Dispense'),
+        ('adjustment', 'Adjustment'),
+    ]
+    
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='stock_movements')
+    movement_type = models.CharField(max_length=20, choices=MOVEMENT_TYPE_CHOICES)
+    quantity = models.IntegerField(help_text="Positive for stock in, negative for stock out")
+    batch = models.ForeignKey(MedicineBatch, on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_movements')
+    prescription = models.ForeignKey('PharmacyPrescription', on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_movements')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [models.Index(fields=['medicine', 'created_at'])]
+    
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError('Stock movements are append-only.')
+        super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        raise ValueError('Stock movements are append-only.')
+    
+    def __str__(self):
+        return f"{self.medicine.medicine_name} {self.quantity:+d} ({self.get_movement_type_display()})"
+
+
+# Active low-stock / expiry alerts, maintained incrementally by core.stock_alerts
+class StockAlert(models.Model):
+    ALERT_TYPE_CHOICES = [
+        ('low_stock', 'Low Stock'),
+        ('expiring', 'Expiring Soon'),
+    ]
+    
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='stock_alerts')
+    alert_type = models.CharField(max_length=20, choices=ALERT_TYPE_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+    notified_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        unique_together = ['medicine', 'alert_type']
+    
+    def __str__(self):
+        return f"{self.medicine.medicine_name} - {self.get_alert_type_display()}"
+
 # Pharmacy Prescription Model
 class PharmacyPrescription(models.Model):
     STATUS_CHOICES = [
@@ -231,8 +361,13 @@ class PharmacyPrescription(models.Model):
     dispensed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     dispensed_date = models.DateTimeField(null=True, blank=True)
     total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Set once the prescription is charged on a bill
+    bill = models.ForeignKey('Bill', on_delete=models.SET_NULL, null=True, blank=True, related_name='prescriptions')
     created_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [models.Index(fields=['status', 'dispensed_date'])]
+    
     def __str__(self):
         return f"{self.prescription_number} - {self.patient.get_full_name()}"
 
@@ -267,6 +402,40 @@ class LabTest(models.Model):
         return f"{self.test_code} - {self.test_name}"
 
 
+# Parsed LabTest.normal_range bounds, maintained by core.lab_results
+class LabReferenceRange(models.Model):
+    SEX_CHOICES = [
+        ('', 'Any'),
+        ('M', 'Male'),
+        ('F', 'Female'),
+    ]
+    
+    test = models.ForeignKey(LabTest, on_delete=models.CASCADE, related_name='reference_ranges')
+    sex = models.CharField(max_length=1, choices=SEX_CHOICES, blank=True)
+    # Age band in whole years: min_age inclusive, max_age exclusive
+    min_age = models.PositiveSmallIntegerField(null=True, blank=True)
+    max_age = models.PositiveSmallIntegerField(null=True, blank=True)
+    low = models.DecimalField(max_digits=12, decimal_places=4, null=True, blank=True)
+    high = models.DecimalField(max_digits=12, decimal_places=4, null=True, blank=True)
+    critical_low = models.DecimalField(max_digits=12, decimal_places=4, null=True, blank=True)
+    critical_high = models.DecimalField(max_digits=12, decimal_places=4, null=True, blank=True)
+    unit = models.CharField(max_length=30, blank=True)
+    
+    def __str__(self):
+        return f"{self.test.test_code} {self.sex or 'Any'} {self.low}-{self.high} {self.unit}"
+
+
+# Lab Test Panel Model
+class LabPanel(models.Model):
+    panel_name = models.CharField(max_length=200)
+    panel_code = models.CharField(max_length=20, unique=True)
+    description = models.TextField(blank=True)
+    tests = models.ManyToManyField(LabTest, related_name='panels')
+    
+    def __str__(self):
+        return f"{self.panel_code} - {self.panel_name}"
+
+
 # Lab Test Request Model
 class LabTestRequest(models.Model):
     STATUS_CHOICES = [
@@ -276,22 +445,91 @@ class LabTestRequest(models.Model):
         ('cancelled', 'Cancelled'),
     ]
     
+    # Lower value is worked first
+    PRIORITY_CHOICES = [
+        (1, 'STAT'),
+        (2, 'Urgent'),
+        (3, 'Routine'),
+    ]
+    
+    FLAG_CHOICES = [
+        ('normal', 'Normal'),
+        ('low', 'Low'),
+        ('high', 'High'),
+        ('critical', 'Critical'),
+    ]
+    ABNORMAL_FLAGS = ['low', 'high', 'critical']
+    
     request_number = models.CharField(max_length=20, unique=True)
+    # Requests entered together share an order number
+    order_number = models.CharField(max_length=20, blank=True, db_index=True)
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE)
     doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE)
     test = models.ForeignKey(LabTest, on_delete=models.CASCADE)
+    panel = models.ForeignKey(LabPanel, on_delete=models.SET_NULL, null=True, blank=True)
+    # Test price at the time of ordering, used for billing
+    price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Set once the request is charged on a bill
+    bill = models.ForeignKey('Bill', on_delete=models.SET_NULL, null=True, blank=True, related_name='lab_requests')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    priority = models.PositiveSmallIntegerField(choices=PRIORITY_CHOICES, default=3)
     requested_date = models.DateTimeField(auto_now_add=True)
+    claimed_date = models.DateTimeField(null=True, blank=True)
     completed_date = models.DateTimeField(null=True, blank=True)
     technician = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     result = models.TextField(blank=True)
-    report_file = models.FileField(upload_to='lab_reports/', null=True, blank=True)
+    numeric_result = models.DecimalField(max_digits=12, decimal_places=4, null=True, blank=True)
+    result_unit = models.CharField(max_length=30, blank=True)
+    # Set from the test's reference ranges whenever the request is saved
+    flag = models.CharField(max_length=10, choices=FLAG_CHOICES, blank=True)
+    report_file = models.FileField(upload_to='lab_reports/', storage=report_storage, null=True, blank=True)
     notes = models.TextField(blank=True)
     
+    class Meta:
+        indexes = [
+            # Worklist: pending requests per test, in queue order
+            models.Index(fields=['test', 'status', 'priority', 'requested_date']),
+            # "My open work" per technician
+            models.Index(fields=['technician', 'status']),
+            # Abnormal results per ordering doctor
+            models.Index(fields=['doctor', 'flag', 'completed_date']),
+        ]
+    
     def __str__(self):
         return f"{self.request_number} - {self.patient.get_full_name()} - {self.test.test_name}"
 
 
+# Lab turnaround-time rollups, maintained by core.lab_tat
+class LabTurnaroundRollup(models.Model):
+    PERIOD_CHOICES = [
+        ('hour', 'Hourly'),
+        ('day', 'Daily'),
+    ]
+    
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    bucket_start = models.DateTimeField()
+    test = models.ForeignKey(LabTest, on_delete=models.CASCADE, related_name='tat_rollups')
+    technician = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='lab_tat_rollups')
+    count = models.PositiveIntegerField(default=0)
+    total_minutes = models.FloatField(default=0)
+    p50_minutes = models.FloatField(default=0)
+    p90_minutes = models.FloatField(default=0)
+    p99_minutes = models.FloatField(default=0)
+    # Counts per log-spaced turnaround bin, see core.lab_tat.BIN_EDGES
+    histogram = models.JSONField(default=list)
+    
+    class Meta:
+        unique_together = ['period', 'bucket_start', 'test', 'technician']
+        indexes = [models.Index(fields=['period', 'bucket_start'])]
+    
+    @property
+    def mean_minutes(self):
+        return self.total_minutes / self.count if self.count else 0
+    
+    def __str__(self):
+        return f"{self.test.test_code} {self.period} {self.bucket_start:%Y-%m-%d %H:%M} ({self.count})"
+
+
 # Billing Model
 class Bill(models.Model):
     STATUS_CHOICES = [
@@ -334,7 +572,7 @@ class Bill(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
-    def save(self, *args, **kwargs):
+    def calculate_totals(self):
         self.subtotal = (
             self.consultation_fee + 
             self.room_charges + 
@@ -344,20 +582,129 @@ class Bill(models.Model):
         )
         self.total_amount = self.subtotal - self.discount + self.tax
         self.balance = self.total_amount - self.amount_paid
-        
-        if self.balance == 0:
-            self.status = 'paid'
-        elif self.amount_paid > 0:
-            self.status = 'partial'
-        else:
-            self.status = 'unpaid'
-        
-        super().save(*args, **kwargs)
+        self.status = self.status_for(self.balance, self.amount_paid)
+    
+    @staticmethod
+    def status_for(balance, amount_paid):
+        if balance == 0:
+            return 'paid'
+        if amount_paid > 0:
+            return 'partial'
+        return 'unpaid'
+    
+    def save(self, *args, **kwargs):
+        self.calculate_totals()
+        # The revenue rollup signals run in the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
     
     def __str__(self):
         return f"{self.bill_number} - {self.patient.get_full_name()}"
 
 
+# Itemized charge line of a bill
+class BillItem(models.Model):
+    CATEGORY_CHOICES = [
+        ('consultation', 'Consultation'),
+        ('room', 'Room'),
+        ('medicine', 'Medicine'),
+        ('lab', 'Laboratory'),
+        ('other', 'Other'),
+    ]
+    
+    bill = models.ForeignKey(Bill, on_delete=models.CASCADE, related_name='items')
+    category = models.CharField(max_length=20, choices=CATEGORY_CHOICES)
+    description = models.CharField(max_length=200)
+    quantity = models.IntegerField(default=1)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    
+    def __str__(self):
+        return f"{self.bill.bill_number} - {self.description}"
+
+
+# Daily billed and collected totals, maintained by core.revenue
+class RevenueRollup(models.Model):
+    day = models.DateField()
+    payment_method = models.CharField(max_length=20, blank=True)
+    # Bill status for billed amounts; empty on rows holding collections
+    status = models.CharField(max_length=20, blank=True)
+    bill_count = models.IntegerField(default=0)
+    billed_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    payment_count = models.IntegerField(default=0)
+    collected_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        unique_together = ['day', 'payment_method', 'status']
+    
+    def __str__(self):
+        return f"{self.day} {self.payment_method or '-'} {self.status or 'collected'}"
+
+
+# Append-only ledger of payments received against bills
+class Payment(models.Model):
+    bill = models.ForeignKey(Bill, on_delete=models.CASCADE, related_name='payments')
+    method = models.CharField(max_length=20, choices=Bill.PAYMENT_METHOD_CHOICES)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    received_at = models.DateTimeField(default=timezone.now)
+    received_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    # Sent with the payment form so a resubmitted form is recorded once
+    idempotency_key = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    
+    class Meta:
+        indexes = [models.Index(fields=['bill', 'received_at'])]
+    
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError('Payments are append-only.')
+        super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        raise ValueError('Payments are append-only.')
+    
+    def __str__(self):
+        return f"{self.bill.bill_number} - {self.amount} ({self.get_method_display()})"
+
+
+# Per-day doctor performance facts, rebuilt by core.performance
+class PerformanceRollup(models.Model):
+    SOURCE_CHOICES = [
+        ('appointment', 'Appointments'),
+        ('opd', 'OPD Visits'),
+        ('admission', 'IPD Admissions'),
+        ('discharge', 'IPD Discharges'),
+        ('bill', 'Bills'),
+    ]
+    
+    day = models.DateField()
+    # Null for bills not tied to an OPD visit or IPD stay
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, null=True, related_name='performance_rollups')
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES)
+    # Status of the source rows (appointment, IPD or bill status); empty for OPD visits
+    status = models.CharField(max_length=20, blank=True)
+    record_count = models.IntegerField(default=0)
+    # Bills: total billed and amount paid
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    amount_paid = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # Discharges: nights stayed, for average length of stay
+    stay_days = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['day', 'doctor', 'source', 'status']
+        indexes = [models.Index(fields=['source', 'day'])]
+    
+    def __str__(self):
+        return f"{self.day} {self.source} {self.status or '-'}: {self.record_count}"
+
+
+# Days whose performance rollups are out of date
+class PerformanceStaleDay(models.Model):
+    day = models.DateField(unique=True)
+    
+    def __str__(self):
+        return str(self.day)
+
+
 # Staff Attendance Model
 class Attendance(models.Model):
     STATUS_CHOICES = [
@@ -416,7 +763,7 @@ class MedicalReport(models.Model):
     report_type = models.CharField(max_length=20, choices=REPORT_TYPE_CHOICES)
     title = models.CharField(max_length=200)
     description = models.TextField(blank=True)
-    report_file = models.FileField(upload_to='medical_reports/')
+    report_file = models.FileField(upload_to='medical_reports/', storage=report_storage)
     uploaded_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     uploaded_date = models.DateTimeField(auto_now_add=True)
     
@@ -0,0 +1,183 @@
+"""
+Doctor performance cube.
+
+``PerformanceRollup`` is a fact table at day × doctor × source × status
+grain. The sources are appointments, OPD visits, IPD admissions, IPD
+discharges (with nights stayed, for average length of stay) and bills
+(with billed and paid amounts). Doctors, and through them
+specializations, are the dimension table, and months are derived from
+the day, so ``pivot()`` answers any doctor × specialization × month ×
+status slice with one grouped query over a few thousand rows instead of
+joining the source tables.
+
+Writes to appointments, OPD and IPD records and bills mark the affected
+local days as stale (the old day too when a record moves). The nightly
+``build_performance_cube`` command rebuilds only those days.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce, TruncDate, TruncMonth
+from django.utils import timezone
+from . import billing
+from .models import Appointment, Bill, IPDRecord, OPDRecord, PerformanceRollup, PerformanceStaleDay
+
+ZERO = Decimal('0.00')
+DIMENSIONS = ('doctor', 'specialization', 'month', 'status')
+
+
+def mark_stale(days):
+    """Queue local dates for the next rebuild"""
+    days = {day for day in days if day}
+    if days:
+        PerformanceStaleDay.objects.bulk_create(
+            [PerformanceStaleDay(day=day) for day in days], ignore_conflicts=True
+        )
+
+
+def record_days(record):
+    """Local dates a source row contributes to"""
+    if isinstance(record, Appointment):
+        return {record.appointment_date}
+    if isinstance(record, OPDRecord):
+        return {record.visit_date and timezone.localdate(record.visit_date)}
+    if isinstance(record, IPDRecord):
+        return {timezone.localdate(value) for value in (record.admission_date, record.discharge_date) if value}
+    return {timezone.localdate(record.created_at)}
+
+
+def _by_day(queryset, field, days):
+    """Annotate the local date of ``field`` as ``day``, limited to ``days`` unless None"""
+    if field == 'appointment_date':
+        queryset = queryset.annotate(day=F(field))
+    else:
+        queryset = queryset.annotate(day=TruncDate(field))
+    return queryset if days is None else queryset.filter(day__in=days)
+
+
+def compute_facts(days=None):
+    """
+    Fact rows for the given local dates (all dates if None).
+
+    One grouped query per source, plus one over the discharges for
+    length of stay.
+    """
+    facts = defaultdict(lambda: [0, ZERO, ZERO, 0])
+
+    for source, model, field, status in (
+        ('appointment', Appointment, 'appointment_date', 'status'),
+        ('opd', OPDRecord, 'visit_date', None),
+        ('admission', IPDRecord, 'admission_date', 'status'),
+    ):
+        group_by = ['day', 'doctor_id'] + ([status] if status else [])
+        for row in _by_day(model.objects.all(), field, days).values(*group_by).annotate(
+            count=Count('pk')
+        ).order_by():
+            facts[row['day'], row['doctor_id'], source, row.get(status, '')][0] += row['count']
+
+    discharges = _by_day(IPDRecord.objects.filter(discharge_date__isnull=False), 'discharge_date', days)
+    for day, doctor_id, admitted, discharged in discharges.values_list(
+        'day', 'doctor_id', 'admission_date', 'discharge_date'
+    ):
+        fact = facts[day, doctor_id, 'discharge', 'discharged']
+        fact[0] += 1
+        fact[3] += billing.length_of_stay(admitted, discharged)
+
+    bills = _by_day(Bill.objects.all(), 'created_at', days).annotate(
+        doctor=Coalesce('opd_record__doctor_id', 'ipd_record__doctor_id')
+    )
+    for row in bills.values('day', 'doctor', 'status').annotate(
+        count=Count('pk'), billed=Sum('total_amount'), paid=Sum('amount_paid')
+    ).order_by():
+        fact = facts[row['day'], row['doctor'], 'bill', row['status']]
+        fact[0] += row['count']
+        fact[1] += row['billed']
+        fact[2] += row['paid']
+
+    return [
+        PerformanceRollup(
+            day=day, doctor_id=doctor_id, source=source, status=status,
+            record_count=count, amount=amount, amount_paid=paid, stay_days=stay_days
+        )
+        for (day, doctor_id, source, status), (count, amount, paid, stay_days) in facts.items()
+    ]
+
+
+def rebuild(days=None):
+    """Replace the facts for ``days`` (every day if None); returns the number of fact rows"""
+    with transaction.atomic():
+        if days is None:
+            PerformanceStaleDay.objects.all().delete()
+            PerformanceRollup.objects.all().delete()
+        else:
+            days = sorted(set(days))
+            PerformanceRollup.objects.filter(day__in=days).delete()
+        rollups = compute_facts(days)
+        PerformanceRollup.objects.bulk_create(rollups, batch_size=500)
+    return len(rollups)
+
+
+def rebuild_stale():
+    """Rebuild the days marked stale since the last run; returns (days, fact rows)"""
+    with transaction.atomic():
+        stale = list(PerformanceStaleDay.objects.select_for_update().values_list('pk', 'day'))
+        if not stale:
+            return 0, 0
+        # Unmarked before reading the sources: a write landing after this
+        # marks its day again for the next run
+        PerformanceStaleDay.objects.filter(pk__in=[pk for pk, _ in stale]).delete()
+        count = rebuild([day for _, day in stale])
+    return len(stale), count
+
+
+def pivot(source, dimensions=('month',), start=None, end=None):
+    """
+    Totals for one source grouped by any of ``DIMENSIONS``, in one query.
+
+    Each row has the chosen dimensions plus ``records``, ``amount``,
+    ``amount_paid``, ``stay_days`` and ``average_stay`` (discharges).
+    ``start`` and ``end`` are inclusive local dates.
+    """
+    queryset = PerformanceRollup.objects.filter(source=source)
+    if start:
+        queryset = queryset.filter(day__gte=start)
+    if end:
+        queryset = queryset.filter(day__lte=end)
+
+    group_by = []
+    for dimension in dimensions:
+        if dimension == 'doctor':
+            group_by += ['doctor_id', 'doctor__user__first_name', 'doctor__user__last_name']
+        elif dimension == 'specialization':
+            group_by.append('doctor__specialization')
+        elif dimension == 'month':
+            queryset = queryset.annotate(month=TruncMonth('day'))
+            group_by.append('month')
+        elif dimension == 'status':
+            group_by.append('status')
+        else:
+            raise ValueError(f'Unknown dimension {dimension!r}.')
+
+    rows = []
+    for row in queryset.values(*group_by).annotate(
+        records=Sum('record_count'), total=Sum('amount'), paid=Sum('amount_paid'), stays=Sum('stay_days')
+    ).order_by(*group_by):
+        result = {
+            'records': row['records'], 'amount': row['total'], 'amount_paid': row['paid'],
+            'stay_days': row['stays'],
+            'average_stay': row['stays'] / row['records'] if source == 'discharge' and row['records'] else None,
+        }
+        if 'doctor' in dimensions:
+            result['doctor'] = (
+                f"Dr. {row['doctor__user__first_name']} {row['doctor__user__last_name']}"
+                if row['doctor_id'] else 'No doctor'
+            )
+        if 'specialization' in dimensions:
+            result['specialization'] = row['doctor__specialization'] or '-'
+        if 'month' in dimensions:
+            result['month'] = row['month']
+        if 'status' in dimensions:
+            result['status'] = row['status']
+        rows.append(result)
+    return rows
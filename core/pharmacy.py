@@ -0,0 +1,358 @@
+"""
+Pharmacy stock operations.
+
+Every change to ``Medicine.stock_quantity`` goes through a conditional
+``F()`` update so concurrent pharmacists cannot oversell stock, and is
+recorded in the append-only ``StockMovement`` ledger.
+
+Medicines that have ``MedicineBatch`` rows are batch-tracked: dispenses
+are filled first-expiry-first-out from non-expired batches, and
+``Medicine.expiry_date`` follows the earliest batch still holding stock.
+Stock held outside any batch (``stock_quantity`` above the batch total,
+e.g. from a manual correction) is drawn on once the batches run out.
+"""
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import F, Q, Sum, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import (
+    IPDRecord, Medicine, MedicineBatch, OPDRecord, Patient, PharmacyPrescription, PrescriptionItem, StockMovement
+)
+from . import stock_alerts
+
+# Batches read per round trip while allocating
+ALLOCATION_PAGE_SIZE = 10
+
+EXPIRY_HORIZONS = (30, 60, 90)
+
+
+class PharmacyError(Exception):
+    pass
+
+
+class InsufficientStock(PharmacyError):
+    def __init__(self, medicine, requested, available=None):
+        self.medicine = medicine
+        self.requested = requested
+        self.available = medicine.stock_quantity if available is None else available
+        super().__init__(
+            f'Insufficient stock for {medicine.medicine_name}: '
+            f'{requested} requested, {self.available} available.'
+        )
+
+
+class PrescriptionNotPending(PharmacyError):
+    pass
+
+
+def adjust_stock(medicine_id, quantity, movement_type, user=None, prescription=None, batch=None):
+    """
+    Atomically add ``quantity`` (negative to remove) to a medicine's stock.
+
+    The update only matches while the result stays non-negative, so it
+    is safe against concurrent writers. Raises InsufficientStock
+    otherwise. Must be called inside a transaction.
+    """
+    if quantity == 0:
+        return
+    updated = Medicine.objects.filter(
+        pk=medicine_id,
+        stock_quantity__gte=max(-quantity, 0)
+    ).update(
+        stock_quantity=F('stock_quantity') + quantity,
+        updated_at=timezone.now()
+    )
+    if not updated:
+        raise InsufficientStock(Medicine.objects.get(pk=medicine_id), -quantity)
+
+    StockMovement.objects.create(
+        medicine_id=medicine_id,
+        movement_type=movement_type,
+        quantity=quantity,
+        batch=batch,
+        prescription=prescription,
+        created_by=user
+    )
+
+
+def sync_expiry_dates(medicine_ids):
+    """Point each batch-tracked medicine's expiry_date at its next expiring batch"""
+    next_expiry = MedicineBatch.objects.filter(
+        medicine=OuterRef('pk'),
+        quantity__gt=0
+    ).order_by('expiry_date').values('expiry_date')[:1]
+    Medicine.objects.filter(pk__in=medicine_ids).update(
+        expiry_date=Coalesce(Subquery(next_expiry), F('expiry_date')), updated_at=timezone.now()
+    )
+
+
+def receive_batch(medicine_id, batch_number, expiry_date, quantity, user=None):
+    """Book a new batch into stock"""
+    with transaction.atomic():
+        batch = MedicineBatch.objects.create(
+            medicine_id=medicine_id,
+            batch_number=batch_number,
+            expiry_date=expiry_date,
+            quantity=quantity,
+            received_quantity=quantity
+        )
+        adjust_stock(medicine_id, quantity, 'restock', user=user, batch=batch)
+        sync_expiry_dates([medicine_id])
+        stock_alerts.refresh_medicine_alerts([medicine_id])
+    return batch
+
+
+def correct_stock(medicine_id, quantity, user=None, on_date=None):
+    """
+    Apply a manual stock correction of ``quantity`` units (negative to remove).
+
+    Additions are held as unbatched stock. Removals from a batch-tracked
+    medicine come out of its batches like a dispense, so the batches
+    keep adding up to the stock.
+    """
+    if quantity == 0:
+        return
+    with transaction.atomic():
+        if quantity > 0 or not MedicineBatch.objects.filter(medicine_id=medicine_id).exists():
+            adjust_stock(medicine_id, quantity, 'adjustment', user=user)
+        else:
+            updated = Medicine.objects.filter(pk=medicine_id, stock_quantity__gte=-quantity).update(
+                stock_quantity=F('stock_quantity') + quantity, updated_at=timezone.now()
+            )
+            if not updated:
+                raise InsufficientStock(Medicine.objects.get(pk=medicine_id), -quantity)
+            StockMovement.objects.bulk_create([
+                StockMovement(
+                    medicine_id=medicine_id, movement_type='adjustment', quantity=-units,
+                    batch_id=batch_id, created_by=user
+                )
+                for batch_id, units in allocate_batches(medicine_id, -quantity, on_date)
+            ])
+            sync_expiry_dates([medicine_id])
+        stock_alerts.refresh_medicine_alerts([medicine_id])
+
+
+def allocate_batches(medicine_id, quantity, on_date=None):
+    """
+    Take ``quantity`` units from a medicine's batches, earliest expiry first.
+
+    Expired batches are skipped. Batches are read a page at a time along
+    the (medicine, expiry_date) index, so only as many batches as the
+    allocation needs are touched. Units the batches cannot cover come
+    from unbatched stock, as ``(None, units)``. Returns a list of
+    ``(batch_id, units)`` and raises InsufficientStock if neither covers
+    the quantity.
+
+    Must be called inside a transaction, after the units have been taken
+    off ``Medicine.stock_quantity``.
+    """
+    on_date = on_date or timezone.localdate()
+    candidates = MedicineBatch.objects.select_for_update().filter(
+        medicine_id=medicine_id,
+        expiry_date__gte=on_date,
+        quantity__gt=0
+    ).order_by('expiry_date', 'pk')
+
+    allocations = []
+    remaining = quantity
+    after = None
+    while remaining > 0:
+        page = candidates
+        if after is not None:
+            page = page.filter(
+                Q(expiry_date__gt=after[0]) | Q(expiry_date=after[0], pk__gt=after[1])
+            )
+        page = list(page.values_list('pk', 'expiry_date', 'quantity')[:ALLOCATION_PAGE_SIZE])
+        if not page:
+            # stock_quantity already has all ``quantity`` units taken off, so
+            # the unbatched stock is its excess over the batches plus the
+            # units not placed yet
+            medicine = Medicine.objects.get(pk=medicine_id)
+            batched = MedicineBatch.objects.filter(medicine_id=medicine_id, quantity__gt=0).aggregate(
+                total=Coalesce(Sum('quantity'), 0)
+            )['total']
+            unbatched = medicine.stock_quantity - batched + remaining
+            if unbatched >= remaining:
+                allocations.append((None, remaining))
+                break
+            allocated = quantity - remaining
+            raise InsufficientStock(medicine, quantity, available=allocated + max(unbatched, 0))
+
+        for pk, expiry_date, available in page:
+            take = min(available, remaining)
+            if MedicineBatch.objects.filter(pk=pk, quantity__gte=take).update(
+                quantity=F('quantity') - take
+            ):
+                allocations.append((pk, take))
+                remaining -= take
+            if remaining == 0:
+                break
+        after = (page[-1][1], page[-1][0])
+
+    return allocations
+
+
+def expiry_horizon_report(on_date=None, horizons=EXPIRY_HORIZONS):
+    """
+    Units on hand per medicine that are expired or expire within each horizon.
+
+    Horizons are cumulative ("within 30 days" includes "within 15").
+    Computed in a single grouped query over the batches.
+    """
+    on_date = on_date or timezone.localdate()
+    buckets = {
+        f'within_{days}': Sum('quantity', filter=Q(
+            expiry_date__gte=on_date,
+            expiry_date__lt=on_date + timedelta(days=days)
+        ), default=0)
+        for days in horizons
+    }
+    rows = MedicineBatch.objects.filter(
+        quantity__gt=0,
+        expiry_date__lt=on_date + timedelta(days=max(horizons))
+    ).values(
+        'medicine_id', 'medicine__medicine_name', 'medicine__medicine_type'
+    ).annotate(
+        expired=Sum('quantity', filter=Q(expiry_date__lt=on_date), default=0),
+        next_expiry=Min('expiry_date'),
+        **buckets
+    ).order_by('next_expiry', 'medicine__medicine_name')
+    return list(rows)
+
+
+def _check_patient(patient_id, opd_record_id=None, ipd_record_id=None):
+    try:
+        patient_id = int(patient_id)
+        encounters = [
+            (model, int(pk), label)
+            for model, pk, label in ((OPDRecord, opd_record_id, 'OPD visit'), (IPDRecord, ipd_record_id, 'IPD stay'))
+            if pk
+        ]
+    except (TypeError, ValueError):
+        raise PharmacyError('Choose a patient for the prescription.')
+    if not encounters and not Patient.objects.filter(pk=patient_id).exists():
+        raise PharmacyError('Unknown patient.')
+    # An encounter's patient exists, so checking it covers the patient too
+    for model, pk, label in encounters:
+        owner = model.objects.filter(pk=pk).values_list('patient_id', flat=True).first()
+        if owner is None:
+            raise PharmacyError(f'Unknown {label}.')
+        if owner != patient_id:
+            raise PharmacyError(f'The {label} belongs to another patient.')
+
+
+def create_prescription(prescription_number, patient_id, doctor_id, items,
+                        opd_record_id=None, ipd_record_id=None):
+    """
+    Create a prescription and all of its items in one transaction.
+
+    ``items`` is a list of dicts with ``medicine_id``, ``quantity``,
+    ``dosage``, ``duration`` and optional ``instructions``. Unit prices
+    for all medicines are read with a single ``in_bulk`` query, line
+    totals and the prescription total are computed in memory, and the
+    items are inserted with one ``bulk_create``, so the query count does
+    not grow with the number of lines. The patient must exist, and an
+    OPD visit or IPD stay given must be that patient's.
+    """
+    if not items:
+        raise PharmacyError('A prescription needs at least one item.')
+    _check_patient(patient_id, opd_record_id, ipd_record_id)
+    try:
+        parsed = [(int(item['medicine_id']), int(item['quantity'])) for item in items]
+    except (TypeError, ValueError):
+        raise PharmacyError('Each item needs a medicine and a whole-number quantity.')
+    if any(quantity <= 0 for _, quantity in parsed):
+        raise PharmacyError('Quantities must be positive.')
+
+    prices = Medicine.objects.only('unit_price').in_bulk({medicine_id for medicine_id, _ in parsed})
+    missing = {medicine_id for medicine_id, _ in parsed} - prices.keys()
+    if missing:
+        raise PharmacyError(f'Unknown medicine(s): {sorted(missing)}')
+
+    lines = []
+    for item, (medicine_id, quantity) in zip(items, parsed):
+        unit_price = prices[medicine_id].unit_price
+        lines.append(PrescriptionItem(
+            medicine_id=medicine_id,
+            quantity=quantity,
+            dosage=item['dosage'],
+            duration=item['duration'],
+            instructions=item.get('instructions', ''),
+            unit_price=unit_price,
+            total_price=quantity * unit_price
+        ))
+
+    with transaction.atomic():
+        prescription = PharmacyPrescription.objects.create(
+            prescription_number=prescription_number,
+            patient_id=patient_id,
+            doctor_id=doctor_id,
+            opd_record_id=opd_record_id,
+            ipd_record_id=ipd_record_id,
+            total_amount=sum(line.total_price for line in lines)
+        )
+        for line in lines:
+            line.prescription = prescription
+        PrescriptionItem.objects.bulk_create(lines)
+    return prescription
+
+
+def dispense_prescription(prescription_id, user):
+    """
+    Dispense every item of a pending prescription in one transaction.
+
+    The prescription is claimed with a conditional status update first,
+    so it can only ever be dispensed once; any stock shortfall rolls the
+    whole dispense back.
+    """
+    with transaction.atomic():
+        now = timezone.now()
+        claimed = PharmacyPrescription.objects.filter(
+            pk=prescription_id,
+            status='pending'
+        ).update(status='dispensed', dispensed_by=user, dispensed_date=now)
+        if not claimed:
+            raise PrescriptionNotPending(f'Prescription {prescription_id} is not pending.')
+
+        # Same medicine on several lines is taken in one update; a fixed
+        # medicine order keeps concurrent dispenses from deadlocking.
+        quantities = list(PrescriptionItem.objects.filter(
+            prescription_id=prescription_id
+        ).values('medicine_id').annotate(total=Sum('quantity')).order_by('medicine_id'))
+        batch_tracked = set(MedicineBatch.objects.filter(
+            medicine_id__in=[row['medicine_id'] for row in quantities]
+        ).values_list('medicine_id', flat=True).distinct())
+
+        movements = []
+        for row in quantities:
+            updated = Medicine.objects.filter(
+                pk=row['medicine_id'],
+                stock_quantity__gte=row['total']
+            ).update(
+                stock_quantity=F('stock_quantity') - row['total'],
+                updated_at=now
+            )
+            if not updated:
+                raise InsufficientStock(Medicine.objects.get(pk=row['medicine_id']), row['total'])
+
+            if row['medicine_id'] in batch_tracked:
+                allocations = allocate_batches(row['medicine_id'], row['total'], on_date=timezone.localdate(now))
+            else:
+                allocations = [(None, row['total'])]
+            for batch_id, units in allocations:
+                movements.append(StockMovement(
+                    medicine_id=row['medicine_id'],
+                    movement_type='dispense',
+                    quantity=-units,
+                    batch_id=batch_id,
+                    prescription_id=prescription_id,
+                    created_by=user
+                ))
+        StockMovement.objects.bulk_create(movements)
+        if batch_tracked:
+            sync_expiry_dates(batch_tracked)
+        # bulk_create skips post_save, so refresh the alerts here
+        stock_alerts.refresh_medicine_alerts([row['medicine_id'] for row in quantities])
+
+    return PharmacyPrescription.objects.get(pk=prescription_id)
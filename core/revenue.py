@@ -0,0 +1,133 @@
+"""
+Daily revenue rollups.
+
+One ``RevenueRollup`` row per local day, payment method and bill status
+holds:
+
+* billed: the count and total of bills created that day that currently
+  have that payment method and status. A bill's contribution moves
+  between rows as payments change its status.
+* collected: the count and sum of payments received that day by that
+  method. Payments have no status of their own, so these sit on rows
+  with an empty status.
+
+Rows are adjusted inside the transaction that writes the bill or
+payment, so dashboards can sum a range of days from at most a few
+hundred rows instead of scanning bills.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from . import performance
+from .models import Bill, Payment, RevenueRollup
+
+ZERO = Decimal('0.00')
+
+
+def bill_state(bill):
+    """What a bill contributes to the rollups: (created_at, payment_method, status, total_amount)"""
+    return (bill.created_at, bill.payment_method, bill.status, bill.total_amount)
+
+
+def _apply(deltas):
+    """Add ``{(day, method, status): [bills, billed, payments, collected]}`` to the rollup rows"""
+    with transaction.atomic():
+        # Sorted, so concurrent writers lock rows in the same order
+        for (day, method, status), (bills, billed, payments, collected) in sorted(deltas.items()):
+            if not (bills or billed or payments or collected):
+                continue
+            rollup, _ = RevenueRollup.objects.get_or_create(day=day, payment_method=method, status=status)
+            RevenueRollup.objects.filter(pk=rollup.pk).update(
+                bill_count=F('bill_count') + bills,
+                billed_amount=F('billed_amount') + billed,
+                payment_count=F('payment_count') + payments,
+                collected_amount=F('collected_amount') + collected
+            )
+
+
+def bills_changed(changes):
+    """
+    Record bill writes given as ``(before, after)`` pairs of ``bill_state()``.
+
+    ``before`` is None for a new bill and ``after`` is None for a
+    deleted one.
+    """
+    deltas = defaultdict(lambda: [0, ZERO, 0, ZERO])
+    for before, after in changes:
+        for state, sign in ((before, -1), (after, 1)):
+            if state is None:
+                continue
+            created_at, method, status, total_amount = state
+            delta = deltas[timezone.localdate(created_at), method or '', status]
+            delta[0] += sign
+            delta[1] += sign * total_amount
+    _apply(deltas)
+    # The same bills feed the performance cube
+    performance.mark_stale({day for day, _, _ in deltas})
+
+
+def payment_recorded(payment):
+    _apply({
+        (timezone.localdate(payment.received_at), payment.method, ''): [0, ZERO, 1, payment.amount]
+    })
+
+
+def rebuild_rollups():
+    """Recompute every rollup row from bills and payments; returns the number of rows"""
+    totals = defaultdict(lambda: [0, ZERO, 0, ZERO])
+    for day, method, status, count, amount in Bill.objects.annotate(
+        day=TruncDate('created_at')
+    ).values('day', 'payment_method', 'status').annotate(
+        count=Count('pk'), amount=Sum('total_amount')
+    ).values_list('day', 'payment_method', 'status', 'count', 'amount'):
+        totals[day, method, status][:2] = [count, amount]
+    for day, method, count, amount in Payment.objects.annotate(
+        day=TruncDate('received_at')
+    ).values('day', 'method').annotate(
+        count=Count('pk'), amount=Sum('amount')
+    ).values_list('day', 'method', 'count', 'amount'):
+        totals[day, method, ''][2:] = [count, amount]
+
+    rollups = [
+        RevenueRollup(
+            day=day, payment_method=method, status=status, bill_count=bills,
+            billed_amount=billed, payment_count=payments, collected_amount=collected
+        )
+        for (day, method, status), (bills, billed, payments, collected) in totals.items()
+    ]
+    with transaction.atomic():
+        RevenueRollup.objects.all().delete()
+        RevenueRollup.objects.bulk_create(rollups, batch_size=500)
+    return len(rollups)
+
+
+def revenue_summary(start, end=None):
+    """
+    Billed and collected totals for local days ``start`` to ``end`` inclusive.
+
+    Returns a dict with ``billed``, ``bill_count``, ``collected``,
+    ``payment_count``, ``by_method`` (method -> collected) and
+    ``by_status`` (status -> billed).
+    """
+    rows = RevenueRollup.objects.filter(day__gte=start, day__lte=end or start).values_list(
+        'payment_method', 'status', 'bill_count', 'billed_amount', 'payment_count', 'collected_amount'
+    )
+    summary = {
+        'billed': ZERO, 'bill_count': 0, 'collected': ZERO, 'payment_count': 0,
+        'by_method': defaultdict(Decimal), 'by_status': defaultdict(Decimal),
+    }
+    for method, status, bills, billed, payments, collected in rows:
+        summary['billed'] += billed
+        summary['bill_count'] += bills
+        summary['collected'] += collected
+        summary['payment_count'] += payments
+        if payments:
+            summary['by_method'][method] += collected
+        if bills:
+            summary['by_status'][status] += billed
+    summary['by_method'] = dict(summary['by_method'])
+    summary['by_status'] = dict(summary['by_status'])
+    return summary
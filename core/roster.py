@@ -0,0 +1,388 @@
+"""
+Shift rosters for nurses and doctors.
+
+``generate_roster()`` writes ``Shift`` rows for every active nurse and
+doctor over a period. Nobody works more than one shift a day (the
+``(user, shift_date)`` unique key), and nobody is rostered:
+
+* on a day they are on leave in ``Attendance``;
+* with less than 11 hours between shifts, i.e. a morning or afternoon
+  right after a night, or a morning right after an afternoon;
+* for more than ``MAX_CONSECUTIVE_DAYS`` days or
+  ``MAX_CONSECUTIVE_NIGHTS`` nights in a row;
+* for more than ``MAX_SHIFTS_RATIO`` of the days in the period.
+
+Every shift needs a minimum number of nurses and doctors: the sum over
+wards of the ward's beds divided by the beds one person covers on that
+ward type (``BEDS_PER_STAFF``). Shifts are not tied to a ward, so the
+minimum is per shift and role for the whole hospital.
+
+The solver works on a staff × day grid of shift codes in memory. A
+greedy pass walks the days in order and fills each shift's minimum with
+the staff furthest below their share who may take it (mornings first, as
+the fewest staff may work one after the day before). It then gives
+everyone shifts up to their share of the period (``WORK_RATIO``), paced
+so days off are spread out. Local search
+then moves staff into shifts still short of their minimum, from a
+shift with a surplus on the same day or from one on another day, and
+evens out workloads by handing shifts from staff furthest over their
+share to those furthest under it. Shares and limits count only the days
+someone is not on leave. A month for a thousand staff takes well under a
+second, and the roster is saved with one bulk insert.
+
+Shifts already in the table are kept and count towards coverage and the
+rest rules.
+"""
+import math
+from collections import defaultdict
+from datetime import time, timedelta
+from django.contrib.auth.models import User
+from . import coverage
+from .models import Attendance, Shift, Ward
+
+ROLES = ('nurse', 'doctor')
+
+# Grid codes: shift codes follow Shift.SHIFT_CHOICES, 0 is a day off
+SHIFT_TYPES = [shift for shift, _ in Shift.SHIFT_CHOICES]
+CODES = {shift: code for code, shift in enumerate(SHIFT_TYPES, start=1)}
+MORNING, AFTERNOON, NIGHT = CODES['morning'], CODES['afternoon'], CODES['night']
+OFF, LEAVE = 0, -1
+LETTERS = {'morning': 'M', 'afternoon': 'A', 'night': 'N'}
+SHIFT_TIMES = {
+    'morning': (time(6), time(14)),
+    'afternoon': (time(14), time(22)),
+    'night': (time(22), time(6)),
+}
+
+# (shift, next day's shift) with less than 11 hours of rest in between
+FORBIDDEN = {(NIGHT, MORNING), (NIGHT, AFTERNOON), (AFTERNOON, MORNING)}
+MAX_CONSECUTIVE_DAYS = 6
+MAX_CONSECUTIVE_NIGHTS = 3
+WORK_RATIO = 5 / 7
+MAX_SHIFTS_RATIO = 6 / 7
+
+# Beds one person covers per shift, by ward type
+BEDS_PER_STAFF = {
+    'nurse': {'ICU': 2, 'Emergency': 4, 'Private': 6, 'General': 8},
+    'doctor': {'ICU': 10, 'Emergency': 10, 'Private': 20, 'General': 30},
+}
+
+
+def ward_requirements(wards):
+    """``{(shift code, role): minimum staff per shift}`` for ``(ward_type, total_beds)`` pairs"""
+    required = defaultdict(int)
+    for ward_type, beds in wards:
+        for role, ratios in BEDS_PER_STAFF.items():
+            needed = math.ceil(beds / ratios.get(ward_type, ratios['General'])) if beds > 0 else 0
+            for code in CODES.values():
+                required[code, role] += needed
+    return dict(required)
+
+
+def requirements():
+    return ward_requirements(Ward.objects.values_list('ward_type', 'total_beds'))
+
+
+class Roster:
+    """
+    A roster being solved: ``grid[i][d]`` is staff member ``i``'s code on day ``d``.
+
+    ``roles`` lists each staff member's role and ``requirements`` maps
+    ``(shift code, role)`` to a minimum per day. ``leave`` (``{(i, d)}``)
+    and ``fixed`` (``{(i, d): code}``) are cells that may not change, and
+    ``before`` (``{i: code}``) holds the shifts of the day before the
+    period, for the rest rules.
+    """
+
+    def __init__(self, roles, days, requirements, leave=(), fixed=None, before=None):
+        fixed = fixed or {}
+        self.roles = list(roles)
+        self.days = days
+        self.requirements = requirements
+        self.before = before or {}
+        self.grid = [[OFF] * days for _ in self.roles]
+        self.load = [0] * len(self.roles)
+        self.nights = [0] * len(self.roles)
+        self.coverage = [defaultdict(int) for _ in range(days)]
+        self.staff = defaultdict(list)
+        for i, role in enumerate(self.roles):
+            self.staff[role].append(i)
+        available = [days] * len(self.roles)
+        for i, d in leave:
+            self.grid[i][d] = LEAVE
+            available[i] -= 1
+        # Shares and limits are of the days each person is not on leave
+        self.targets = [round(count * WORK_RATIO) for count in available]
+        self.limits = [max(target, math.floor(count * MAX_SHIFTS_RATIO)) for target, count in zip(self.targets, available)]
+        for (i, d), code in fixed.items():
+            self.assign(i, d, code)
+        self.locked = set(leave) | set(fixed)
+
+    # Moves
+
+    def assign(self, i, d, code):
+        self.grid[i][d] = code
+        self.load[i] += 1
+        self.nights[i] += code == NIGHT
+        self.coverage[d][code, self.roles[i]] += 1
+
+    def unassign(self, i, d):
+        code = self.grid[i][d]
+        self.grid[i][d] = OFF
+        self.load[i] -= 1
+        self.nights[i] -= code == NIGHT
+        self.coverage[d][code, self.roles[i]] -= 1
+        return code
+
+    def short(self, d, code, role):
+        """Staff still needed on shift ``code`` of day ``d``; negative for a surplus"""
+        return self.requirements.get((code, role), 0) - self.coverage[d][code, role]
+
+    def _run(self, row, d, step, code=None):
+        """Working days (or ``code`` shifts) in a row next to day ``d``, in direction ``step``"""
+        length, d = 0, d + step
+        while 0 <= d < self.days and (row[d] > OFF if code is None else row[d] == code):
+            length += 1
+            d += step
+        return length
+
+    def can_assign(self, i, d, code):
+        row = self.grid[i]
+        if row[d] != OFF or self.load[i] >= self.limits[i]:
+            return False
+        previous = row[d - 1] if d else self.before.get(i, OFF)
+        if (previous, code) in FORBIDDEN or (d + 1 < self.days and (code, row[d + 1]) in FORBIDDEN):
+            return False
+        if self._run(row, d, -1) + self._run(row, d, 1) >= MAX_CONSECUTIVE_DAYS:
+            return False
+        return code != NIGHT or self._run(row, d, -1, NIGHT) + self._run(row, d, 1, NIGHT) < MAX_CONSECUTIVE_NIGHTS
+
+    def excess(self, i):
+        """Shifts over (negative: under) staff member ``i``'s share"""
+        return self.load[i] - self.targets[i]
+
+    def movable(self, i, d):
+        return self.grid[i][d] > OFF and (i, d) not in self.locked
+
+    # Greedy construction
+
+    def greedy(self):
+        size = len(self.roles)
+        for d in range(self.days):
+            for role, staff in self.staff.items():
+                for code in (MORNING, AFTERNOON, NIGHT):
+                    missing = self.short(d, code, role)
+                    if missing <= 0:
+                        continue
+                    candidates = [i for i in staff if self.can_assign(i, d, code)]
+                    # Furthest below their share first; the rotation spreads ties over the staff list
+                    candidates.sort(key=lambda i: (
+                        self.excess(i), self.nights[i] if code == NIGHT else 0, (i - d) % size
+                    ))
+                    for i in candidates[:missing]:
+                        self.assign(i, d, code)
+
+        # Everyone up to their share, no faster than an even pace through the period
+        worked = [0] * size
+        for d in range(self.days):
+            for role, staff in self.staff.items():
+                for i in sorted(staff, key=self.excess):
+                    due = math.ceil(self.targets[i] * (d + 1) / self.days)
+                    if self.grid[i][d] == OFF and worked[i] < due and self.load[i] < self.targets[i]:
+                        # The shift of the day that is least covered relative to its minimum
+                        for code in sorted(CODES.values(), key=lambda code: (
+                            self.coverage[d][code, role] / max(self.requirements.get((code, role), 0), 1)
+                        )):
+                            if self.can_assign(i, d, code):
+                                self.assign(i, d, code)
+                                break
+                    worked[i] += self.grid[i][d] > OFF
+
+    # Local search
+
+    def _switch_shift(self, d, code, staff):
+        """Move someone from a shift of day ``d`` with a surplus to ``code``"""
+        role = self.roles[staff[0]]
+        if all(self.short(d, other, role) >= 0 for other in CODES.values()):
+            return False
+        for i in staff:
+            other = self.grid[i][d]
+            if other == code or not self.movable(i, d) or self.short(d, other, role) >= 0:
+                continue
+            self.unassign(i, d)
+            if self.can_assign(i, d, code):
+                self.assign(i, d, code)
+                return True
+            self.assign(i, d, other)
+        return False
+
+    def _move_day(self, d, code, staff):
+        """Move someone off day ``d`` from a shift with a surplus on another day to ``code`` on ``d``"""
+        role = self.roles[staff[0]]
+        if all(self.short(e, other, role) >= 0 for e in range(self.days) for other in CODES.values()):
+            return False
+        for i in staff:
+            if self.grid[i][d] != OFF:
+                continue
+            for e in range(self.days):
+                if e == d or not self.movable(i, e) or self.short(e, self.grid[i][e], role) >= 0:
+                    continue
+                other = self.unassign(i, e)
+                if self.can_assign(i, d, code):
+                    self.assign(i, d, code)
+                    return True
+                self.assign(i, e, other)
+        return False
+
+    def repair(self):
+        """Fill shifts short of their minimum by moving staff; returns the number of moves"""
+        moves = 0
+        for d in range(self.days):
+            for role, staff in self.staff.items():
+                for code in (MORNING, AFTERNOON, NIGHT):
+                    while self.short(d, code, role) > 0 and (
+                        self._switch_shift(d, code, staff) or self._move_day(d, code, staff)
+                    ):
+                        moves += 1
+        return moves
+
+    def _give(self, busy, idle):
+        """Hand one of ``busy``'s shifts to ``idle``, who has the same role"""
+        for d in range(self.days):
+            code = self.grid[busy][d]
+            if self.movable(busy, d) and self.can_assign(idle, d, code):
+                self.unassign(busy, d)
+                self.assign(idle, d, code)
+                return True
+        return False
+
+    def balance(self):
+        """Even out shifts over each person's share within each role; returns the number of moves"""
+        moves = 0
+        for staff in self.staff.values():
+            for _ in range(self.days):
+                ordered = sorted(staff, key=self.excess)
+                moved = False
+                for busy in reversed(ordered):
+                    if self.excess(busy) - self.excess(ordered[0]) <= 1:
+                        break
+                    for idle in ordered:
+                        if self.excess(busy) - self.excess(idle) <= 1:
+                            break
+                        if self._give(busy, idle):
+                            moves += 1
+                            moved = True
+                            break
+                if not moved:
+                    break
+        return moves
+
+    def solve(self):
+        """Greedy pass then local search; returns the number of local search moves"""
+        self.greedy()
+        return self.repair() + self.balance()
+
+    def deficits(self):
+        """``(day, shift code, role, missing)`` for every shift short of its minimum"""
+        result = []
+        for d in range(self.days):
+            for code, role in sorted(self.requirements):
+                missing = self.short(d, code, role)
+                if missing > 0:
+                    result.append((d, code, role, missing))
+        return result
+
+
+def generate_roster(start, days, save=True):
+    """
+    Roster the active nurses and doctors for ``days`` days from ``start``.
+
+    Returns a dict with the ``shifts`` created (not saved if ``save`` is
+    False), the ``deficits`` left as ``(date, shift type, role,
+    missing)``, and the number of local search ``moves``.
+    """
+    end = start + timedelta(days=days - 1)
+    staff = list(User.objects.filter(profile__role__in=ROLES, is_active=True).order_by(
+        'profile__role', 'pk'
+    ).values_list('pk', 'profile__role'))
+    position = {pk: i for i, (pk, _) in enumerate(staff)}
+
+    leave = {
+        (position[user_id], (day - start).days)
+        for user_id, day in Attendance.objects.filter(
+            status='leave', date__gte=start, date__lte=end, user__profile__role__in=ROLES, user__is_active=True
+        ).values_list('user_id', 'date')
+    }
+    fixed, before = {}, {}
+    for user_id, day, shift_type in Shift.objects.filter(
+        shift_date__gte=start - timedelta(days=1), shift_date__lte=end,
+        user__profile__role__in=ROLES, user__is_active=True
+    ).values_list('user_id', 'shift_date', 'shift_type'):
+        if day < start:
+            before[position[user_id]] = CODES[shift_type]
+        else:
+            fixed[position[user_id], (day - start).days] = CODES[shift_type]
+
+    roster = Roster([role for _, role in staff], days, requirements(), leave, fixed, before)
+    moves = roster.solve()
+
+    shifts = []
+    for i, row in enumerate(roster.grid):
+        for d, code in enumerate(row):
+            if code > OFF and (i, d) not in roster.locked:
+                shift_type = SHIFT_TYPES[code - 1]
+                start_time, end_time = SHIFT_TIMES[shift_type]
+                shifts.append(Shift(
+                    user_id=staff[i][0], shift_type=shift_type, shift_date=start + timedelta(days=d),
+                    start_time=start_time, end_time=end_time
+                ))
+    if save:
+        # A shift someone added meanwhile wins over the generated one
+        Shift.objects.bulk_create(shifts, batch_size=1000, ignore_conflicts=True)
+        coverage.days_changed({shift.shift_date for shift in shifts})
+    return {
+        'shifts': shifts,
+        'deficits': [
+            (start + timedelta(days=d), SHIFT_TYPES[code - 1], role, missing)
+            for d, code, role, missing in roster.deficits()
+        ],
+        'moves': moves,
+    }
+
+
+def roster_matrix(start, days, role=None):
+    """
+    Shifts from ``start`` for ``days`` days as a staff × day table.
+
+    Returns a dict with ``days``, ``rows`` (``{'user', 'cells',
+    'totals'}``, cells being ``(shift type, letter)``) and ``coverage``
+    (``(shift label, [(staffed, required), ...])`` per shift type, for
+    the role or for nurses and doctors together).
+    """
+    dates = [start + timedelta(days=offset) for offset in range(days)]
+    roles = [role] if role else ROLES
+    staff = User.objects.filter(profile__role__in=roles, is_active=True).select_related('profile')
+    staff = list(staff.order_by('profile__role', 'first_name', 'last_name', 'pk'))
+    cells = {user.pk: [('', '')] * days for user in staff}
+    counts = defaultdict(int)
+    for user_id, day, shift_type in Shift.objects.filter(
+        user__profile__role__in=roles, user__is_active=True, shift_date__gte=start, shift_date__lte=dates[-1]
+    ).values_list('user_id', 'shift_date', 'shift_type'):
+        cells[user_id][(day - start).days] = (shift_type, LETTERS.get(shift_type, '?'))
+        counts[(day - start).days, shift_type] += 1
+
+    required = requirements()
+    coverage = []
+    for shift_type, label in Shift.SHIFT_CHOICES:
+        minimum = sum(required.get((CODES[shift_type], r), 0) for r in roles)
+        coverage.append((label, [(counts[d, shift_type], minimum) for d in range(days)]))
+
+    rows = []
+    for user in staff:
+        row = cells[user.pk]
+        rows.append({
+            'user': user,
+            'cells': row,
+            'totals': {shift_type: sum(1 for cell, _ in row if cell == shift_type) for shift_type in SHIFT_TYPES},
+        })
+    return {'days': dates, 'rows': rows, 'coverage': coverage}
@@ -0,0 +1,186 @@
+"""
+Full-text search over OPD and IPD clinical notes.
+
+Notes are mirrored into an SQLite FTS5 table that is kept in sync from
+model signals. Queries use the FTS5 syntax directly, so boolean
+operators (``dengue AND fever``, ``NOT malaria``), phrases
+(``"chest pain"``) and prefixes (``diab*``) all work.
+"""
+from datetime import datetime, time, timedelta
+from django.db import connection, transaction, DatabaseError
+from django.utils import timezone
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from .models import OPDRecord, IPDRecord
+
+FTS_TABLE = 'core_clinical_fts'
+
+# rowid = record pk * 2 + source, so OPD and IPD records never collide
+SOURCE_OPD = 0
+SOURCE_IPD = 1
+
+CREATE_SQL = f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        symptoms, diagnosis, treatment,
+        source UNINDEXED, record_id UNINDEXED, patient_id UNINDEXED,
+        doctor_id UNINDEXED, note_date UNINDEXED,
+        tokenize='porter unicode61', prefix='3'
+    )
+"""
+DROP_SQL = f"DROP TABLE IF EXISTS {FTS_TABLE}"
+
+INSERT_SQL = f"""
+    INSERT INTO {FTS_TABLE} (rowid, symptoms, diagnosis, treatment, source,
+                             record_id, patient_id, doctor_id, note_date)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+DELETE_SQL = f"DELETE FROM {FTS_TABLE} WHERE rowid = %s"
+
+# Highlight markers that cannot appear in user text; swapped for <mark>
+# after the snippet has been HTML-escaped.
+MARK_START = '\x02'
+MARK_END = '\x03'
+
+# Diagnosis matches rank above symptom and treatment matches
+COLUMN_WEIGHTS = '1.0, 2.0, 1.0'
+
+
+def is_available():
+    return connection.vendor == 'sqlite'
+
+
+def _row(source, pk, symptoms, diagnosis, treatment, patient_id, doctor_id, note_date):
+    return (
+        pk * 2 + source, symptoms or '', diagnosis or '', treatment or '',
+        source, pk, patient_id, doctor_id, int(note_date.timestamp())
+    )
+
+
+def _opd_row(values):
+    pk, patient_id, doctor_id, visit_date, symptoms, diagnosis, prescription = values
+    return _row(SOURCE_OPD, pk, symptoms, diagnosis, prescription, patient_id, doctor_id, visit_date)
+
+
+def _ipd_row(values):
+    pk, patient_id, doctor_id, admission_date, diagnosis, treatment_notes = values
+    return _row(SOURCE_IPD, pk, '', diagnosis, treatment_notes, patient_id, doctor_id, admission_date)
+
+
+OPD_FIELDS = ('pk', 'patient_id', 'doctor_id', 'visit_date', 'symptoms', 'diagnosis', 'prescription')
+IPD_FIELDS = ('pk', 'patient_id', 'doctor_id', 'admission_date', 'diagnosis', 'treatment_notes')
+
+
+def index_record(record):
+    """Insert or refresh a single OPD/IPD record in the index"""
+    if not is_available():
+        return
+    if isinstance(record, OPDRecord):
+        row = _opd_row([getattr(record, f) for f in OPD_FIELDS])
+    else:
+        row = _ipd_row([getattr(record, f) for f in IPD_FIELDS])
+
+    with connection.cursor() as cursor:
+        cursor.execute(DELETE_SQL, [row[0]])
+        cursor.execute(INSERT_SQL, row)
+
+
+def unindex_record(record):
+    if not is_available():
+        return
+    source = SOURCE_OPD if isinstance(record, OPDRecord) else SOURCE_IPD
+    with connection.cursor() as cursor:
+        cursor.execute(DELETE_SQL, [record.pk * 2 + source])
+
+
+def rebuild_index(chunk_size=2000):
+    """
+    Re-create the index from every OPD and IPD record.
+
+    Returns ``(opd_count, ipd_count)``.
+    """
+    counts = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(DROP_SQL)
+        cursor.execute(CREATE_SQL)
+        for model, fields, to_row in ((OPDRecord, OPD_FIELDS, _opd_row),
+                                      (IPDRecord, IPD_FIELDS, _ipd_row)):
+            count = 0
+            batch = []
+            for values in model.objects.values_list(*fields).iterator(chunk_size=chunk_size):
+                batch.append(to_row(values))
+                if len(batch) >= chunk_size:
+                    cursor.executemany(INSERT_SQL, batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                cursor.executemany(INSERT_SQL, batch)
+                count += len(batch)
+            counts.append(count)
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    return tuple(counts)
+
+
+def _highlight(snippet):
+    html = escape(snippet).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+    return mark_safe(html)
+
+
+def _day_start(day):
+    return int(timezone.make_aware(datetime.combine(day, time.min)).timestamp())
+
+
+def search(query, date_from=None, date_to=None, doctor_id=None, limit=50):
+    """
+    Run a full-text query and return ranked hits.
+
+    Each hit is a dict with ``source`` ('opd' or 'ipd'), ``record`` (the
+    model instance), ``snippet`` (safe HTML with matches in <mark>) and
+    ``score``. Raises ValueError for malformed queries.
+    """
+    if not query or not is_available():
+        return []
+
+    sql = f"""
+        SELECT source, record_id,
+               snippet({FTS_TABLE}, -1, %s, %s, '…', 16),
+               bm25({FTS_TABLE}, {COLUMN_WEIGHTS}) AS score
+        FROM {FTS_TABLE}
+        WHERE {FTS_TABLE} MATCH %s
+    """
+    params = [MARK_START, MARK_END, query]
+    if date_from:
+        sql += " AND note_date >= %s"
+        params.append(_day_start(date_from))
+    if date_to:
+        sql += " AND note_date < %s"
+        params.append(_day_start(date_to + timedelta(days=1)))
+    if doctor_id:
+        sql += " AND doctor_id = %s"
+        params.append(int(doctor_id))
+    sql += " ORDER BY score LIMIT %s"
+    params.append(limit)
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+    except DatabaseError as e:
+        raise ValueError(f'Invalid search query: {e}')
+
+    opd = OPDRecord.objects.select_related('patient', 'doctor__user').in_bulk(
+        [r[1] for r in rows if r[0] == SOURCE_OPD])
+    ipd = IPDRecord.objects.select_related('patient', 'doctor__user').in_bulk(
+        [r[1] for r in rows if r[0] == SOURCE_IPD])
+
+    hits = []
+    for source, record_id, snippet, score in rows:
+        record = (opd if source == SOURCE_OPD else ipd).get(record_id)
+        if record is None:
+            continue
+        hits.append({
+            'source': 'opd' if source == SOURCE_OPD else 'ipd',
+            'record': record,
+            'snippet': _highlight(snippet),
+            'score': -score,
+        })
+    return hits
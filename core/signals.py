@@ -0,0 +1,116 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import (
+    Appointment, OPDRecord, IPDRecord, Medicine, StockMovement, LabTest, LabTestRequest, Bill, Shift, Attendance, Ward
+)
+from . import coverage, lab_results, performance, revenue, search, stock_alerts
+
+
+# Keep the clinical full-text index in sync with OPD/IPD notes
+@receiver(post_save, sender=OPDRecord)
+@receiver(post_save, sender=IPDRecord)
+def index_clinical_note(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_record(instance)
+
+
+@receiver(post_delete, sender=OPDRecord)
+@receiver(post_delete, sender=IPDRecord)
+def unindex_clinical_note(sender, instance, **kwargs):
+    search.unindex_record(instance)
+
+
+# Re-evaluate stock alerts for medicines whose stock or settings changed
+@receiver(post_save, sender=Medicine)
+def refresh_alerts_on_medicine_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        stock_alerts.refresh_medicine_alerts([instance.pk])
+
+
+@receiver(post_save, sender=StockMovement)
+def refresh_alerts_on_stock_movement(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        stock_alerts.refresh_medicine_alerts([instance.medicine_id])
+
+
+# Structured reference ranges follow LabTest.normal_range
+@receiver(post_save, sender=LabTest)
+def sync_lab_reference_ranges(sender, instance, raw=False, **kwargs):
+    if not raw:
+        lab_results.sync_reference_ranges(instance)
+
+
+# Flag lab results against the reference ranges as they are saved
+@receiver(pre_save, sender=LabTestRequest)
+def flag_lab_result(sender, instance, raw=False, **kwargs):
+    if not raw:
+        lab_results.flag_request(instance)
+
+
+# Move each saved bill's amount between the daily revenue rollups
+@receiver(pre_save, sender=Bill)
+def remember_bill_revenue(sender, instance, raw=False, **kwargs):
+    if not raw:
+        previous = Bill.objects.filter(pk=instance.pk).first() if instance.pk else None
+        instance._revenue_before = revenue.bill_state(previous) if previous else None
+
+
+@receiver(post_save, sender=Bill)
+def update_bill_revenue(sender, instance, raw=False, **kwargs):
+    if not raw:
+        revenue.bills_changed([(getattr(instance, '_revenue_before', None), revenue.bill_state(instance))])
+
+
+@receiver(post_delete, sender=Bill)
+def remove_bill_revenue(sender, instance, **kwargs):
+    revenue.bills_changed([(revenue.bill_state(instance), None)])
+
+
+# Mark the days an appointment, visit or stay counts on (before and after) for the performance cube
+@receiver(pre_save, sender=Appointment)
+@receiver(pre_save, sender=OPDRecord)
+@receiver(pre_save, sender=IPDRecord)
+def remember_performance_days(sender, instance, raw=False, **kwargs):
+    if not raw:
+        previous = sender.objects.filter(pk=instance.pk).first() if instance.pk else None
+        instance._performance_days = performance.record_days(previous) if previous else set()
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_save, sender=OPDRecord)
+@receiver(post_save, sender=IPDRecord)
+@receiver(post_delete, sender=Appointment)
+@receiver(post_delete, sender=OPDRecord)
+@receiver(post_delete, sender=IPDRecord)
+def mark_performance_days(sender, instance, raw=False, **kwargs):
+    if not raw:
+        performance.mark_stale(getattr(instance, '_performance_days', set()) | performance.record_days(instance))
+
+
+# Rebuild the staff coverage index for the days a shift or attendance entry is on (before and after)
+@receiver(pre_save, sender=Shift)
+@receiver(pre_save, sender=Attendance)
+def remember_coverage_day(sender, instance, raw=False, **kwargs):
+    if not raw:
+        field = 'shift_date' if sender is Shift else 'date'
+        instance._coverage_day = sender.objects.filter(pk=instance.pk).values_list(
+            field, flat=True
+        ).first() if instance.pk else None
+
+
+@receiver(post_save, sender=Shift)
+@receiver(post_save, sender=Attendance)
+@receiver(post_delete, sender=Shift)
+@receiver(post_delete, sender=Attendance)
+def refresh_coverage_days(sender, instance, raw=False, **kwargs):
+    if not raw:
+        day = instance.shift_date if sender is Shift else instance.date
+        coverage.days_changed({getattr(instance, '_coverage_day', None), day})
+
+
+# Shift minimums follow the wards' types and beds
+@receiver(post_save, sender=Ward)
+@receiver(post_delete, sender=Ward)
+def refresh_coverage_requirements(sender, instance, raw=False, **kwargs):
+    if not raw:
+        coverage.requirements_changed()
@@ -0,0 +1,158 @@
+"""
+Incrementally maintained low-stock and expiry alerts.
+
+``StockAlert`` holds exactly the medicines that currently need
+attention, so dashboards read the alert set instead of re-scanning the
+catalogue. Alerts are refreshed for the affected medicines whenever
+stock or a medicine changes, and a daily sweep along the
+``Medicine.expiry_date`` index picks up medicines whose expiry has
+come within the alert horizon.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import Medicine, StockAlert
+
+EXPIRY_ALERT_DAYS = 30
+
+
+def _expiry_horizon(on_date=None):
+    return (on_date or timezone.localdate()) + timedelta(days=EXPIRY_ALERT_DAYS)
+
+
+def refresh_medicine_alerts(medicine_ids, on_date=None):
+    """Re-evaluate the alerts of the given medicines only"""
+    medicine_ids = set(medicine_ids)
+    if not medicine_ids:
+        return
+    horizon = _expiry_horizon(on_date)
+
+    wanted = set()
+    for pk, stock, reorder_level, expiry_date in Medicine.objects.filter(
+        pk__in=medicine_ids
+    ).values_list('pk', 'stock_quantity', 'reorder_level', 'expiry_date'):
+        if stock <= reorder_level:
+            wanted.add((pk, 'low_stock'))
+        if stock > 0 and expiry_date < horizon:
+            wanted.add((pk, 'expiring'))
+
+    existing = set(StockAlert.objects.filter(
+        medicine_id__in=medicine_ids
+    ).values_list('medicine_id', 'alert_type'))
+
+    _apply(wanted - existing, existing - wanted)
+
+
+def rebuild_alerts(on_date=None, chunk_size=2000):
+    """Re-evaluate every medicine; for first-time setup and repairs"""
+    ids = list(Medicine.objects.values_list('pk', flat=True))
+    for start in range(0, len(ids), chunk_size):
+        refresh_medicine_alerts(ids[start:start + chunk_size], on_date)
+    return StockAlert.objects.count()
+
+
+def sweep_expiry_alerts(on_date=None):
+    """
+    Daily pass that brings expiry alerts up to date with the calendar.
+
+    Reads only the medicines inside the expiry horizon (a range scan on
+    the expiry_date index) plus the existing expiry alerts.
+    Returns ``(raised, cleared)``.
+    """
+    horizon = _expiry_horizon(on_date)
+    expiring = set(Medicine.objects.filter(
+        expiry_date__lt=horizon,
+        stock_quantity__gt=0
+    ).values_list('pk', flat=True))
+    alerted = set(StockAlert.objects.filter(
+        alert_type='expiring'
+    ).values_list('medicine_id', flat=True))
+
+    raised = {(pk, 'expiring') for pk in expiring - alerted}
+    cleared = {(pk, 'expiring') for pk in alerted - expiring}
+    _apply(raised, cleared)
+    return len(raised), len(cleared)
+
+
+def _apply(raised, cleared):
+    with transaction.atomic():
+        if cleared:
+            condition = Q()
+            for medicine_id, alert_type in cleared:
+                condition |= Q(medicine_id=medicine_id, alert_type=alert_type)
+            StockAlert.objects.filter(condition).delete()
+        if raised:
+            StockAlert.objects.bulk_create(
+                [StockAlert(medicine_id=pk, alert_type=alert_type) for pk, alert_type in raised],
+                ignore_conflicts=True
+            )
+
+
+def active_alerts(alert_type=None):
+    alerts = StockAlert.objects.select_related('medicine').order_by('alert_type', 'medicine__medicine_name')
+    if alert_type:
+        alerts = alerts.filter(alert_type=alert_type)
+    return alerts
+
+
+def alert_counts():
+    """Counts per alert type, read from the alert set only"""
+    counts = dict.fromkeys(dict(StockAlert.ALERT_TYPE_CHOICES), 0)
+    for alert_type in StockAlert.objects.values_list('alert_type', flat=True):
+        counts[alert_type] += 1
+    return counts
+
+
+def _format_alert(alert):
+    medicine = alert.medicine
+    if alert.alert_type == 'low_stock':
+        detail = f'{medicine.stock_quantity} in stock, reorder level {medicine.reorder_level}'
+    else:
+        detail = f'{medicine.stock_quantity} in stock, expires {medicine.expiry_date:%Y-%m-%d}'
+    return f'  - {medicine.medicine_name} ({medicine.medicine_type}): {detail}'
+
+
+def send_alert_digest(outbox_dir=None):
+    """
+    Write a digest of alerts raised since the last digest to the outbox.
+
+    The digest is an email written by Django's file-based email backend
+    into ``STOCK_ALERT_OUTBOX`` and addressed to pharmacists and admins.
+    Returns the number of new alerts included.
+    """
+    with transaction.atomic():
+        new_alerts = list(active_alerts().filter(notified_at__isnull=True))
+        if not new_alerts:
+            return 0
+
+        lines = ['New pharmacy stock alerts:', '']
+        for alert_type, label in StockAlert.ALERT_TYPE_CHOICES:
+            section = [a for a in new_alerts if a.alert_type == alert_type]
+            if section:
+                lines.append(f'{label} ({len(section)}):')
+                lines.extend(_format_alert(a) for a in section)
+                lines.append('')
+        lines.append(f'{StockAlert.objects.count()} alert(s) are active in total.')
+
+        recipients = list(User.objects.filter(
+            profile__role__in=['pharmacist', 'admin'],
+            is_active=True
+        ).exclude(email='').values_list('email', flat=True))
+
+        connection = get_connection(
+            'django.core.mail.backends.filebased.EmailBackend',
+            file_path=outbox_dir or settings.STOCK_ALERT_OUTBOX
+        )
+        EmailMessage(
+            subject=f'[HMS] {len(new_alerts)} new stock alert(s)',
+            body='\n'.join(lines),
+            to=recipients,
+            connection=connection
+        ).send()
+
+        StockAlert.objects.filter(pk__in=[a.pk for a in new_alerts]).update(notified_at=timezone.now())
+    return len(new_alerts)
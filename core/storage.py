@@ -0,0 +1,195 @@
+"""
+Content-addressed storage for report files and profile pictures.
+
+Uploads are streamed in chunks straight to a temporary file next to the
+blob store while their SHA-256 is computed, then renamed into place as
+``blobs/<aa>/<bb>/<sha256><ext>``. A file whose content is already
+stored is not written again; every record uploading it points at the
+same blob, so blobs must never be deleted through a single record.
+
+Downloads go through ``file_response()``, which answers single-range
+requests with 206 responses and otherwise hands the open file to the
+WSGI server's ``file_wrapper`` (``sendfile()`` on most servers), or to
+the front-end server via ``REPORT_SENDFILE_HEADER``.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.deconstruct import deconstructible
+
+CHUNK_SIZE = 1024 * 1024
+BLOB_PREFIX = 'blobs'
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def blob_name(digest, extension=''):
+    return f'{BLOB_PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    @property
+    def temp_dir(self):
+        # Same filesystem as the blobs, so finished uploads are renamed, not copied
+        path = os.path.join(self.location, BLOB_PREFIX, 'tmp')
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def get_available_name(self, name, max_length=None):
+        # The stored name comes from the content hash in _save()
+        return name
+
+    def _spool(self, content):
+        """Copy ``content`` into a temp file, hashing as it goes"""
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(suffix='.upload', dir=self.temp_dir)
+        with os.fdopen(fd, 'wb') as temp_file:
+            for chunk in content.chunks(CHUNK_SIZE):
+                digest.update(chunk)
+                temp_file.write(chunk)
+        return temp_path, digest.hexdigest()
+
+    def _save(self, name, content):
+        hashed = isinstance(content, HashedUploadedFile) and os.path.dirname(
+            content.temporary_file_path()
+        ) == self.temp_dir
+        if hashed:
+            temp_path, digest = content.temporary_file_path(), content.sha256
+        else:
+            temp_path, digest = self._spool(content)
+
+        name = blob_name(digest, os.path.splitext(name)[1].lower())
+        path = self.path(name)
+        if os.path.exists(path):
+            os.unlink(temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+            os.chmod(path, self.file_permissions_mode or 0o644)
+        return name
+
+
+def report_storage():
+    return ContentAddressedStorage()
+
+
+class HashedUploadedFile(UploadedFile):
+    """An upload written to a temp file in the blob store, with its SHA-256"""
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None, temp_dir=None):
+        file = tempfile.NamedTemporaryFile(suffix='.upload', dir=temp_dir or report_storage().temp_dir)
+        super().__init__(file, name, content_type, size, charset, content_type_extra)
+        self._digest = hashlib.sha256()
+
+    def write(self, data):
+        self._digest.update(data)
+        return self.file.write(data)
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+    def temporary_file_path(self):
+        return self.file.name
+
+    def close(self):
+        try:
+            return self.file.close()
+        except FileNotFoundError:
+            # The temp file was already moved into the store
+            pass
+
+
+class HashingFileUploadHandler(FileUploadHandler):
+    """Streams every uploaded file to disk in 1 MB chunks while hashing it"""
+
+    chunk_size = CHUNK_SIZE
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file = HashedUploadedFile(
+            self.file_name, self.content_type, 0, self.charset, self.content_type_extra
+        )
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.seek(0)
+        self.file.size = file_size
+        return self.file
+
+    def upload_interrupted(self):
+        if hasattr(self, 'file'):
+            self.file.close()
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def file_response(request, field_file, filename=None, as_attachment=False):
+    """
+    Serve a stored file, honouring a single ``Range: bytes=`` header.
+
+    With ``REPORT_SENDFILE_HEADER`` set to ``X-Sendfile`` or
+    ``X-Accel-Redirect`` the body (and any range) is left to the
+    front-end server.
+    """
+    path = field_file.path
+    filename = filename or os.path.basename(field_file.name)
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    disposition = 'attachment' if as_attachment else 'inline'
+
+    sendfile_header = getattr(settings, 'REPORT_SENDFILE_HEADER', None)
+    if sendfile_header:
+        response = HttpResponse(content_type=content_type)
+        if sendfile_header == 'X-Accel-Redirect':
+            response[sendfile_header] = settings.REPORT_SENDFILE_URL + field_file.name
+        else:
+            response[sendfile_header] = path
+        response['Content-Disposition'] = f'{disposition}; filename="{filename}"'
+        return response
+
+    size = os.path.getsize(path)
+    match = RANGE_RE.match(request.headers.get('Range', ''))
+    if match and any(match.groups()):
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start, end = max(size - int(last), 0), size - 1
+        if start >= size or start > end:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        response = StreamingHttpResponse(
+            _read_range(path, start, end - start + 1), status=206, content_type=content_type
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    else:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+        response.block_size = CHUNK_SIZE
+
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = f'{disposition}; filename="{filename}"'
+    return response
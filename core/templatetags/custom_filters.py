@@ -1,5 +1,6 @@
 from django import template
 from datetime import date
+from core import thumbnails
 
 register = template.Library()
 
@@ -12,3 +13,15 @@ def calculate_age(birth_date):
     today = date.today()
     age = today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day))
     return age
+
+@register.filter
+def thumbnail(field_file, size='thumb'):
+    """URL of an image's rendered thumbnail; the original until it is ready"""
+    if not field_file:
+        return ''
+    return thumbnails.thumbnail_url(field_file, size) or field_file.url
+
+@register.filter
+def has_thumbnail(field_file, size='thumb'):
+    """Whether a preview has been rendered for a stored file"""
+    return thumbnails.thumbnail_file(field_file, size) is not None
@@ -1,3 +1,2060 @@
-from django.test import TestCase
+import hashlib
+import io
+import os
+import tempfile
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from .models import *
+from . import analytics, attendance, billing, census, columnar, coverage, discharge, forecasting, invoices, lab_results, lab_tat, laboratory, performance, pharmacy, revenue, roster, search, stock_alerts, thumbnails
+from .vitals import build_vitals_matrix, early_warning_scores, scan_vitals
 
-# Create your tests here.
+
+def make_doctor(username='doc', fee=Decimal('500.00')):
+    user = User.objects.create_user(username=username, password='pass', first_name='Greg', last_name='House')
+    UserProfile.objects.create(user=user, role='doctor')
+    return Doctor.objects.create(
+        user=user,
+        specialization='General Medicine',
+        qualification='MBBS',
+        consultation_fee=fee,
+        available_days='Mon, Wed, Fri',
+        available_time_start=time(9, 0),
+        available_time_end=time(17, 0)
+    )
+
+
+def make_patient(patient_id='PAT00000001'):
+    return Patient.objects.create(
+        patient_id=patient_id,
+        first_name='John',
+        last_name='Doe',
+        gender='M',
+        date_of_birth='1980-01-01',
+        blood_group='O+',
+        phone='9999999999',
+        address='Street 1',
+        emergency_contact='8888888888',
+        emergency_contact_name='Jane Doe'
+    )
+
+
+def make_admission(doctor, patient, ipd_number='IPD00000001', bed_number='1', ward=None):
+    if ward is None:
+        ward = Ward.objects.create(
+            ward_name='Ward A', ward_type='General', floor=1, total_beds=10,
+            charge_per_day=Decimal('1000.00')
+        )
+    bed = Bed.objects.create(ward=ward, bed_number=bed_number, status='occupied')
+    return IPDRecord.objects.create(
+        ipd_number=ipd_number,
+        patient=patient,
+        doctor=doctor,
+        bed=bed,
+        admission_date=timezone.now() - timedelta(days=2),
+        diagnosis='Pneumonia'
+    )
+
+
+class VitalsScanTests(TestCase):
+    def test_matrix_keeps_latest_readings_right_aligned(self):
+        record_ids = np.array([1, 1, 1, 2])
+        values = np.arange(20, dtype=float).reshape(4, 5)
+        patients, matrix = build_vitals_matrix(record_ids, values, window=2)
+
+        self.assertEqual(list(patients), [1, 2])
+        np.testing.assert_array_equal(matrix[0], values[1:3])
+        self.assertTrue(np.isnan(matrix[1, 0]).all())
+        np.testing.assert_array_equal(matrix[1, 1], values[3])
+
+    def test_scores_bands_and_trend(self):
+        normal = [16, 97, 120, 75, 36.8]
+        septic = [26, 90, 88, 135, 39.5]
+        matrix = np.array([[normal, normal], [normal, septic]], dtype=float)
+        totals, param_scores, _ = early_warning_scores(matrix)
+
+        self.assertEqual(totals[0], 0)
+        # 3 points per band for each parameter plus the trend bonus,
+        # except temperature which tops out at 2 + 1
+        self.assertEqual(list(param_scores[1]), [4, 4, 4, 4, 3])
+
+    def test_missing_values_score_zero(self):
+        matrix = np.full((1, 3, 5), np.nan)
+        totals, _, _ = early_warning_scores(matrix)
+        self.assertEqual(totals[0], 0)
+
+    def test_scan_publishes_ranked_alerts_for_admitted_patients(self):
+        doctor = make_doctor()
+        stable = make_admission(doctor, make_patient('PAT1'), 'IPD1', '1')
+        sick = make_admission(doctor, make_patient('PAT2'), 'IPD2', '2', ward=stable.bed.ward)
+        discharged = make_admission(doctor, make_patient('PAT3'), 'IPD3', '3', ward=stable.bed.ward)
+        discharged.status = 'discharged'
+        discharged.save()
+
+        for record in (stable, sick, discharged):
+            VitalSign.objects.create(ipd_record=record, respiratory_rate=16, spo2=97,
+                                     systolic_bp=120, pulse=75, temperature=Decimal('36.8'))
+        for record in (sick, discharged):
+            VitalSign.objects.create(ipd_record=record, respiratory_rate=27, spo2=90,
+                                     systolic_bp=85, pulse=130, temperature=Decimal('38.5'))
+
+        self.assertEqual(scan_vitals(), 1)
+        alert = VitalsAlert.objects.get()
+        self.assertEqual(alert.ipd_record, sick)
+        self.assertEqual(alert.risk, 'high')
+        self.assertIn('RR 27', alert.summary)
+
+
+class ClinicalSearchTests(TestCase):
+    def setUp(self):
+        self.doctor = make_doctor()
+        self.other_doctor = make_doctor('doc2')
+        self.patient = make_patient()
+        self.dengue = OPDRecord.objects.create(
+            opd_number='OPD1', patient=self.patient, doctor=self.doctor,
+            symptoms='High fever with joint pain', diagnosis='Dengue fever',
+            prescription='Paracetamol 500mg'
+        )
+        self.malaria = OPDRecord.objects.create(
+            opd_number='OPD2', patient=self.patient, doctor=self.other_doctor,
+            symptoms='Fever and chills', diagnosis='Malaria', prescription='Chloroquine'
+        )
+        self.admission = make_admission(self.doctor, self.patient)
+        self.admission.treatment_notes = 'IV fluids for severe dengue'
+        self.admission.save()
+
+    def test_index_follows_saves_and_deletes(self):
+        hits = search.search('dengue')
+        self.assertEqual({(h['source'], h['record'].pk) for h in hits},
+                         {('opd', self.dengue.pk), ('ipd', self.admission.pk)})
+
+        self.dengue.diagnosis = 'Viral fever'
+        self.dengue.save()
+        self.malaria.delete()
+        self.assertEqual([h['source'] for h in search.search('dengue')], ['ipd'])
+        self.assertEqual(search.search('malaria'), [])
+
+    def test_boolean_phrase_and_doctor_filters(self):
+        self.assertEqual([h['record'] for h in search.search('fever NOT dengue')], [self.malaria])
+        self.assertEqual([h['record'] for h in search.search('"joint pain"')], [self.dengue])
+        hits = search.search('fever', doctor_id=self.other_doctor.pk)
+        self.assertEqual([h['record'] for h in hits], [self.malaria])
+
+    def test_date_filter(self):
+        yesterday = timezone.localdate() - timedelta(days=1)
+        self.assertEqual(len(search.search('dengue', date_to=yesterday)), 1)
+        self.assertEqual(len(search.search('dengue', date_from=timezone.localdate())), 1)
+
+    def test_snippet_is_escaped_and_highlighted(self):
+        self.dengue.symptoms = '<script>alert(1)</script> dengue'
+        self.dengue.save()
+        snippet = search.search('dengue', doctor_id=self.doctor.pk)[0]['snippet']
+        self.assertIn('&lt;script&gt;', snippet)
+        self.assertIn('<mark>', snippet)
+
+    def test_invalid_query_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            search.search('"unterminated')
+
+    def test_rebuild_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {search.FTS_TABLE}")
+        self.assertEqual(search.search('dengue'), [])
+        self.assertEqual(search.rebuild_index(), (2, 1))
+        self.assertEqual(len(search.search('dengue')), 2)
+
+
+def make_medicine(name='Paracetamol', stock=100, price=Decimal('2.50'), **kwargs):
+    return Medicine.objects.create(
+        medicine_name=name,
+        medicine_type='Tablet',
+        manufacturer='Acme',
+        unit_price=price,
+        stock_quantity=stock,
+        expiry_date=kwargs.pop('expiry_date', timezone.localdate() + timedelta(days=365)),
+        **kwargs
+    )
+
+
+def make_prescription(doctor, patient, items, number='RX1'):
+    prescription = PharmacyPrescription.objects.create(
+        prescription_number=number, patient=patient, doctor=doctor
+    )
+    for medicine, quantity in items:
+        PrescriptionItem.objects.create(
+            prescription=prescription, medicine=medicine, quantity=quantity,
+            dosage='1-0-1', duration='5 days', unit_price=medicine.unit_price
+        )
+    return prescription
+
+
+class DispenseTests(TestCase):
+    def setUp(self):
+        self.doctor = make_doctor()
+        self.patient = make_patient()
+        self.pharmacist = User.objects.create_user(username='pharma', password='pass')
+
+    def test_dispense_decrements_stock_and_writes_ledger(self):
+        paracetamol = make_medicine(stock=20)
+        amoxicillin = make_medicine('Amoxicillin', stock=10)
+        prescription = make_prescription(self.doctor, self.patient, [
+            (paracetamol, 5), (amoxicillin, 4), (paracetamol, 3)
+        ])
+
+        dispensed = pharmacy.dispense_prescription(prescription.pk, self.pharmacist)
+
+        self.assertEqual(dispensed.status, 'dispensed')
+        self.assertEqual(dispensed.dispensed_by, self.pharmacist)
+        self.assertIsNotNone(dispensed.dispensed_date)
+        paracetamol.refresh_from_db()
+        amoxicillin.refresh_from_db()
+        self.assertEqual((paracetamol.stock_quantity, amoxicillin.stock_quantity), (12, 6))
+        self.assertEqual(
+            sorted(prescription.stock_movements.values_list('medicine_id', 'quantity')),
+            sorted([(paracetamol.pk, -8), (amoxicillin.pk, -4)])
+        )
+
+    def test_shortfall_rolls_back_whole_dispense(self):
+        paracetamol = make_medicine(stock=20)
+        amoxicillin = make_medicine('Amoxicillin', stock=1)
+        prescription = make_prescription(self.doctor, self.patient, [(paracetamol, 5), (amoxicillin, 4)])
+
+        with self.assertRaises(pharmacy.InsufficientStock):
+            pharmacy.dispense_prescription(prescription.pk, self.pharmacist)
+
+        paracetamol.refresh_from_db()
+        prescription.refresh_from_db()
+        self.assertEqual(paracetamol.stock_quantity, 20)
+        self.assertEqual(prescription.status, 'pending')
+        self.assertFalse(StockMovement.objects.exists())
+
+    def test_prescription_cannot_be_dispensed_twice(self):
+        prescription = make_prescription(self.doctor, self.patient, [(make_medicine(), 1)])
+        pharmacy.dispense_prescription(prescription.pk, self.pharmacist)
+        with self.assertRaises(pharmacy.PrescriptionNotPending):
+            pharmacy.dispense_prescription(prescription.pk, self.pharmacist)
+
+    def test_ledger_is_append_only(self):
+        movement = StockMovement.objects.create(medicine=make_medicine(), movement_type='restock', quantity=5)
+        with self.assertRaises(ValueError):
+            movement.save()
+        with self.assertRaises(ValueError):
+            movement.delete()
+
+
+class ParallelDispenseTests(TransactionTestCase):
+    def test_parallel_dispenses_never_oversell(self):
+        doctor = make_doctor()
+        patient = make_patient()
+        pharmacist = User.objects.create_user(username='pharma', password='pass')
+        medicine = make_medicine(stock=50)
+        prescriptions = [
+            make_prescription(doctor, patient, [(medicine, 3)], number=f'RX{i}')
+            for i in range(40)
+        ]
+
+        def dispense(prescription):
+            try:
+                pharmacy.dispense_prescription(prescription.pk, pharmacist)
+                return True
+            except pharmacy.InsufficientStock:
+                return False
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(dispense, prescriptions))
+
+        medicine.refresh_from_db()
+        self.assertEqual(results.count(True), 16)
+        self.assertEqual(medicine.stock_quantity, 2)
+        self.assertEqual(PharmacyPrescription.objects.filter(status='dispensed').count(), 16)
+        self.assertEqual(
+            StockMovement.objects.filter(medicine=medicine).aggregate(total=Sum('quantity'))['total'],
+            -48
+        )
+
+
+class BatchAllocationTests(TestCase):
+    def setUp(self):
+        self.doctor = make_doctor()
+        self.patient = make_patient()
+        self.pharmacist = User.objects.create_user(username='pharma', password='pass')
+        self.medicine = make_medicine(stock=0)
+        self.today = timezone.localdate()
+
+    def receive(self, number, days, quantity):
+        return pharmacy.receive_batch(self.medicine.pk, number, self.today + timedelta(days=days), quantity)
+
+    def test_dispense_fills_earliest_unexpired_batches_first(self):
+        expired = self.receive('B0', -1, 50)
+        soon = self.receive('B1', 10, 4)
+        later = self.receive('B2', 200, 50)
+        middle = self.receive('B3', 40, 5)
+        prescription = make_prescription(self.doctor, self.patient, [(self.medicine, 6), (self.medicine, 5)])
+
+        pharmacy.dispense_prescription(prescription.pk, self.pharmacist)
+
+        quantities = dict(MedicineBatch.objects.values_list('batch_number', 'quantity'))
+        self.assertEqual(quantities, {'B0': 50, 'B1': 0, 'B2': 48, 'B3': 0})
+        self.assertEqual(
+            sorted(prescription.stock_movements.values_list('batch_id', 'quantity')),
+            sorted([(soon.pk, -4), (middle.pk, -5), (later.pk, -2)])
+        )
+        self.medicine.refresh_from_db()
+        self.assertEqual(self.medicine.stock_quantity, 98)
+        # The expired batch is still on hand, so the medicine shows as expired
+        self.assertEqual(self.medicine.expiry_date, expired.expiry_date)
+
+    def test_allocation_pages_through_many_batches(self):
+        for i in range(25):
+            self.receive(f'B{i:02d}', 10 + i, 2)
+        with transaction.atomic():
+            allocations = pharmacy.allocate_batches(self.medicine.pk, 45)
+        self.assertEqual(len(allocations), 23)
+        self.assertEqual(sum(units for _, units in allocations), 45)
+
+    def test_expired_batches_do_not_count_towards_stock(self):
+        self.receive('B0', -1, 50)
+        self.receive('B1', 10, 4)
+        prescription = make_prescription(self.doctor, self.patient, [(self.medicine, 10)])
+
+        with self.assertRaises(pharmacy.InsufficientStock) as cm:
+            pharmacy.dispense_prescription(prescription.pk, self.pharmacist)
+        self.assertEqual(cm.exception.available, 4)
+        self.assertEqual(MedicineBatch.objects.get(batch_number='B1').quantity, 4)
+
+    def test_unbatched_stock_is_dispensed_after_the_batches(self):
+        Medicine.objects.filter(pk=self.medicine.pk).update(stock_quantity=100)
+        batch = self.receive('B1', 10, 10)
+        prescription = make_prescription(self.doctor, self.patient, [(self.medicine, 50)])
+
+        pharmacy.dispense_prescription(prescription.pk, self.pharmacist)
+
+        self.assertEqual(
+            sorted(prescription.stock_movements.values_list('batch_id', 'quantity'), key=str),
+            sorted([(batch.pk, -10), (None, -40)], key=str)
+        )
+        self.medicine.refresh_from_db()
+        self.assertEqual(self.medicine.stock_quantity, 60)
+
+        prescription = make_prescription(self.doctor, self.patient, [(self.medicine, 61)], number='RX-2')
+        with self.assertRaises(pharmacy.InsufficientStock):
+            pharmacy.dispense_prescription(prescription.pk, self.pharmacist)
+
+    def test_added_medicine_stock_is_an_opening_batch(self):
+        UserProfile.objects.create(user=self.pharmacist, role='pharmacist')
+        self.client.force_login(self.pharmacist)
+        self.client.post(reverse('medicine_add'), {
+            'medicine_name': 'Ibuprofen', 'medicine_type': 'tablet', 'manufacturer': 'Acme',
+            'unit_price': '2.00', 'stock_quantity': '30', 'reorder_level': '5',
+            'expiry_date': str(self.today + timedelta(days=100)),
+        })
+        medicine = Medicine.objects.get(medicine_name='Ibuprofen')
+        self.assertEqual(medicine.stock_quantity, 30)
+        self.assertEqual(list(medicine.batches.values_list('batch_number', 'quantity')), [('OPENING', 30)])
+
+    def test_corrections_keep_batches_in_step(self):
+        self.receive('B1', 10, 10)
+        self.receive('B2', 20, 10)
+        pharmacy.correct_stock(self.medicine.pk, -12)
+        self.assertEqual(dict(MedicineBatch.objects.values_list('batch_number', 'quantity')), {'B1': 0, 'B2': 8})
+        pharmacy.correct_stock(self.medicine.pk, 5)
+        self.medicine.refresh_from_db()
+        self.assertEqual(self.medicine.stock_quantity, 13)
+        with self.assertRaises(pharmacy.InsufficientStock):
+            pharmacy.correct_stock(self.medicine.pk, -14)
+
+    def test_expiry_horizon_report(self):
+        other = make_medicine('Amoxicillin', stock=0)
+        self.receive('B0', -5, 3)
+        self.receive('B1', 10, 4)
+        self.receive('B2', 45, 5)
+        self.receive('B3', 80, 6)
+        self.receive('B4', 365, 7)
+        pharmacy.receive_batch(other.pk, 'X1', self.today + timedelta(days=20), 8)
+
+        with self.assertNumQueries(1):
+            rows = pharmacy.expiry_horizon_report()
+
+        by_medicine = {row['medicine_id']: row for row in rows}
+        row = by_medicine[self.medicine.pk]
+        self.assertEqual(
+            (row['expired'], row['within_30'], row['within_60'], row['within_90']),
+            (3, 4, 9, 15)
+        )
+        self.assertEqual(by_medicine[other.pk]['within_30'], 8)
+
+
+class StockAlertTests(TestCase):
+    def setUp(self):
+        self.today = timezone.localdate()
+
+    def alerts(self):
+        return set(StockAlert.objects.values_list('medicine__medicine_name', 'alert_type'))
+
+    def test_alerts_follow_stock_changes(self):
+        medicine = make_medicine(stock=12, reorder_level=10)
+        self.assertEqual(self.alerts(), set())
+
+        with transaction.atomic():
+            pharmacy.adjust_stock(medicine.pk, -3, 'adjustment')
+        self.assertEqual(self.alerts(), {('Paracetamol', 'low_stock')})
+
+        with transaction.atomic():
+            pharmacy.adjust_stock(medicine.pk, 50, 'restock')
+        self.assertEqual(self.alerts(), set())
+
+    def test_dispense_refreshes_alerts(self):
+        medicine = make_medicine(stock=12, reorder_level=10)
+        prescription = make_prescription(make_doctor(), make_patient(), [(medicine, 5)])
+        pharmacy.dispense_prescription(prescription.pk, None)
+        self.assertEqual(self.alerts(), {('Paracetamol', 'low_stock')})
+
+    def test_daily_sweep_raises_and_clears_expiry_alerts(self):
+        make_medicine('Near', stock=50, expiry_date=self.today + timedelta(days=40))
+        make_medicine('Far', stock=50, expiry_date=self.today + timedelta(days=400))
+        make_medicine('Empty', stock=0, expiry_date=self.today + timedelta(days=5))
+        self.assertEqual(self.alerts(), {('Empty', 'low_stock')})
+        StockAlert.objects.all().delete()
+
+        self.assertEqual(stock_alerts.sweep_expiry_alerts(self.today + timedelta(days=15)), (1, 0))
+        self.assertEqual(self.alerts(), {('Near', 'expiring')})
+        self.assertEqual(stock_alerts.sweep_expiry_alerts(self.today), (0, 1))
+        self.assertEqual(self.alerts(), set())
+
+    def test_digest_is_written_once_per_alert(self):
+        admin = User.objects.create_user(username='boss', email='boss@example.com', password='pass')
+        UserProfile.objects.create(user=admin, role='admin')
+        make_medicine(stock=1)
+
+        with tempfile.TemporaryDirectory() as outbox:
+            self.assertEqual(stock_alerts.send_alert_digest(outbox), 1)
+            self.assertEqual(stock_alerts.send_alert_digest(outbox), 0)
+            files = os.listdir(outbox)
+            self.assertEqual(len(files), 1)
+            with open(os.path.join(outbox, files[0])) as f:
+                message = f.read()
+        self.assertIn('boss@example.com', message)
+        self.assertIn('Paracetamol (Tablet): 1 in stock, reorder level 10', message)
+
+    def test_dashboard_counts_read_alert_set(self):
+        make_medicine(stock=1)
+        with self.assertNumQueries(1):
+            counts = stock_alerts.alert_counts()
+        self.assertEqual(counts, {'low_stock': 1, 'expiring': 0})
+
+
+class ReorderForecastTests(TestCase):
+    def test_flat_demand(self):
+        demand = np.full((1, 56), 10, dtype=np.float32)
+        daily, reorder_points, order_quantities = forecasting.forecast_reorder_points(
+            demand, date(2024, 1, 1), lead_time=7, review_period=30
+        )
+        self.assertAlmostEqual(float(daily[0]), 10.0, places=4)
+        self.assertEqual(int(reorder_points[0]), 70)
+        self.assertEqual(int(order_quantities[0]), 300)
+
+    def test_weekday_seasonality_and_no_history(self):
+        # Demand only on Mondays; 2024-01-01 is a Monday
+        demand = np.zeros((2, 28), dtype=np.float32)
+        demand[0, ::7] = 70
+        daily, reorder_points, _ = forecasting.forecast_reorder_points(
+            demand, date(2024, 1, 1), lead_time=1, review_period=7
+        )
+        self.assertAlmostEqual(float(daily[0]), 10.0, places=4)
+        # The next day is a Monday, so one day of lead time needs a full
+        # Monday's demand plus safety stock
+        self.assertGreaterEqual(int(reorder_points[0]), 70)
+        self.assertEqual((float(daily[1]), int(reorder_points[1])), (0.0, 0))
+
+    def test_suggestions_written_back_from_dispensing_history(self):
+        doctor = make_doctor()
+        patient = make_patient()
+        busy = make_medicine('Busy', stock=10000)
+        idle = make_medicine('Idle', stock=10000, reorder_level=25)
+        now = timezone.now()
+        for day in range(28):
+            prescription = make_prescription(doctor, patient, [(busy, 4), (busy, 1)], number=f'RX{day}')
+            PharmacyPrescription.objects.filter(pk=prescription.pk).update(
+                status='dispensed', dispensed_date=now - timedelta(days=day)
+            )
+
+        self.assertEqual(forecasting.update_reorder_suggestions(history_days=56, apply=True), 2)
+
+        busy.refresh_from_db()
+        idle.refresh_from_db()
+        self.assertEqual((busy.suggested_reorder_level, busy.suggested_reorder_quantity), (35, 150))
+        self.assertEqual(busy.reorder_level, 35)
+        self.assertEqual(idle.suggested_reorder_level, 0)
+        # No dispensing history leaves the configured level alone
+        self.assertEqual(idle.reorder_level, 25)
+        self.assertIsNotNone(busy.forecast_updated_at)
+        # bulk_update skips auto_now; incremental exports rely on updated_at
+        self.assertGreaterEqual(idle.updated_at, now)
+
+
+class PrescriptionBuilderTests(TestCase):
+    def setUp(self):
+        self.doctor = make_doctor()
+        self.patient = make_patient()
+        self.medicines = [make_medicine(f'Med {i}', price=Decimal('1.25') * (i + 1)) for i in range(20)]
+
+    def build(self, count, number):
+        items = [
+            {'medicine_id': m.pk, 'quantity': 2, 'dosage': '1-0-1', 'duration': '5 days'}
+            for m in self.medicines[:count]
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            prescription = pharmacy.create_prescription(number, self.patient.pk, self.doctor.pk, items)
+        return prescription, len(queries)
+
+    def test_query_count_does_not_grow_with_lines(self):
+        _, one_line = self.build(1, 'RX1')
+        prescription, twenty_lines = self.build(20, 'RX20')
+        self.assertEqual(one_line, twenty_lines)
+        self.assertLessEqual(twenty_lines, 6)
+        self.assertEqual(prescription.items.count(), 20)
+
+    def test_totals_computed_in_memory(self):
+        prescription, _ = self.build(3, 'RX3')
+        prescription.refresh_from_db()
+        self.assertEqual(
+            sorted(prescription.items.values_list('total_price', flat=True)),
+            [Decimal('2.50'), Decimal('5.00'), Decimal('7.50')]
+        )
+        self.assertEqual(prescription.total_amount, Decimal('15.00'))
+
+    def test_rejects_unknown_medicine_and_bad_quantity(self):
+        with self.assertRaises(pharmacy.PharmacyError):
+            pharmacy.create_prescription('RX1', self.patient.pk, self.doctor.pk, [
+                {'medicine_id': 999999, 'quantity': 1, 'dosage': '', 'duration': ''}
+            ])
+        with self.assertRaises(pharmacy.PharmacyError):
+            pharmacy.create_prescription('RX1', self.patient.pk, self.doctor.pk, [
+                {'medicine_id': self.medicines[0].pk, 'quantity': 0, 'dosage': '', 'duration': ''}
+            ])
+        with self.assertRaises(pharmacy.PharmacyError):
+            pharmacy.create_prescription('RX1', self.patient.pk, self.doctor.pk, [
+                {'medicine_id': self.medicines[0].pk, 'quantity': 'two', 'dosage': '', 'duration': ''}
+            ])
+        with self.assertRaises(pharmacy.PharmacyError):
+            pharmacy.create_prescription('RX1', self.patient.pk, self.doctor.pk, [
+                {'medicine_id': 'x', 'quantity': 1, 'dosage': '', 'duration': ''}
+            ])
+        self.assertFalse(PharmacyPrescription.objects.exists())
+
+    def test_rejects_missing_patient_and_other_patients_visit(self):
+        items = [{'medicine_id': self.medicines[0].pk, 'quantity': 1, 'dosage': '', 'duration': ''}]
+        for patient_id in (None, '', 999999):
+            with self.assertRaises(pharmacy.PharmacyError):
+                pharmacy.create_prescription('RX1', patient_id, self.doctor.pk, items)
+        visit = OPDRecord.objects.create(
+            opd_number='OPD1', patient=make_patient('PAT00000002'), doctor=self.doctor,
+            symptoms='Fever', diagnosis='Flu', prescription='Rest'
+        )
+        with self.assertRaisesMessage(pharmacy.PharmacyError, 'belongs to another patient'):
+            pharmacy.create_prescription('RX1', self.patient.pk, self.doctor.pk, items, opd_record_id=visit.pk)
+        self.assertFalse(PharmacyPrescription.objects.exists())
+
+
+def make_lab_request(doctor, patient, test, number, priority=3, requested_date=None):
+    lab_request = LabTestRequest.objects.create(
+        request_number=number, patient=patient, doctor=doctor, test=test, priority=priority
+    )
+    if requested_date:
+        LabTestRequest.objects.filter(pk=lab_request.pk).update(requested_date=requested_date)
+    return lab_request
+
+
+class LabWorklistTests(TestCase):
+    def setUp(self):
+        self.doctor = make_doctor()
+        self.patient = make_patient()
+        self.cbc = LabTest.objects.create(test_name='CBC', test_code='CBC', price=Decimal('300.00'))
+        self.lft = LabTest.objects.create(test_name='LFT', test_code='LFT', price=Decimal('600.00'))
+        self.tech = User.objects.create_user(username='tech', password='pass')
+        self.other = User.objects.create_user(username='tech2', password='pass')
+
+    def test_queue_orders_by_priority_then_age(self):
+        now = timezone.now()
+        routine_old = make_lab_request(self.doctor, self.patient, self.cbc, 'L1', 3, now - timedelta(hours=5))
+        stat = make_lab_request(self.doctor, self.patient, self.cbc, 'L2', 1, now - timedelta(hours=1))
+        routine_new = make_lab_request(self.doctor, self.patient, self.cbc, 'L3', 3, now)
+        make_lab_request(self.doctor, self.patient, self.lft, 'L4', 1)
+
+        self.assertEqual(list(laboratory.worklist(self.cbc.pk)), [stat, routine_old, routine_new])
+        self.assertEqual(laboratory.claim_next(self.tech, self.cbc.pk), stat)
+        self.assertEqual(laboratory.claim_next(self.tech, self.cbc.pk), routine_old)
+        self.assertEqual([(t.test_code, n) for t, n in laboratory.queue_counts()], [('CBC', 1), ('LFT', 1)])
+
+    def test_claim_is_exclusive(self):
+        lab_request = make_lab_request(self.doctor, self.patient, self.cbc, 'L1')
+        claimed = laboratory.claim_request(lab_request.pk, self.tech)
+        self.assertEqual((claimed.status, claimed.technician), ('in_progress', self.tech))
+        self.assertIsNotNone(claimed.claimed_date)
+        with self.assertRaises(laboratory.RequestNotPending):
+            laboratory.claim_request(lab_request.pk, self.other)
+        self.assertEqual(list(laboratory.my_open_work(self.tech)), [claimed])
+        self.assertEqual(list(laboratory.my_open_work(self.other)), [])
+
+    def test_release_returns_request_to_queue(self):
+        lab_request = make_lab_request(self.doctor, self.patient, self.cbc, 'L1')
+        laboratory.claim_request(lab_request.pk, self.tech)
+        with self.assertRaises(laboratory.NotClaimedByUser):
+            laboratory.release_request(lab_request.pk, self.other)
+        laboratory.release_request(lab_request.pk, self.tech)
+        self.assertEqual(list(laboratory.worklist()), [lab_request])
+        self.assertIsNone(laboratory.claim_next(self.tech, self.lft.pk))
+
+    def test_update_requires_the_claiming_technician(self):
+        lab_request = make_lab_request(self.doctor, self.patient, self.cbc, 'L1')
+        for user in (self.tech, self.other):
+            UserProfile.objects.create(user=user, role='lab_technician')
+        url = reverse('lab_request_update', args=[lab_request.pk])
+        data = {'status': 'completed', 'result': 'Hb 13.5'}
+
+        self.client.force_login(self.tech)
+        self.assertRedirects(self.client.post(url, data), reverse('lab_worklist'))
+        self.client.post(reverse('lab_request_claim', args=[lab_request.pk]))
+
+        self.client.force_login(self.other)
+        self.client.post(url, data)
+        lab_request.refresh_from_db()
+        self.assertEqual((lab_request.status, lab_request.result), ('in_progress', ''))
+
+        self.client.force_login(self.tech)
+        self.client.post(url, data)
+        lab_request.refresh_from_db()
+        self.assertEqual((lab_request.status, lab_request.technician), ('completed', self.tech))
+        self.assertIsNotNone(lab_request.completed_date)
+
+    def test_unattended_requests_can_be_taken_over_or_released(self):
+        orphan = make_lab_request(self.doctor, self.patient, self.cbc, 'L1')
+        LabTestRequest.objects.filter(pk=orphan.pk).update(status='in_progress')
+        left = make_lab_request(self.doctor, self.patient, self.cbc, 'L2')
+        laboratory.claim_request(left.pk, self.other)
+        self.other.is_active = False
+        self.other.save()
+        held = make_lab_request(self.doctor, self.patient, self.lft, 'L3')
+        laboratory.claim_request(held.pk, self.tech)
+
+        UserProfile.objects.create(user=self.tech, role='lab_technician')
+        self.client.force_login(self.tech)
+        self.client.post(reverse('lab_request_update', args=[orphan.pk]), {'status': 'completed', 'result': 'OK'})
+        orphan.refresh_from_db()
+        self.assertEqual((orphan.status, orphan.technician), ('completed', self.tech))
+        laboratory.release_request(left.pk, self.tech)
+        self.assertEqual(LabTestRequest.objects.get(pk=left.pk).status, 'pending')
+
+        # Admins can return anyone's request to the queue
+        admin = User.objects.create_user('admin')
+        UserProfile.objects.create(user=admin, role='admin')
+        self.client.force_login(admin)
+        self.client.post(reverse('lab_request_release', args=[held.pk]))
+        self.assertEqual(LabTestRequest.objects.get(pk=held.pk).status, 'pending')
+
+
+class LabOrderTests(TestCase):
+    def setUp(self):
+        self.doctor = make_doctor()
+        self.patient = make_patient()
+        self.tests = [
+            LabTest.objects.create(test_name=f'Test {i}', test_code=f'T{i}', price=Decimal('100.00') * (i + 1))
+            for i in range(12)
+        ]
+        self.panel = LabPanel.objects.create(panel_name='Liver', panel_code='LFT')
+        self.panel.tests.set(self.tests[:3])
+
+    def order(self, number, tests=(), panels=()):
+        with CaptureQueriesContext(connection) as queries:
+            requests = laboratory.create_order(
+                number, self.patient.pk, self.doctor.pk,
+                test_ids=[t.pk for t in tests], panel_ids=[p.pk for p in panels]
+            )
+        return requests, len(queries)
+
+    def test_panel_and_tests_share_one_order(self):
+        requests, _ = self.order('LAB1', tests=[self.tests[2], self.tests[5]], panels=[self.panel])
+        saved = LabTestRequest.objects.filter(order_number='LAB1')
+        self.assertEqual(saved.count(), 4)
+        self.assertEqual(
+            sorted(saved.values_list('test__test_code', 'panel_id')),
+            [('T0', self.panel.pk), ('T1', self.panel.pk), ('T2', None), ('T5', None)]
+        )
+        self.assertEqual(laboratory.lab_charges(order_number='LAB1'), Decimal('1200.00'))
+
+        saved.filter(test=self.tests[5]).update(status='cancelled')
+        self.assertEqual(laboratory.lab_charges(order_number='LAB1'), Decimal('600.00'))
+
+    def test_query_count_does_not_grow_with_order_size(self):
+        _, small = self.order('LAB1', tests=self.tests[:1], panels=[self.panel])
+        _, large = self.order('LAB2', tests=self.tests, panels=[self.panel])
+        self.assertEqual(small, large)
+        self.assertEqual(LabTestRequest.objects.filter(order_number='LAB2').count(), 12)
+
+    def test_empty_or_unknown_orders_are_rejected(self):
+        with self.assertRaises(laboratory.LabError):
+            laboratory.create_order('LAB1', self.patient.pk, self.doctor.pk)
+        with self.assertRaises(laboratory.LabError):
+            laboratory.create_order('LAB1', self.patient.pk, self.doctor.pk, test_ids=[999999])
+        self.assertFalse(LabTestRequest.objects.exists())
+
+
+class LabResultFlagTests(TestCase):
+    def setUp(self):
+        self.doctor = make_doctor()
+        self.man = make_patient('PAT1')
+        self.woman = Patient.objects.create(
+            patient_id='PAT2', first_name='Ann', last_name='Lee', gender='F', date_of_birth='1990-05-01',
+            blood_group='A+', phone='1', address='x', emergency_contact='2', emergency_contact_name='y'
+        )
+        self.child = Patient.objects.create(
+            patient_id='PAT3', first_name='Tim', last_name='Lee', gender='M',
+            date_of_birth=timezone.localdate() - timedelta(days=365 * 8),
+            blood_group='A+', phone='1', address='x', emergency_contact='2', emergency_contact_name='y'
+        )
+        self.hb = LabTest.objects.create(
+            test_name='Haemoglobin', test_code='HB', price=Decimal('150.00'),
+            normal_range='M: 13.5-17.5 g/dL; F: 12.0-15.5 g/dL; Child (1-12y): 11-13.5 g/dL; Critical: <7, >20'
+        )
+
+    def result(self, patient, result, number):
+        return LabTestRequest.objects.create(
+            request_number=number, patient=patient, doctor=self.doctor, test=self.hb,
+            status='completed', completed_date=timezone.now(), result=result
+        )
+
+    def test_parse_normal_range_variants(self):
+        ranges = lab_results.parse_normal_range('M: 13.5-17.5 g/dL; F: 12.0-15.5 g/dL; Critical: <7, >20')
+        self.assertEqual(
+            [(r['sex'], r['low'], r['high'], r['unit'], r['critical_low']) for r in ranges],
+            [('M', Decimal('13.5'), Decimal('17.5'), 'g/dL', Decimal('7')),
+             ('F', Decimal('12.0'), Decimal('15.5'), 'g/dL', Decimal('7'))]
+        )
+        (platelets,) = lab_results.parse_normal_range('150,000 - 400,000 /uL')
+        self.assertEqual((platelets['low'], platelets['high']), (Decimal('150000'), Decimal('400000')))
+        (older,) = lab_results.parse_normal_range('Female >50y: <200 mg/dL')
+        self.assertEqual((older['sex'], older['min_age'], older['low'], older['high']), ('F', 51, None, Decimal('200')))
+        self.assertEqual(lab_results.parse_normal_range('Negative'), [])
+        self.assertEqual(self.hb.reference_ranges.count(), 3)
+
+    def test_results_are_flagged_on_save(self):
+        self.assertEqual(self.result(self.man, 'Hb 12.8 g/dL', 'L1').flag, 'low')
+        self.assertEqual(self.result(self.woman, 'Hb 12.8 g/dL', 'L2').flag, 'normal')
+        self.assertEqual(self.result(self.child, '12.8', 'L3').flag, 'normal')
+        self.assertEqual(self.result(self.man, '18.1', 'L4').flag, 'high')
+        critical = self.result(self.woman, '6.2', 'L5')
+        self.assertEqual((critical.flag, critical.numeric_result, critical.result_unit),
+                         ('critical', Decimal('6.2'), 'g/dL'))
+        self.assertEqual(self.result(self.man, 'Haemolysed sample', 'L6').flag, '')
+
+        self.assertEqual(
+            set(lab_results.abnormal_results(self.doctor).values_list('request_number', flat=True)),
+            {'L1', 'L4', 'L5'}
+        )
+
+    def test_bulk_reflag_matches_per_row_flags(self):
+        rows = [
+            self.result(patient, value, f'L{i}')
+            for i, (patient, value) in enumerate([
+                (self.man, '12.8'), (self.woman, '12.8'), (self.child, '12.8'),
+                (self.man, '18.1'), (self.woman, '6.2'), (self.child, '25'),
+            ])
+        ]
+        expected = {row.pk: row.flag for row in rows}
+
+        # Historical rows: text only, no numeric value or flag yet
+        LabTestRequest.objects.update(numeric_result=None, flag='', result_unit='')
+        checked, changed = lab_results.reflag_results()
+        self.assertEqual((checked, changed), (6, 6))
+        self.assertEqual(dict(LabTestRequest.objects.values_list('pk', 'flag')), expected)
+
+        # Tightening the range re-flags only what it affects
+        self.hb.normal_range = 'M: 13.5-17.5 g/dL; F: 13.0-15.5 g/dL; Child (1-12y): 11-13.5 g/dL; Critical: <7, >20'
+        self.hb.save()
+        self.assertEqual(lab_results.reflag_results(), (6, 1))
+        self.assertEqual(LabTestRequest.objects.get(pk=rows[1].pk).flag, 'low')
+
+    def test_ages_in_years_matches_age_on(self):
+        births = [date(1990, 5, 1), date(2000, 2, 29), date(2016, 12, 31)]
+        on_dates = [date(2026, 4, 30), date(2026, 3, 1), date(2026, 12, 31)]
+        self.assertEqual(
+            list(lab_results.ages_in_years(np.array(births, dtype='datetime64[D]'),
+                                           np.array(on_dates, dtype='datetime64[D]'))),
+            [lab_results.age_on(b, d) for b, d in zip(births, on_dates)]
+        )
+
+
+class LabTurnaroundTests(TestCase):
+    def setUp(self):
+        self.doctor = make_doctor()
+        self.patient = make_patient()
+        self.tests = [
+            LabTest.objects.create(test_name=name, test_code=name, price=Decimal('100.00'))
+            for name in ('CBC', 'LFT')
+        ]
+        self.techs = [User.objects.create_user(username=f'tech{i}', password='pass') for i in range(2)]
+
+    def complete(self, number, test, tech, requested, minutes):
+        lab_request = make_lab_request(self.doctor, self.patient, test, number, requested_date=requested)
+        LabTestRequest.objects.filter(pk=lab_request.pk).update(
+            status='completed', technician=tech, completed_date=requested + timedelta(minutes=minutes)
+        )
+        lab_request.refresh_from_db()
+        lab_tat.record_completion(lab_request)
+        return lab_request
+
+    def test_percentiles_track_exact_values(self):
+        minutes = np.random.default_rng(0).lognormal(4, 1, size=5000)
+        histogram = np.bincount(lab_tat.bin_indices(minutes), minlength=lab_tat.BIN_COUNT)
+        estimated = lab_tat.histogram_percentiles(histogram)[0]
+        exact = np.percentile(minutes, [50, 90, 99])
+        np.testing.assert_allclose(estimated, exact, rtol=0.05)
+
+    def test_incremental_rollups_match_rebuild(self):
+        rng = np.random.default_rng(1)
+        start = timezone.now() - timedelta(days=3)
+        for i in range(60):
+            self.complete(
+                f'L{i}', self.tests[i % 2], self.techs[i % 3 % 2],
+                start + timedelta(minutes=int(rng.integers(0, 3 * 24 * 60))), int(rng.integers(5, 600))
+            )
+
+        def snapshot():
+            return sorted(LabTurnaroundRollup.objects.values_list(
+                'period', 'bucket_start', 'test_id', 'technician_id', 'count', 'histogram'
+            ))
+
+        incremental = snapshot()
+        self.assertEqual(sum(row[4] for row in incremental if row[0] == 'day'), 60)
+        lab_tat.rebuild_rollups()
+        self.assertEqual(snapshot(), incremental)
+
+    def test_summary_merges_rollups_by_test_and_technician(self):
+        now = timezone.now()
+        for i, minutes in enumerate([30, 60, 90, 120]):
+            self.complete(f'L{i}', self.tests[0], self.techs[i % 2], now - timedelta(hours=5), minutes)
+        self.complete('L9', self.tests[1], self.techs[0], now - timedelta(days=30), 45)
+
+        since = now - timedelta(days=2)
+        with CaptureQueriesContext(connection) as queries:
+            (cbc,) = lab_tat.turnaround_summary(since)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual((cbc['label'], cbc['count'], cbc['mean']), ('CBC', 4, 75))
+        self.assertAlmostEqual(cbc['p50'], 60, delta=5)
+
+        by_tech = {row['label']: row['count'] for row in lab_tat.turnaround_summary(since, by='technician')}
+        self.assertEqual(by_tech, {'tech0': 2, 'tech1': 2})
+
+        # Namesakes keep their own rows
+        User.objects.filter(pk__in=[tech.pk for tech in self.techs]).update(first_name='Sam', last_name='Lee')
+        rows = lab_tat.turnaround_summary(since, by='technician')
+        self.assertEqual([(row['label'], row['count']) for row in rows], [('Sam Lee', 2), ('Sam Lee', 2)])
+
+    def test_completing_in_lab_request_update_records_turnaround(self):
+        tech = self.techs[0]
+        UserProfile.objects.create(user=tech, role='lab_technician')
+        lab_request = make_lab_request(self.doctor, self.patient, self.tests[0], 'L1')
+        laboratory.claim_request(lab_request.pk, tech)
+        self.client.force_login(tech)
+        url = reverse('lab_request_update', args=[lab_request.pk])
+
+        self.client.post(url, {'status': 'completed', 'result': 'ok'})
+        self.client.post(url, {'status': 'completed', 'result': 'ok, amended'})
+        self.assertEqual(
+            sorted(LabTurnaroundRollup.objects.values_list('period', 'count', 'technician_id')),
+            [('day', 1, tech.pk), ('hour', 1, tech.pk)]
+        )
+        response = self.client.get(reverse('lab_tat_report'))
+        self.assertContains(response, 'CBC')
+
+
+class ConcurrentClaimTests(TransactionTestCase):
+    def test_concurrent_technicians_never_share_a_sample(self):
+        doctor = make_doctor()
+        patient = make_patient()
+        test = LabTest.objects.create(test_name='CBC', test_code='CBC', price=Decimal('300.00'))
+        LabTestRequest.objects.bulk_create([
+            LabTestRequest(request_number=f'L{i}', patient=patient, doctor=doctor, test=test, priority=i % 3 + 1)
+            for i in range(120)
+        ])
+        technicians = [User.objects.create_user(username=f'tech{i}', password='pass') for i in range(8)]
+
+        def drain(technician):
+            claimed = []
+            try:
+                while True:
+                    lab_request = laboratory.claim_next(technician, test.pk)
+                    if lab_request is None:
+                        return claimed
+                    claimed.append(lab_request.pk)
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=len(technicians)) as executor:
+            results = list(executor.map(drain, technicians))
+
+        claimed = [pk for pks in results for pk in pks]
+        self.assertEqual(len(claimed), 120)
+        self.assertEqual(len(set(claimed)), 120)
+        self.assertFalse(LabTestRequest.objects.filter(status='pending').exists())
+        for technician, pks in zip(technicians, results):
+            self.assertEqual(
+                set(LabTestRequest.objects.filter(technician=technician).values_list('pk', flat=True)),
+                set(pks)
+            )
+
+
+class ReportStorageTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.settings_override = self.settings(MEDIA_ROOT=self.media.name)
+        self.settings_override.enable()
+        self.doctor = make_doctor()
+        self.patient = make_patient()
+        self.client.force_login(self.doctor.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.media.cleanup()
+
+    def upload(self, title, content, filename='scan.pdf'):
+        upload = SimpleUploadedFile(filename, content, content_type='application/pdf')
+        self.client.post(reverse('medical_report_add', args=[self.patient.pk]), {
+            'title': title, 'report_type': 'radiology', 'report_file': upload
+        })
+        return MedicalReport.objects.get(title=title)
+
+    def test_uploads_are_stored_by_hash_and_deduplicated(self):
+        content = os.urandom(3 * 1024 * 1024 + 17)
+        first = self.upload('First', content)
+        second = self.upload('Second', content, filename='copy.PDF')
+        third = self.upload('Third', content + b'x')
+
+        digest = hashlib.sha256(content).hexdigest()
+        self.assertEqual(first.report_file.name, f'blobs/{digest[:2]}/{digest[2:4]}/{digest}.pdf')
+        self.assertEqual(second.report_file.name, first.report_file.name)
+        self.assertNotEqual(third.report_file.name, first.report_file.name)
+        with first.report_file.open('rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(os.listdir(os.path.join(self.media.name, 'blobs', 'tmp')), [])
+
+    def test_downloads_support_ranges(self):
+        content = bytes(range(256)) * 40
+        report = self.upload('Scan', content)
+        url = reverse('medical_report_download', args=[report.pk])
+        self.assertContains(self.client.get(reverse('patient_detail', args=[self.patient.pk])), url)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(b''.join(response.streaming_content), content)
+
+        response = self.client.get(url, headers={'Range': 'bytes=100-199'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(content)}')
+        self.assertEqual(b''.join(response.streaming_content), content[100:200])
+
+        response = self.client.get(url, headers={'Range': 'bytes=-10'})
+        self.assertEqual(b''.join(response.streaming_content), content[-10:])
+
+        response = self.client.get(url, headers={'Range': f'bytes={len(content)}-'})
+        self.assertEqual(response.status_code, 416)
+
+    def test_sendfile_header_hands_off_to_front_end(self):
+        report = self.upload('Scan', b'%PDF-1.4 test')
+        with self.settings(REPORT_SENDFILE_HEADER='X-Accel-Redirect'):
+            response = self.client.get(reverse('medical_report_download', args=[report.pk]))
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + report.report_file.name)
+        self.assertEqual(response.content, b'')
+
+
+def make_bill(patient, total=Decimal('1000.00'), number='BILL1'):
+    return Bill.objects.create(bill_number=number, patient=patient, consultation_fee=total)
+
+
+class BillingTests(TestCase):
+    def setUp(self):
+        self.doctor = make_doctor()
+        self.patient = make_patient()
+        self.ward = Ward.objects.create(
+            ward_name='Ward B', ward_type='Private', floor=2, total_beds=10, charge_per_day=Decimal('1000.00')
+        )
+        self.cbc = LabTest.objects.create(test_name='Complete Blood Count', test_code='CBC', price=Decimal('300.00'))
+
+    def discharge(self, number, discharged, patient=None):
+        admission = make_admission(self.doctor, patient or self.patient, ipd_number=number, bed_number=number, ward=self.ward)
+        IPDRecord.objects.filter(pk=admission.pk).update(
+            status='discharged', admission_date=discharged - timedelta(days=2), discharge_date=discharged
+        )
+        admission.refresh_from_db()
+        return admission
+
+    def add_charges(self, admission, prefix):
+        prescription = make_prescription(self.doctor, admission.patient, [], number=f'{prefix}RX')
+        PharmacyPrescription.objects.filter(pk=prescription.pk).update(
+            ipd_record=admission, total_amount=Decimal('75.00')
+        )
+        during = admission.admission_date + timedelta(hours=5)
+        for index in range(2):
+            lab_request = make_lab_request(self.doctor, admission.patient, self.cbc, f'{prefix}L{index}', requested_date=during)
+            LabTestRequest.objects.filter(pk=lab_request.pk).update(price=self.cbc.price)
+        return prescription
+
+    def test_ipd_bill_itemizes_every_source_once(self):
+        admission = self.discharge('IPD1', timezone.now())
+        prescription = self.add_charges(admission, 'A')
+        make_lab_request(self.doctor, self.patient, self.cbc, 'BEFORE',
+                         requested_date=admission.admission_date - timedelta(days=1))
+        cancelled = make_prescription(self.doctor, self.patient, [], number='CANCELLED')
+        PharmacyPrescription.objects.filter(pk=cancelled.pk).update(ipd_record=admission, status='cancelled')
+
+        bill = billing.compose_bill(self.patient, admission, discount=Decimal('100.00'))
+        self.assertEqual(
+            list(bill.items.order_by('pk').values_list('category', 'quantity', 'amount')),
+            [('consultation', 1, Decimal('500.00')), ('room', 2, Decimal('2000.00')),
+             ('medicine', 1, Decimal('75.00')), ('lab', 2, Decimal('600.00'))]
+        )
+        bill.refresh_from_db()
+        self.assertEqual((bill.ipd_record, bill.room_charges, bill.lab_charges), (admission, Decimal('2000.00'), Decimal('600.00')))
+        self.assertEqual((bill.total_amount, bill.balance, bill.status), (Decimal('3075.00'), Decimal('3075.00'), 'unpaid'))
+        self.assertEqual(bill.lab_requests.count(), 2)
+        self.assertEqual(list(bill.prescriptions.all()), [prescription])
+
+        with self.assertRaises(billing.BillingError):
+            billing.compose_bill(self.patient, admission)
+        with self.assertRaises(billing.BillingError):
+            billing.compose_bill(make_patient('PAT2'), admission)
+
+    def test_discharge_billing_query_count_does_not_grow(self):
+        today = timezone.now()
+        yesterday = today - timedelta(days=1)
+        self.add_charges(self.discharge('IPD1', yesterday), 'A')
+        for index in range(2, 6):
+            self.add_charges(self.discharge(f'IPD{index}', today, make_patient(f'PAT{index}')), f'B{index}')
+        # Both runs then update today's existing revenue rollup row
+        make_bill(self.patient)
+
+        with CaptureQueriesContext(connection) as small:
+            one = billing.compose_discharge_bills(timezone.localdate(yesterday))
+        with CaptureQueriesContext(connection) as large:
+            many = billing.compose_discharge_bills(timezone.localdate(today))
+        self.assertEqual((len(one), len(many)), (1, 4))
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(LabTestRequest.objects.filter(bill__isnull=True).count(), 0)
+        self.assertEqual(billing.compose_discharge_bills(timezone.localdate(today)), [])
+
+    def test_compose_view_bills_an_opd_visit(self):
+        admin = User.objects.create_user(username='admin', password='pass')
+        UserProfile.objects.create(user=admin, role='admin')
+        self.client.force_login(admin)
+        visit = OPDRecord.objects.create(
+            opd_number='OPD1', patient=self.patient, doctor=self.doctor,
+            symptoms='Cough', diagnosis='Cold', prescription='Rest'
+        )
+        make_lab_request(self.doctor, self.patient, self.cbc, 'L1')
+        LabTestRequest.objects.filter(request_number='L1').update(price=self.cbc.price)
+
+        response = self.client.post(reverse('bill_compose'), {'encounter': f'opd:{visit.pk}', 'tax': '40'})
+        bill = Bill.objects.get(opd_record=visit)
+        self.assertRedirects(response, reverse('bill_detail', args=[bill.pk]))
+        self.assertEqual(bill.total_amount, Decimal('840.00'))
+        self.assertContains(self.client.get(reverse('bill_detail', args=[bill.pk])), 'Complete Blood Count')
+
+
+class PaymentLedgerTests(TestCase):
+    def setUp(self):
+        self.patient = make_patient()
+        self.bill = make_bill(self.patient)
+
+    def test_payments_update_balance_and_status(self):
+        billing.record_payment(self.bill.pk, '400.00', 'cash')
+        self.bill.refresh_from_db()
+        self.assertEqual((self.bill.amount_paid, self.bill.balance, self.bill.status),
+                         (Decimal('400.00'), Decimal('600.00'), 'partial'))
+
+        with self.assertRaises(billing.BillingError):
+            billing.record_payment(self.bill.pk, '600.01', 'card')
+        with self.assertRaises(billing.BillingError):
+            billing.record_payment(self.bill.pk, '0', 'card')
+
+        billing.record_payment(self.bill.pk, '600.00', 'upi')
+        self.bill.refresh_from_db()
+        self.assertEqual((self.bill.balance, self.bill.status, self.bill.payment_method), (Decimal('0.00'), 'paid', 'upi'))
+        self.assertEqual(self.bill.payments.count(), 2)
+        with self.assertRaises(ValueError):
+            self.bill.payments.first().delete()
+
+    def test_idempotency_key_records_payment_once(self):
+        first, created = billing.record_payment(self.bill.pk, '250.00', 'card', idempotency_key='abc')
+        again, created_again = billing.record_payment(self.bill.pk, '250.00', 'card', idempotency_key='abc')
+        self.assertEqual((first, created, created_again), (again, True, False))
+        other = make_bill(self.patient, number='BILL2')
+        with self.assertRaises(billing.BillingError):
+            billing.record_payment(other.pk, '250.00', 'card', idempotency_key='abc')
+        self.assertFalse(other.payments.exists())
+        self.bill.refresh_from_db()
+        self.assertEqual(self.bill.amount_paid, Decimal('250.00'))
+
+    def test_reconcile_rederives_paid_amounts_from_ledger(self):
+        billing.record_payment(self.bill.pk, '300.00', 'cash')
+        other = make_bill(self.patient, number='BILL2')
+        Bill.objects.filter(pk=self.bill.pk).update(amount_paid=Decimal('900.00'), balance=Decimal('100.00'))
+        Bill.objects.filter(pk=other.pk).update(amount_paid=Decimal('50.00'))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(billing.reconcile_bills(apply=False)), 2)
+        self.assertEqual(len(queries), 1)
+
+        before = timezone.now()
+        billing.reconcile_bills()
+        self.bill.refresh_from_db()
+        other.refresh_from_db()
+        self.assertGreaterEqual(other.updated_at, before)
+        self.assertEqual((self.bill.amount_paid, self.bill.balance, self.bill.status),
+                         (Decimal('300.00'), Decimal('700.00'), 'partial'))
+        self.assertEqual((other.amount_paid, other.balance, other.status),
+                         (Decimal('0.00'), Decimal('1000.00'), 'unpaid'))
+        self.assertEqual(billing.reconcile_bills(), [])
+
+    def test_resubmitted_payment_form_is_recorded_once(self):
+        admin = User.objects.create_user(username='admin', password='pass')
+        UserProfile.objects.create(user=admin, role='admin')
+        self.client.force_login(admin)
+        url = reverse('bill_payment', args=[self.bill.pk])
+        key = self.client.get(url).context['idempotency_key']
+        for _ in range(2):
+            response = self.client.post(url, {'amount': '100', 'payment_method': 'cash', 'idempotency_key': key})
+            self.assertRedirects(response, reverse('bill_detail', args=[self.bill.pk]))
+        self.bill.refresh_from_db()
+        self.assertEqual(self.bill.amount_paid, Decimal('100.00'))
+        self.assertContains(self.client.get(reverse('bill_detail', args=[self.bill.pk])), 'Payments')
+
+
+class ConcurrentPaymentTests(TransactionTestCase):
+    def test_concurrent_payments_are_never_lost(self):
+        bill = make_bill(make_patient(), total=Decimal('5000.00'))
+
+        def pay(index):
+            try:
+                billing.record_payment(bill.pk, '100.00', 'cash', idempotency_key=f'key-{index % 40}')
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(pay, range(80)))
+
+        bill.refresh_from_db()
+        self.assertEqual(bill.payments.count(), 40)
+        self.assertEqual((bill.amount_paid, bill.balance), (Decimal('4000.00'), Decimal('1000.00')))
+        self.assertEqual(billing.reconcile_bills(apply=False), [])
+
+
+class RevenueRollupTests(TestCase):
+    def setUp(self):
+        self.patient = make_patient()
+        self.today = timezone.localdate()
+
+    def rollups(self):
+        return sorted(
+            (r.day, r.payment_method, r.status, r.bill_count, r.billed_amount, r.payment_count, r.collected_amount)
+            for r in RevenueRollup.objects.all()
+            if r.bill_count or r.payment_count
+        )
+
+    def test_bills_and_payments_move_between_rollups(self):
+        bill = make_bill(self.patient)
+        make_bill(self.patient, total=Decimal('250.00'), number='BILL2')
+        self.assertEqual(self.rollups(), [(self.today, '', 'unpaid', 2, Decimal('1250.00'), 0, Decimal('0.00'))])
+
+        billing.record_payment(bill.pk, '400.00', 'card')
+        self.assertEqual(self.rollups(), [
+            (self.today, '', 'unpaid', 1, Decimal('250.00'), 0, Decimal('0.00')),
+            (self.today, 'card', '', 0, Decimal('0.00'), 1, Decimal('400.00')),
+            (self.today, 'card', 'partial', 1, Decimal('1000.00'), 0, Decimal('0.00')),
+        ])
+
+        summary = revenue.revenue_summary(self.today)
+        self.assertEqual((summary['billed'], summary['collected']), (Decimal('1250.00'), Decimal('400.00')))
+        self.assertEqual(summary['by_method'], {'card': Decimal('400.00')})
+        self.assertEqual(summary['by_status'], {'unpaid': Decimal('250.00'), 'partial': Decimal('1000.00')})
+
+        incremental = self.rollups()
+        revenue.rebuild_rollups()
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_dashboards_read_rollups_not_bills(self):
+        make_bill(self.patient)
+        admin = User.objects.create_user(username='admin', password='pass')
+        UserProfile.objects.create(user=admin, role='admin')
+        self.client.force_login(admin)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin_dashboard'))
+        self.assertEqual(response.context['today_revenue'], Decimal('1000.00'))
+        self.assertFalse([q for q in queries.captured_queries if '"core_bill"' in q['sql']])
+        response = self.client.get(reverse('reports_dashboard'))
+        self.assertEqual(response.context['monthly_revenue'], Decimal('1000.00'))
+        self.assertContains(response, 'Billed This Month by Status')
+
+
+class InvoiceExportTests(TestCase):
+    def setUp(self):
+        self.doctor = make_doctor()
+        self.patient = make_patient()
+        self.admission = make_admission(self.doctor, self.patient)
+        self.bills = [
+            billing.compose_bill(self.patient, self.admission)
+        ] + [make_bill(self.patient, number=f'BILL{index}') for index in range(2, 8)]
+        billing.record_payment(self.bills[1].pk, '250.00', 'upi')
+
+    def test_invoice_data_takes_three_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = invoices.invoice_data(Bill.objects.all())
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(len(data), 7)
+        self.assertIn('IPD IPD00000001', data[0]['encounter'])
+        self.assertEqual(data[1]['payments'][0][1:], ('UPI', Decimal('250.00')))
+
+    def test_pdf_is_well_formed(self):
+        pdf = invoices.render_invoice(invoices.invoice_data(Bill.objects.filter(pk=self.bills[0].pk))[0])
+        self.assertTrue(pdf.startswith(b'%PDF-1.4'))
+        xref = int(pdf.rsplit(b'startxref', 1)[1].split()[0])
+        self.assertTrue(pdf[xref:].startswith(b'xref'))
+        stream = pdf.split(b'stream\n', 1)[1].split(b'\nendstream', 1)[0]
+        self.assertIn(self.bills[0].bill_number.encode(), zlib.decompress(stream))
+
+    def test_date_range_download_streams_a_zip(self):
+        admin = User.objects.create_user(username='admin', password='pass')
+        UserProfile.objects.create(user=admin, role='admin')
+        self.client.force_login(admin)
+        today = timezone.localdate().isoformat()
+
+        response = self.client.get(reverse('bill_invoices'), {'start': today, 'end': today})
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(
+            sorted(archive.namelist()),
+            sorted([f'{bill.bill_number}.pdf' for bill in self.bills] + ['summary.txt'])
+        )
+        self.assertIn(b'invoices/s', archive.read('summary.txt'))
+
+        response = self.client.get(reverse('bill_invoices'), {'ids': f'{self.bills[2].pk}'})
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(len(archive.namelist()), 2)
+
+
+class AnalyticsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.doctor = make_doctor()
+        self.patient = make_patient()
+        self.local = timezone.get_current_timezone()
+        Patient.objects.update(registered_date=timezone.make_aware(datetime(2026, 1, 2, 10, 30), self.local))
+        for number, day, status in (('A1', 2, 'completed'), ('A2', 3, 'pending'), ('A3', 3, 'pending')):
+            Appointment.objects.create(
+                appointment_number=number, patient=self.patient, doctor=self.doctor,
+                appointment_date=date(2026, 1, day), appointment_time=time(10), reason='Checkup', status=status
+            )
+        make_bill(self.patient)
+        Bill.objects.update(created_at=timezone.make_aware(datetime(2026, 1, 3, 9), self.local))
+        revenue.rebuild_rollups()
+        self.later = timezone.make_aware(datetime(2026, 2, 1), self.local)
+
+    def test_day_buckets_are_zero_filled(self):
+        data = analytics.series(datetime(2026, 1, 1), datetime(2026, 1, 4), 'day', now=self.later)
+        self.assertEqual(data['buckets'], ['2026-01-01T00:00:00', '2026-01-02T00:00:00', '2026-01-03T00:00:00'])
+        series = data['series']
+        self.assertEqual(series['registrations'], [0, 1, 0])
+        self.assertEqual(series['appointments'], {'completed': [0, 1, 0], 'pending': [0, 0, 2]})
+        self.assertEqual(series['opd_visits'], [0, 0, 0])
+        self.assertEqual(series['revenue_billed'], [0, 0, 1000.0])
+
+    def test_hour_and_week_buckets(self):
+        data = analytics.series(datetime(2026, 1, 2), datetime(2026, 1, 2, 12), 'hour', now=self.later)
+        self.assertEqual(len(data['buckets']), 12)
+        self.assertEqual(data['series']['registrations'][10], 1)
+        # Appointments only have a date, so they stay out of hourly series
+        self.assertEqual(data['series']['appointments'], {})
+
+        data = analytics.series(datetime(2026, 1, 1), datetime(2026, 1, 15), 'week', now=self.later)
+        self.assertEqual(data['buckets'], ['2025-12-29T00:00:00', '2026-01-05T00:00:00', '2026-01-12T00:00:00'])
+        self.assertEqual(data['series']['appointments']['pending'], [2, 0, 0])
+
+    def test_past_buckets_are_cached(self):
+        with self.assertNumQueries(len(analytics.COUNT_METRICS) + 1):
+            first = analytics.series(datetime(2026, 1, 1), datetime(2026, 1, 4), 'day', now=self.later)
+        with self.assertNumQueries(0):
+            self.assertEqual(analytics.series(datetime(2026, 1, 1), datetime(2026, 1, 4), 'day', now=self.later), first)
+
+        # A range reaching the current bucket is split into a cached past part and a live part
+        now = timezone.make_aware(datetime(2026, 1, 3, 12), self.local)
+        self.assertEqual(analytics.series(datetime(2026, 1, 1), datetime(2026, 1, 4), 'day', now=now), first)
+
+    def test_hourly_series_spanning_now(self):
+        now = timezone.make_aware(datetime(2026, 1, 3, 9, 30), self.local)
+        data = analytics.series(datetime(2026, 1, 3, 6), datetime(2026, 1, 3, 12), 'hour', now=now)
+        self.assertEqual(data['series']['appointments'], {})
+        self.assertEqual(data['series']['revenue_billed'], [0, 0, 0, 1000.0, 0, 0])
+
+    def test_invalid_ranges(self):
+        with self.assertRaises(analytics.AnalyticsError):
+            analytics.series(datetime(2026, 1, 1), datetime(2026, 1, 4), 'minute')
+        with self.assertRaises(analytics.AnalyticsError):
+            analytics.series(datetime(2020, 1, 1), datetime(2026, 1, 1), 'hour')
+
+        user = User.objects.create_user('admin')
+        UserProfile.objects.create(user=user, role='admin')
+        self.client.force_login(user)
+        response = self.client.get(reverse('reports_analytics'), {'bucket': 'minute'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('reports_analytics'), {'start': '2026-01-01', 'end': '2026-01-03'})
+        self.assertEqual(response.json()['series']['registrations'], [0, 1, 0])
+
+
+class ColumnarExportTests(TestCase):
+    def setUp(self):
+        self.output = tempfile.TemporaryDirectory()
+        self.doctor = make_doctor()
+        self.patient = make_patient()
+        self.admission = make_admission(self.doctor, self.patient)
+        self.bill = make_bill(self.patient, total=Decimal('1234.56'))
+
+    def tearDown(self):
+        self.output.cleanup()
+
+    def test_types_round_trip(self):
+        counts = columnar.export_all(self.output.name)
+        self.assertEqual(counts['core_bill'], 1)
+        self.assertIn('core_labpanel_tests', counts)
+
+        bills = columnar.read_table(self.output.name, 'core_bill')
+        self.assertEqual(bills['total_amount'], [Decimal('1234.56')])
+        self.assertEqual(bills['status'], ['unpaid'])
+        self.assertEqual(bills['ipd_record_id'], [None])
+        self.assertEqual(bills['created_at'], [Bill.objects.get().created_at])
+        doctors = columnar.read_table(self.output.name, 'core_doctor')
+        self.assertEqual(doctors['available_time_start'], [time(9, 0)])
+        patients = columnar.read_table(self.output.name, 'core_patient')
+        self.assertEqual(patients['date_of_birth'], [date(1980, 1, 1)])
+
+        partition = columnar.read_manifest(self.output.name)['tables']['core_bill']['partitions'][0]
+        with np.load(os.path.join(self.output.name, partition['file'])) as arrays:
+            self.assertEqual(arrays['total_amount'].tolist(), [123456])
+            self.assertEqual(arrays['created_at'].dtype, np.dtype('datetime64[us]'))
+            categories = arrays['status__categories'].tolist()
+            self.assertEqual(categories[arrays['status'][0]], 'unpaid')
+            self.assertEqual(arrays['ipd_record_id__null'].tolist(), [True])
+
+    def test_incremental_chunks(self):
+        make_patient('PAT00000002')
+        make_patient('PAT00000003')
+        columnar.export_all(self.output.name, chunk_size=2)
+        state = columnar.read_manifest(self.output.name)['tables']['core_patient']
+        self.assertEqual([partition['rows'] for partition in state['partitions']], [2, 1])
+
+        # Nothing changed: nothing appended to the incremental tables
+        counts = columnar.export_all(self.output.name)
+        self.assertEqual((counts['core_patient'], counts['core_bill']), (0, 0))
+
+        self.patient.phone = '7777777777'
+        self.patient.save()
+        counts = columnar.export_all(self.output.name)
+        self.assertEqual(counts['core_patient'], 1)
+        state = columnar.read_manifest(self.output.name)['tables']['core_patient']
+        self.assertEqual([partition['rows'] for partition in state['partitions']], [2, 1, 1])
+        patients = columnar.read_table(self.output.name, 'core_patient')
+        self.assertEqual(len(patients['id']), 3)
+        self.assertEqual(patients['phone'][patients['id'].index(self.patient.pk)], '7777777777')
+
+        out = io.StringIO()
+        call_command('export_columnar', self.output.name, stdout=out)
+        self.assertIn('core_bed: 1 row(s)', out.getvalue())
+
+    def test_rows_changed_in_place_or_deleted(self):
+        prescription = make_prescription(self.doctor, self.patient, [(make_medicine(), 1)])
+        other = make_patient('PAT00000002')
+        columnar.export_all(self.output.name)
+        old_files = set(os.listdir(os.path.join(self.output.name, 'core_bed')))
+
+        # No updated_at: the whole table is exported again and replaces the old partitions
+        Bed.objects.update(status='vacant')
+        PharmacyPrescription.objects.filter(pk=prescription.pk).update(status='dispensed')
+        other.delete()
+        columnar.export_all(self.output.name)
+
+        self.assertEqual(columnar.read_table(self.output.name, 'core_bed')['status'], ['vacant'])
+        self.assertEqual(columnar.read_table(self.output.name, 'core_pharmacyprescription')['status'], ['dispensed'])
+        self.assertFalse(old_files & set(os.listdir(os.path.join(self.output.name, 'core_bed'))))
+        self.assertEqual(columnar.read_manifest(self.output.name)['tables']['core_bed']['mode'], 'snapshot')
+        # Deleted rows of incremental tables drop out
+        self.assertEqual(columnar.read_table(self.output.name, 'core_patient')['id'], [self.patient.pk])
+
+
+class PerformanceCubeTests(TestCase):
+    def setUp(self):
+        self.doctor = make_doctor()
+        self.patient = make_patient()
+        for number, day, status in (('A1', 5, 'completed'), ('A2', 5, 'completed'), ('A3', 20, 'cancelled')):
+            Appointment.objects.create(
+                appointment_number=number, patient=self.patient, doctor=self.doctor,
+                appointment_date=date(2026, 3, day), appointment_time=time(10), reason='Checkup', status=status
+            )
+        self.admission = make_admission(self.doctor, self.patient)
+        self.admission.status = 'discharged'
+        self.admission.discharge_date = timezone.now()
+        self.admission.save()
+        billing.compose_bill(self.patient, self.admission)
+
+    def test_pivot(self):
+        days, count = performance.rebuild_stale()
+        self.assertGreater(count, 0)
+        self.assertFalse(PerformanceStaleDay.objects.exists())
+
+        with self.assertNumQueries(1):
+            rows = performance.pivot('appointment', ['doctor', 'month', 'status'])
+        self.assertEqual(
+            [(row['doctor'], row['month'], row['status'], row['records']) for row in rows],
+            [('Dr. Greg House', date(2026, 3, 1), 'cancelled', 1), ('Dr. Greg House', date(2026, 3, 1), 'completed', 2)]
+        )
+        stays = performance.pivot('discharge', ['specialization'])
+        self.assertEqual(stays[0]['specialization'], 'General Medicine')
+        self.assertEqual(stays[0]['average_stay'], 2)
+        bills = performance.pivot('bill', ['doctor', 'status'])
+        self.assertEqual([(row['status'], row['amount']) for row in bills], [('unpaid', Decimal('2500.00'))])
+        self.assertEqual(performance.pivot('admission', ['status'])[0]['status'], 'discharged')
+
+        # A full rebuild gives the same facts
+        performance.rebuild()
+        self.assertEqual(performance.pivot('bill', ['doctor', 'status']), bills)
+
+    def test_only_changed_days_are_rebuilt(self):
+        performance.rebuild_stale()
+        appointment = Appointment.objects.get(appointment_number='A3')
+        appointment.appointment_date = date(2026, 4, 2)
+        appointment.save()
+        self.assertEqual(
+            set(PerformanceStaleDay.objects.values_list('day', flat=True)), {date(2026, 3, 20), date(2026, 4, 2)}
+        )
+        Appointment.objects.get(appointment_number='A1').delete()
+        self.assertEqual(performance.rebuild_stale()[0], 3)
+
+        rows = performance.pivot('appointment', ['month'], start=date(2026, 3, 1), end=date(2026, 4, 30))
+        self.assertEqual([(row['month'], row['records']) for row in rows], [(date(2026, 3, 1), 1), (date(2026, 4, 1), 1)])
+
+        bill = Bill.objects.get()
+        billing.record_payment(bill.pk, bill.total_amount, 'cash')
+        out = io.StringIO()
+        call_command('build_performance_cube', stdout=out)
+        self.assertIn('Rebuilt 1 changed day(s)', out.getvalue())
+        self.assertEqual(performance.pivot('bill', ['status'])[0]['status'], 'paid')
+
+
+class CensusTests(TestCase):
+    def test_sweep_matches_daily_scan(self):
+        first = date(2026, 1, 1)
+        stays = [
+            (1, first, first + timedelta(days=3), 3),
+            (1, first + timedelta(days=1), first + timedelta(days=1), 1),
+            (1, first + timedelta(days=2), None, 0),
+            (2, first + timedelta(days=5), first + timedelta(days=8), 3),
+        ]
+        rows = census.census_rows(stays)
+        self.assertEqual(rows[1, first + timedelta(days=1)], [1, 1, 1, 1])
+
+        start, end = first + timedelta(days=1), first + timedelta(days=9)
+        ward_rows = [(day, *row) for (ward_id, day), row in sorted(rows.items()) if ward_id == 1 and day >= start]
+        stats = census.period_stats(ward_rows, start, end, opening=rows[1, first][2], beds=4)
+        scanned = sum(
+            1 for offset in range((end - start).days + 1) for ward_id, admitted, discharged, _ in stays
+            if ward_id == 1 and admitted <= start + timedelta(days=offset)
+            and (discharged is None or discharged > start + timedelta(days=offset))
+        )
+        self.assertEqual(stats['bed_days'], scanned)
+        self.assertEqual(stats['census'], 1)
+        self.assertEqual(stats['alos'], 2)
+        self.assertEqual(stats['occupancy'], 100 * scanned / 36)
+
+    def test_admission_and_discharge_update_census(self):
+        doctor = make_doctor()
+        patient = make_patient()
+        ward = Ward.objects.create(
+            ward_name='Ward A', ward_type='General', floor=1, total_beds=10, charge_per_day=Decimal('1000.00')
+        )
+        bed = Bed.objects.create(ward=ward, bed_number='1')
+        user = User.objects.create_user('admin')
+        UserProfile.objects.create(user=user, role='admin')
+        self.client.force_login(user)
+
+        today = timezone.localdate()
+        admitted = f'{today - timedelta(days=3)}T10:00'
+        self.client.post(reverse('ipd_add'), {
+            'patient': patient.pk, 'doctor': doctor.pk, 'bed': bed.pk,
+            'admission_date': admitted, 'diagnosis': 'Pneumonia'
+        })
+        ipd = IPDRecord.objects.get()
+        stats = census.ward_stats(today - timedelta(days=3), today)[ward.pk]
+        self.assertEqual((stats['census'], stats['bed_days'], stats['admissions']), (1, 4, 1))
+
+        self.client.post(reverse('ipd_discharge', args=[ipd.pk]))
+        stats = census.ward_stats(today - timedelta(days=3), today)[ward.pk]
+        self.assertEqual((stats['census'], stats['bed_days'], stats['discharges'], stats['alos']), (0, 3, 1, 3))
+
+        recorded = list(WardCensus.objects.order_by('day').values_list('day', 'admissions', 'discharges', 'census'))
+        self.assertEqual(recorded, [(today - timedelta(days=3), 1, 0, 1), (today, 0, 1, 0)])
+        census.rebuild_census()
+        self.assertEqual(
+            list(WardCensus.objects.order_by('day').values_list('day', 'admissions', 'discharges', 'census')), recorded
+        )
+        with self.assertNumQueries(2):
+            census.ward_stats(today - timedelta(days=29), today)
+        response = self.client.get(reverse('ward_list'))
+        self.assertContains(response, '3 bed-days')
+
+
+class DischargeTests(TestCase):
+    def setUp(self):
+        self.doctor = make_doctor()
+        self.patient = make_patient()
+        self.admission = make_admission(self.doctor, self.patient)
+        self.ward = self.admission.bed.ward
+        self.cbc = LabTest.objects.create(test_name='Complete Blood Count', test_code='CBC', price=Decimal('300.00'))
+        prescription = make_prescription(self.doctor, self.patient, [], number='RX1')
+        PharmacyPrescription.objects.filter(pk=prescription.pk).update(
+            ipd_record=self.admission, total_amount=Decimal('75.00')
+        )
+        self.add_lab('L1', self.admission.admission_date + timedelta(hours=5))
+        census.rebuild_census()
+
+    def add_lab(self, number, requested_date):
+        lab_request = make_lab_request(self.doctor, self.patient, self.cbc, number, requested_date=requested_date)
+        LabTestRequest.objects.filter(pk=lab_request.pk).update(price=self.cbc.price)
+
+    def test_discharge_closes_stay_frees_bed_and_bills(self):
+        bill = discharge.discharge_stay(self.admission)
+        self.assertEqual(
+            sorted(bill.items.values_list('category', 'quantity', 'amount')),
+            [('consultation', 1, Decimal('500.00')), ('lab', 1, Decimal('300.00')),
+             ('medicine', 1, Decimal('75.00')), ('room', 2, Decimal('2000.00'))]
+        )
+        self.assertEqual(bill.total_amount, Decimal('2875.00'))
+        self.admission.refresh_from_db()
+        self.assertEqual(self.admission.status, 'discharged')
+        self.assertEqual(Bed.objects.get().status, 'vacant')
+        today = timezone.localdate()
+        self.assertEqual(census.ward_stats(today, today)[self.ward.pk]['census'], 0)
+        self.assertTrue(PerformanceStaleDay.objects.filter(day=today).exists())
+
+        with self.assertRaises(discharge.DischargeError):
+            discharge.discharge_stay(self.admission)
+        self.assertEqual(Bill.objects.count(), 1)
+
+    def test_final_bill_covers_what_an_interim_bill_did_not(self):
+        billing.compose_bill(self.patient, self.admission)
+        self.add_lab('L2', timezone.now())
+        bill = discharge.discharge_stay(self.admission, when=timezone.now() + timedelta(days=1))
+        self.assertEqual(
+            sorted(bill.items.values_list('category', 'quantity', 'amount')),
+            [('lab', 1, Decimal('300.00')), ('room', 1, Decimal('1000.00'))]
+        )
+
+    def test_bulk_discharge(self):
+        other = make_admission(self.doctor, make_patient('PAT00000002'), 'IPD00000002', '2', self.ward)
+        # A bed another admitted stay still occupies is not freed
+        shared = make_admission(self.doctor, make_patient('PAT00000003'), 'IPD00000003', '3', self.ward)
+        IPDRecord.objects.create(
+            ipd_number='IPD00000004', patient=make_patient('PAT00000004'), doctor=self.doctor, bed=shared.bed,
+            admission_date=timezone.now(), diagnosis='Fever'
+        )
+        user = User.objects.create_user('nurse')
+        UserProfile.objects.create(user=user, role='nurse')
+        self.client.force_login(user)
+        response = self.client.post(reverse('ipd_discharge_bulk'), {
+            'ipd': [self.admission.pk, other.pk, shared.pk]
+        })
+        self.assertRedirects(response, reverse('ipd_list'))
+        self.assertEqual(IPDRecord.objects.filter(status='discharged').count(), 3)
+        self.assertEqual(Bill.objects.filter(created_by=user).count(), 3)
+        self.assertEqual(
+            dict(Bed.objects.values_list('bed_number', 'status')), {'1': 'vacant', '2': 'vacant', '3': 'occupied'}
+        )
+
+
+class AttendanceTests(TestCase):
+    def setUp(self):
+        self.nurses = []
+        for index in range(3):
+            user = User.objects.create_user(f'nurse{index}', first_name='Nurse', last_name=str(index))
+            UserProfile.objects.create(user=user, role='nurse')
+            self.nurses.append(user)
+        self.doctor = make_doctor()
+        self.admin = User.objects.create_user('admin')
+        UserProfile.objects.create(user=self.admin, role='admin')
+        self.day = date(2026, 2, 3)
+
+    def test_mark_upserts_in_one_query(self):
+        with self.assertNumQueries(1):
+            attendance.mark([{'user_id': nurse.pk, 'date': self.day, 'status': 'present'} for nurse in self.nurses])
+        with self.assertNumQueries(1):
+            attendance.mark([{'user_id': self.nurses[0].pk, 'date': self.day, 'status': 'leave', 'notes': 'Sick'}])
+        self.assertEqual(Attendance.objects.count(), 3)
+        self.assertEqual(
+            Attendance.objects.get(user=self.nurses[0]).status, 'leave'
+        )
+        with self.assertRaises(ValueError):
+            attendance.mark([{'user_id': self.nurses[0].pk, 'date': self.day, 'status': 'holiday'}])
+
+    def test_bulk_view_marks_a_role(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('attendance_bulk'), {'date': '2026-02-03', 'role': 'nurse'})
+        self.assertContains(response, 'Nurse 2')
+        self.assertNotContains(response, 'Greg House')
+
+        data = {'date': '2026-02-03', 'role': 'nurse', f'check_in_{self.nurses[1].pk}': '09:00'}
+        data.update({f'status_{nurse.pk}': 'present' for nurse in self.nurses})
+        data[f'status_{self.nurses[2].pk}'] = 'absent'
+        response = self.client.post(reverse('attendance_bulk'), data)
+        self.assertRedirects(response, reverse('attendance_list') + '?date=2026-02-03')
+        self.assertEqual(
+            dict(Attendance.objects.values_list('user__username', 'status')),
+            {'nurse0': 'present', 'nurse1': 'present', 'nurse2': 'absent'}
+        )
+        self.assertEqual(Attendance.objects.get(user=self.nurses[1]).check_in_time, time(9, 0))
+
+    def test_monthly_matrix(self):
+        attendance.mark([
+            {'user_id': self.nurses[0].pk, 'date': self.day, 'status': 'present'},
+            {'user_id': self.nurses[0].pk, 'date': self.day + timedelta(days=1), 'status': 'half_day'},
+            {'user_id': self.nurses[1].pk, 'date': self.day, 'status': 'leave'},
+            {'user_id': self.nurses[1].pk, 'date': date(2026, 3, 1), 'status': 'present'},
+        ])
+        with self.assertNumQueries(2):
+            matrix = attendance.monthly_matrix(date(2026, 2, 17), role='nurse')
+        self.assertEqual(len(matrix['days']), 28)
+        self.assertEqual([row['user'] for row in matrix['rows']], self.nurses)
+        first = matrix['rows'][0]
+        self.assertEqual(first['cells'][2:4], [('present', 'P'), ('half_day', 'H')])
+        self.assertEqual(first['totals'], {'present': 1, 'absent': 0, 'half_day': 1, 'leave': 0})
+        self.assertEqual(matrix['rows'][1]['totals']['present'], 0)
+        self.assertEqual(matrix['day_totals'][2:5], [1, 1, 0])
+
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('attendance_matrix'), {'month': '2026-02', 'role': 'nurse'})
+        self.assertContains(response, '<td class="half_day">H</td>', html=True)
+
+
+class RosterTests(TestCase):
+    def assertRulesHold(self, solved, leave=()):
+        for i, row in enumerate(solved.grid):
+            self.assertLessEqual(solved.load[i], solved.limits[i])
+            days = nights = 0
+            for d, code in enumerate(row):
+                if (i, d) in leave:
+                    self.assertEqual(code, roster.LEAVE)
+                if d:
+                    self.assertNotIn((row[d - 1], code), roster.FORBIDDEN)
+                days = days + 1 if code > roster.OFF else 0
+                nights = nights + 1 if code == roster.NIGHT else 0
+                self.assertLessEqual(days, roster.MAX_CONSECUTIVE_DAYS)
+                self.assertLessEqual(nights, roster.MAX_CONSECUTIVE_NIGHTS)
+
+    def test_solver_covers_every_shift_within_the_rules(self):
+        roles = ['nurse'] * 30 + ['doctor'] * 10
+        required = {(code, 'nurse'): 6 for code in roster.CODES.values()}
+        required.update({(code, 'doctor'): 2 for code in roster.CODES.values()})
+        leave = {(0, d) for d in range(5)} | {(31, 3)}
+        solved = roster.Roster(roles, 14, required, leave, fixed={(1, 0): roster.NIGHT}, before={2: roster.NIGHT})
+        solved.solve()
+
+        self.assertEqual(solved.deficits(), [])
+        self.assertRulesHold(solved, leave)
+        self.assertEqual(solved.grid[1][0], roster.NIGHT)
+        self.assertNotIn(solved.grid[2][0], (roster.MORNING, roster.AFTERNOON))
+        # Everyone ends within one shift of their share; leave lowers the share
+        self.assertEqual(solved.targets[0], 6)
+        self.assertLessEqual(max(map(solved.excess, range(40))) - min(map(solved.excess, range(40))), 1)
+
+    def test_solver_reports_what_it_cannot_cover(self):
+        required = {(roster.NIGHT, 'nurse'): 3}
+        solved = roster.Roster(['nurse'] * 3, 7, required)
+        solved.solve()
+        self.assertRulesHold(solved)
+        self.assertTrue(solved.deficits())
+        self.assertTrue(all(code == roster.NIGHT and missing > 0 for _, code, _, missing in solved.deficits()))
+
+    def test_requirements_follow_ward_types(self):
+        required = roster.ward_requirements([('ICU', 10), ('General', 17)])
+        self.assertEqual(required[roster.MORNING, 'nurse'], 5 + 3)
+        self.assertEqual(required[roster.NIGHT, 'doctor'], 1 + 1)
+
+    def test_generate_roster_saves_shifts(self):
+        Ward.objects.create(ward_name='Ward A', ward_type='General', floor=1, total_beds=8, charge_per_day=1000)
+        staff = []
+        for index in range(9):
+            user = User.objects.create_user(f'staff{index}')
+            UserProfile.objects.create(user=user, role='doctor' if index < 4 else 'nurse')
+            staff.append(user)
+        start = date(2026, 3, 2)
+        Attendance.objects.create(user=staff[5], date=start + timedelta(days=2), status='leave')
+        Shift.objects.create(
+            user=staff[6], shift_type='night', shift_date=start, start_time=time(22), end_time=time(6)
+        )
+
+        with self.assertNumQueries(5):
+            result = roster.generate_roster(start, 7)
+        self.assertEqual(result['deficits'], [])
+        self.assertEqual(Shift.objects.count(), len(result['shifts']) + 1)
+        self.assertFalse(Shift.objects.filter(user=staff[5], shift_date=start + timedelta(days=2)).exists())
+        self.assertEqual(Shift.objects.get(user=staff[6], shift_date=start).shift_type, 'night')
+        self.assertFalse(Shift.objects.filter(user=staff[6], shift_date=start + timedelta(days=1)).exclude(
+            shift_type='night'
+        ).exists())
+        morning = Shift.objects.filter(shift_type='morning').first()
+        self.assertEqual((morning.start_time, morning.end_time), (time(6), time(14)))
+        for day in range(7):
+            for shift_type in roster.SHIFT_TYPES:
+                for role in roster.ROLES:
+                    self.assertTrue(Shift.objects.filter(
+                        shift_date=start + timedelta(days=day), shift_type=shift_type, user__profile__role=role
+                    ).exists())
+
+        # Running again only adds to what is there
+        existing = set(Shift.objects.values_list('user_id', 'shift_date'))
+        again = roster.generate_roster(start, 7, save=False)
+        self.assertFalse({(shift.user_id, shift.shift_date) for shift in again['shifts']} & existing)
+        matrix = roster.roster_matrix(start, 7, 'nurse')
+        self.assertEqual(len(matrix['rows']), 5)
+        self.assertEqual(matrix['coverage'][0][1][0][1], 1)
+
+    def test_roster_view(self):
+        Ward.objects.create(ward_name='Ward A', ward_type='General', floor=1, total_beds=8, charge_per_day=1000)
+        for index in range(6):
+            user = User.objects.create_user(f'nurse{index}', first_name='Nurse', last_name=str(index))
+            UserProfile.objects.create(user=user, role='nurse')
+        admin = User.objects.create_user('admin')
+        UserProfile.objects.create(user=admin, role='admin')
+        self.client.force_login(admin)
+
+        response = self.client.post(reverse('staff_roster'), {'start': '2026-03-02', 'days': '7'})
+        self.assertRedirects(response, reverse('staff_roster') + '?start=2026-03-02&days=7')
+        self.assertTrue(Shift.objects.exists())
+        response = self.client.get(response.url)
+        self.assertContains(response, 'Nurse 5')
+        self.assertNotContains(response, 'admin</td>')
+        self.assertContains(response, 'class="night"')
+
+
+class CoverageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        Ward.objects.create(ward_name='Ward A', ward_type='General', floor=1, total_beds=8, charge_per_day=1000)
+        self.nurses = []
+        for index in range(2):
+            user = User.objects.create_user(f'nurse{index}', first_name='Nurse', last_name=str(index))
+            UserProfile.objects.create(user=user, role='nurse')
+            self.nurses.append(user)
+        self.day = date(2026, 3, 2)
+        self.morning = timezone.make_aware(datetime(2026, 3, 2, 9, 30))
+
+    def add_shift(self, user, shift_type='morning', day=None):
+        start, end = roster.SHIFT_TIMES[shift_type]
+        return Shift.objects.create(
+            user=user, shift_type=shift_type, shift_date=day or self.day, start_time=start, end_time=end
+        )
+
+    def test_current_shift(self):
+        for hour, expected in (
+            (3, (date(2026, 3, 1), 'night')), (6, (self.day, 'morning')),
+            (15, (self.day, 'afternoon')), (23, (self.day, 'night')),
+        ):
+            self.assertEqual(coverage.current_shift(timezone.make_aware(datetime(2026, 3, 2, hour))), expected)
+
+    def test_index_follows_shift_and_attendance_writes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            shift = self.add_shift(self.nurses[0])
+        coverage.on_duty(self.morning)
+        with self.assertNumQueries(0):
+            duty = coverage.on_duty(self.morning)
+        nurses, doctors = duty['rows']
+        self.assertEqual((duty['day'], duty['shift_type']), (self.day, 'morning'))
+        self.assertEqual((nurses['on_duty'], nurses['missing']), (['Nurse 0'], 0))
+        self.assertEqual((doctors['required'], doctors['missing']), (1, 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Attendance.objects.create(user=self.nurses[0], date=self.day, status='leave')
+        nurses = coverage.on_duty(self.morning)['rows'][0]
+        self.assertEqual((nurses['on_duty'], nurses['absent'], nurses['missing']), ([], ['Nurse 0'], 1))
+
+        # Moving the shift rebuilds the day it left as well
+        with self.captureOnCommitCallbacks(execute=True):
+            shift.shift_date = self.day + timedelta(days=1)
+            shift.save()
+        self.assertEqual(coverage.on_duty(self.morning)['rows'][0]['absent'], [])
+        found, _ = coverage.entries([self.day + timedelta(days=1)])
+        self.assertEqual(found[self.day + timedelta(days=1)]['morning', 'nurse']['on_duty'], ['Nurse 0'])
+
+    def test_gaps_come_from_the_cache(self):
+        night_nurse = User.objects.create_user('nurse2', first_name='Nurse', last_name='2')
+        UserProfile.objects.create(user=night_nurse, role='nurse')
+        with self.captureOnCommitCallbacks(execute=True):
+            for user, shift_type in zip(self.nurses + [night_nurse], roster.SHIFT_TYPES):
+                self.add_shift(user, shift_type)
+        coverage.gaps(self.day)
+        with self.assertNumQueries(0):
+            gaps = coverage.gaps(self.day)
+        self.assertEqual(len(gaps), 7 * 3 * 2 - 3)
+        self.assertFalse([gap for gap in gaps if gap['day'] == self.day and gap['role'] == 'nurse'])
+
+        # Bulk writes rebuild their days too, and ward changes the minimums
+        with self.captureOnCommitCallbacks(execute=True):
+            attendance.mark([{'user_id': self.nurses[1].pk, 'date': self.day, 'status': 'absent'}])
+            Ward.objects.create(ward_name='ICU', ward_type='ICU', floor=2, total_beds=2, charge_per_day=5000)
+        gaps = [(gap['shift_type'], gap['missing']) for gap in coverage.gaps(self.day, 1) if gap['role'] == 'nurse']
+        self.assertEqual(gaps, [('morning', 1), ('afternoon', 2), ('night', 1)])
+
+    def test_dashboards_show_coverage(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_shift(self.nurses[0], day=timezone.localdate())
+        self.client.force_login(self.nurses[1])
+        response = self.client.get(reverse('nurse_dashboard'))
+        self.assertContains(response, 'Coverage Gaps (Next 7 Days)')
+        admin = User.objects.create_user('admin')
+        UserProfile.objects.create(user=admin, role='admin')
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin_dashboard'))
+        self.assertContains(response, 'On Duty:')
+
+
+def make_image(size=(1600, 1200), mode='RGB', fmt='PNG'):
+    buffer = io.BytesIO()
+    Image.new(mode, size, 'red').save(buffer, fmt)
+    return buffer.getvalue()
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.settings_override = self.settings(MEDIA_ROOT=self.media.name)
+        self.settings_override.enable()
+        self.doctor = make_doctor()
+        self.patient = make_patient()
+        self.client.force_login(self.doctor.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.media.cleanup()
+
+    def wait_for_thumbnails(self, field_file):
+        # The view's render may still be running; a finished one needs no new job
+        future = thumbnails.schedule(field_file)
+        if future:
+            future.result(timeout=60)
+
+    def test_renders_every_size_keyed_by_content_hash(self):
+        source = os.path.join(self.media.name, 'photo.png')
+        with open(source, 'wb') as f:
+            f.write(make_image(mode='RGBA'))
+        output = os.path.join(self.media.name, 'out')
+
+        self.assertEqual(sorted(thumbnails.render_thumbnails(source, output)), ['avatar', 'preview', 'thumb'])
+        expected = {'avatar': (64, 64), 'thumb': (240, 180), 'preview': (1024, 768)}
+        for size, dimensions in expected.items():
+            with Image.open(os.path.join(output, f'{size}.jpg')) as image:
+                self.assertEqual((image.format, image.mode, image.size), ('JPEG', 'RGB', dimensions))
+
+        with open(os.path.join(self.media.name, 'notes.txt'), 'w') as f:
+            f.write('not an image')
+        self.assertEqual(thumbnails.render_thumbnails(os.path.join(self.media.name, 'notes.txt'), output), [])
+
+    def test_profile_picture_is_served_as_thumbnail(self):
+        self.client.post(reverse('profile_edit'), {
+            'first_name': 'Greg', 'last_name': 'House', 'email': 'greg@example.com', 'phone': '1',
+            'profile_picture': SimpleUploadedFile('me.jpg', make_image(fmt='JPEG'), content_type='image/jpeg'),
+        })
+        picture = UserProfile.objects.get(user=self.doctor.user).profile_picture
+        digest = thumbnails.content_digest(picture)
+        self.assertIsNotNone(digest)
+        self.wait_for_thumbnails(picture)
+
+        self.assertIsNone(thumbnails.schedule(picture))
+        response = self.client.get(reverse('profile_view'))
+        self.assertContains(response, '/media/' + thumbnails.thumbnail_name(digest, 'thumb'))
+        self.assertContains(response, '/media/' + thumbnails.thumbnail_name(digest, 'avatar'))
+        self.assertNotContains(response, picture.url)
+
+    def test_backfill_moves_legacy_pictures_into_blob_store(self):
+        legacy = default_storage.save('profiles/old.png', io.BytesIO(make_image()))
+        UserProfile.objects.filter(user=self.doctor.user).update(profile_picture=legacy)
+
+        call_command('generate_thumbnails', workers=1, stdout=io.StringIO())
+        picture = UserProfile.objects.get(user=self.doctor.user).profile_picture
+        self.assertIsNotNone(thumbnails.content_digest(picture))
+        self.assertIsNotNone(thumbnails.thumbnail_file(picture, 'avatar'))
+
+    def test_report_previews_require_a_rendered_image(self):
+        self.client.post(reverse('medical_report_add', args=[self.patient.pk]), {
+            'title': 'X-ray', 'report_type': 'radiology',
+            'report_file': SimpleUploadedFile('xray.png', make_image(), content_type='image/png'),
+        })
+        report = MedicalReport.objects.get(title='X-ray')
+        self.wait_for_thumbnails(report.report_file)
+
+        url = reverse('medical_report_preview', args=[report.pk, 'thumb'])
+        self.assertContains(self.client.get(reverse('patient_detail', args=[self.patient.pk])), url)
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) as image:
+            self.assertEqual(image.size, (240, 180))
+
+        self.assertEqual(self.client.get(reverse('medical_report_preview', args=[report.pk, 'original'])).status_code, 404)
+
+
+class PageRenderTests(TestCase):
+    """Smoke-test that the pages render for the roles that use them"""
+
+    def setUp(self):
+        self.doctor = make_doctor()
+        self.patient = make_patient()
+        self.admission = make_admission(self.doctor, self.patient)
+        self.medicine = make_medicine(stock=5)
+        self.opd = OPDRecord.objects.create(
+            opd_number='OPD1', patient=self.patient, doctor=self.doctor,
+            symptoms='Fever', diagnosis='Dengue', prescription='Rest'
+        )
+        self.prescription = make_prescription(self.doctor, self.patient, [(self.medicine, 1)])
+
+    def login(self, role):
+        if role == 'doctor':
+            user = self.doctor.user
+        else:
+            user = User.objects.create_user(username=role, password='pass')
+            UserProfile.objects.create(user=user, role=role)
+        self.client.force_login(user)
+
+    def assertRenders(self, name, *args, query=''):
+        response = self.client.get(reverse(name, args=args) + query)
+        self.assertEqual(response.status_code, 200, name)
+        return response
+
+    def test_admin_pages(self):
+        self.login('admin')
+        self.assertRenders('admin_dashboard')
+        self.assertRenders('medicine_list', query='?expiring=30')
+        self.assertRenders('medicine_list', query='?expiring=abc')
+        self.assertRenders('medicine_batches', self.medicine.pk)
+        response = self.client.post(reverse('medicine_batches', args=[self.medicine.pk]), {
+            'batch_number': 'B1', 'expiry_date': '2030-01-01', 'quantity': 'ten'
+        })
+        self.assertRedirects(response, reverse('medicine_batches', args=[self.medicine.pk]))
+        self.assertFalse(self.medicine.batches.exists())
+        self.assertRenders('medicine_expiry_report')
+        self.assertRenders('prescription_list')
+        self.assertRenders('clinical_search', query='?q=dengue')
+        self.assertRenders('lab_panel_list')
+        self.assertRenders('lab_panel_add')
+        self.assertRenders('reports_dashboard', query='?start=2026-01-01&end=2026-01-02&bucket=hour')
+        performance.rebuild()
+        self.assertRenders('reports_performance', query='?source=discharge&dim=doctor&dim=month')
+
+    def test_doctor_pages(self):
+        self.login('doctor')
+        self.assertRenders('prescription_add', query=f'?opd={self.opd.pk}')
+        self.assertRenders('opd_detail', self.opd.pk)
+        response = self.assertRenders('clinical_search', query='?q=dengue&doctor=' + str(self.doctor.pk))
+        self.assertContains(response, '<mark>Dengue</mark>')
+
+        response = self.client.post(reverse('prescription_add'), {
+            'patient': self.patient.pk,
+            'opd_record': self.opd.pk,
+            'medicine': [self.medicine.pk, ''],
+            'quantity': ['3', '1'],
+            'dosage': ['1-0-1', ''],
+            'duration': ['3 days', ''],
+            'instructions': ['', ''],
+        })
+        self.assertRedirects(response, reverse('prescription_list'))
+        created = PharmacyPrescription.objects.get(opd_record=self.opd)
+        self.assertEqual(created.total_amount, Decimal('7.50'))
+
+        response = self.client.post(reverse('prescription_add'), {
+            'patient': self.patient.pk,
+            'medicine': [self.medicine.pk],
+            'quantity': ['three'],
+            'dosage': ['1-0-1'],
+            'duration': ['3 days'],
+            'instructions': [''],
+        })
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(reverse('prescription_add'), {
+            'patient': '',
+            'medicine': [self.medicine.pk],
+            'quantity': ['1'],
+            'dosage': ['1-0-1'],
+            'duration': ['3 days'],
+            'instructions': [''],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(PharmacyPrescription.objects.filter(opd_record__isnull=True).count(), 1)
+
+        test = LabTest.objects.create(test_name='CBC', test_code='CBC', price=Decimal('300.00'))
+        self.assertRenders('lab_request_add')
+        response = self.client.post(reverse('lab_request_add'), {
+            'patient': self.patient.pk, 'tests': [test.pk], 'priority': '2'
+        })
+        self.assertRedirects(response, reverse('lab_request_list'))
+        self.assertEqual(
+            list(LabTestRequest.objects.values_list('doctor_id', 'price', 'priority')),
+            [(self.doctor.pk, Decimal('300.00'), 2)]
+        )
+
+        LabTestRequest.objects.update(status='completed', completed_date=timezone.now())
+        test.normal_range = '4-11 x10^9/L'
+        test.save()
+        lab_request = LabTestRequest.objects.get()
+        lab_request.result = 'WBC 14.2'
+        lab_request.save()
+        response = self.assertRenders('doctor_dashboard')
+        self.assertContains(response, 'Abnormal Lab Results')
+        response = self.assertRenders('lab_request_list', query='?abnormal=1')
+        self.assertContains(response, 'x10^9/L')
+
+    def test_nurse_pages(self):
+        self.login('nurse')
+        VitalsAlert.objects.create(ipd_record=self.admission, score=8, risk='high',
+                                   summary='RR 27', scanned_at=timezone.now())
+        response = self.assertRenders('nurse_dashboard')
+        self.assertContains(response, 'RR 27')
+        self.assertRenders('ipd_vitals', self.admission.pk)
+        response = self.assertRenders('ipd_discharge', self.admission.pk)
+        self.assertContains(response, 'Ward A (General), bed 1')
+
+    def test_pharmacist_pages(self):
+        self.login('pharmacist')
+        response = self.assertRenders('pharmacist_dashboard')
+        self.assertContains(response, 'running low on stock')
+        self.assertRenders('prescription_list')
+
+    def test_lab_technician_pages(self):
+        test = LabTest.objects.create(test_name='CBC', test_code='CBC', price=Decimal('300.00'))
+        make_lab_request(self.doctor, self.patient, test, 'L1', priority=1)
+        self.login('lab_technician')
+        response = self.assertRenders('lab_worklist')
+        self.assertContains(response, 'STAT')
+        self.assertRenders('lab_worklist', query=f'?test={test.pk}')
+        self.assertRenders('lab_request_list')
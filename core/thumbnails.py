@@ -0,0 +1,147 @@
+"""
+Thumbnails and first-page previews for uploaded images and reports.
+
+Renders run in a process pool after the upload is saved, so the request
+never waits on Pillow. Output is keyed by the source's content hash,
+``thumbs/<aa>/<sha256>/<size>.jpg``, which for files in the
+content-addressed store is read straight from the blob name; the same
+file uploaded twice is rendered once. Until a render finishes,
+templates fall back to the original (images) or an icon (documents).
+
+PDF first pages need ``pdftoppm`` (poppler) on the PATH; without it
+PDFs simply get no preview.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+from django.conf import settings
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+from .storage import BLOB_PREFIX
+
+THUMBNAIL_DIR = 'thumbs'
+# name: (bounding box, crop to fill the box)
+SIZES = {
+    'avatar': ((64, 64), True),
+    'thumb': ((240, 240), False),
+    'preview': ((1024, 1024), False),
+}
+JPEG_QUALITY = 80
+
+_executor = None
+
+
+def content_digest(field_file):
+    """SHA-256 of a stored file, or None if it is not in the blob store"""
+    if not field_file or not field_file.name.startswith(BLOB_PREFIX + '/'):
+        return None
+    digest = os.path.splitext(os.path.basename(field_file.name))[0]
+    return digest if len(digest) == 64 else None
+
+
+def thumbnail_name(digest, size):
+    return f'{THUMBNAIL_DIR}/{digest[:2]}/{digest}/{size}.jpg'
+
+
+def output_dir(digest):
+    return default_storage.path(f'{THUMBNAIL_DIR}/{digest[:2]}/{digest}')
+
+
+def thumbnail_file(field_file, size):
+    """The rendered thumbnail (with ``name`` and ``path``), or None if not ready"""
+    digest = content_digest(field_file)
+    if not digest or size not in SIZES:
+        return None
+    name = thumbnail_name(digest, size)
+    path = default_storage.path(name)
+    return SimpleNamespace(name=name, path=path) if os.path.exists(path) else None
+
+
+def thumbnail_url(field_file, size):
+    thumbnail = thumbnail_file(field_file, size)
+    return default_storage.url(thumbnail.name) if thumbnail else None
+
+
+def _open_source(source_path, work_dir):
+    if source_path.lower().endswith('.pdf'):
+        pdftoppm = shutil.which('pdftoppm')
+        if not pdftoppm:
+            return None
+        # Only the first page, at a resolution just above the largest size
+        output = os.path.join(work_dir, 'page')
+        subprocess.run(
+            [pdftoppm, '-f', '1', '-l', '1', '-singlefile', '-png', '-scale-to', '1024',
+             source_path, output],
+            check=True, capture_output=True, timeout=60
+        )
+        source_path = output + '.png'
+    return Image.open(source_path)
+
+
+def render_thumbnails(source_path, output_dir, sizes=SIZES):
+    """
+    Write every size of one source file as a JPEG into ``output_dir``.
+
+    Runs in a worker process. Returns the sizes written; a source that
+    cannot be decoded writes nothing.
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        try:
+            image = _open_source(source_path, work_dir)
+            if image is None:
+                return []
+            with image:
+                # Let the JPEG decoder downscale while reading
+                largest = max(box for box, _ in sizes.values())
+                image.draft('RGB', largest)
+                image = ImageOps.exif_transpose(image)
+                if image.mode in ('RGBA', 'LA', 'P'):
+                    image = image.convert('RGBA')
+                    background = Image.new('RGB', image.size, 'white')
+                    background.paste(image, mask=image.getchannel('A'))
+                    image = background
+                else:
+                    image = image.convert('RGB')
+        except (OSError, ValueError, Image.DecompressionBombError, subprocess.SubprocessError):
+            return []
+
+    os.makedirs(output_dir, exist_ok=True)
+    written = []
+    # Largest first, so each smaller size is resampled from fewer pixels
+    for size, (box, crop) in sorted(sizes.items(), key=lambda item: -item[1][0][0]):
+        if crop:
+            resized = ImageOps.fit(image, box, Image.Resampling.LANCZOS)
+        else:
+            resized = image.copy()
+            resized.thumbnail(box, Image.Resampling.LANCZOS)
+            image = resized
+        temp_path = os.path.join(output_dir, f'.{size}.{os.getpid()}.tmp')
+        resized.save(temp_path, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+        os.replace(temp_path, os.path.join(output_dir, f'{size}.jpg'))
+        written.append(size)
+    return written
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=getattr(settings, 'THUMBNAIL_WORKERS', 2))
+    return _executor
+
+
+def schedule(field_file):
+    """
+    Queue rendering for a saved file.
+
+    Returns a Future, or None when there is nothing to do: the file is
+    not in the blob store or its thumbnails already exist.
+    """
+    digest = content_digest(field_file)
+    if not digest:
+        return None
+    if all(default_storage.exists(thumbnail_name(digest, size)) for size in SIZES):
+        return None
+    return _get_executor().submit(render_thumbnails, field_file.path, output_dir(digest))
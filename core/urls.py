@@ -22,6 +22,9 @@ urlpatterns = [
     path('patients/<int:pk>/', views.patient_detail, name='patient_detail'),
     path('patients/<int:pk>/edit/', views.patient_edit, name='patient_edit'),
     path('patients/<int:pk>/delete/', views.patient_delete, name='patient_delete'),
+    path('patients/<int:pk>/reports/add/', views.medical_report_add, name='medical_report_add'),
+    path('reports/<int:pk>/download/', views.medical_report_download, name='medical_report_download'),
+    path('reports/<int:pk>/preview/<slug:size>/', views.medical_report_preview, name='medical_report_preview'),
     
     # Doctor Management
     path('doctors/', views.doctor_list, name='doctor_list'),
@@ -39,11 +42,14 @@ urlpatterns = [
     path('opd/', views.opd_list, name='opd_list'),
     path('opd/add/', views.opd_add, name='opd_add'),
     path('opd/<int:pk>/', views.opd_detail, name='opd_detail'),
+    path('opd/search/', views.clinical_search, name='clinical_search'),
     
     # IPD Management
     path('ipd/', views.ipd_list, name='ipd_list'),
     path('ipd/add/', views.ipd_add, name='ipd_add'),
     path('ipd/<int:pk>/discharge/', views.ipd_discharge, name='ipd_discharge'),
+    path('ipd/discharge/', views.ipd_discharge_bulk, name='ipd_discharge_bulk'),
+    path('ipd/<int:pk>/vitals/', views.ipd_vitals, name='ipd_vitals'),
     
     # Ward and Bed Management
     path('wards/', views.ward_list, name='ward_list'),
@@ -54,17 +60,33 @@ urlpatterns = [
     path('pharmacy/medicines/', views.medicine_list, name='medicine_list'),
     path('pharmacy/medicines/add/', views.medicine_add, name='medicine_add'),
     path('pharmacy/medicines/<int:pk>/edit/', views.medicine_edit, name='medicine_edit'),
+    path('pharmacy/medicines/<int:pk>/batches/', views.medicine_batches, name='medicine_batches'),
+    path('pharmacy/medicines/expiry/', views.medicine_expiry_report, name='medicine_expiry_report'),
+    path('pharmacy/prescriptions/', views.prescription_list, name='prescription_list'),
+    path('pharmacy/prescriptions/add/', views.prescription_add, name='prescription_add'),
+    path('pharmacy/prescriptions/<int:pk>/dispense/', views.prescription_dispense, name='prescription_dispense'),
     
     # Laboratory Management
     path('laboratory/tests/', views.lab_test_list, name='lab_test_list'),
     path('laboratory/tests/add/', views.lab_test_add, name='lab_test_add'),
+    path('laboratory/panels/', views.lab_panel_list, name='lab_panel_list'),
+    path('laboratory/panels/add/', views.lab_panel_add, name='lab_panel_add'),
     path('laboratory/requests/', views.lab_request_list, name='lab_request_list'),
     path('laboratory/requests/add/', views.lab_request_add, name='lab_request_add'),
     path('laboratory/requests/<int:pk>/update/', views.lab_request_update, name='lab_request_update'),
+    path('laboratory/worklist/', views.lab_worklist, name='lab_worklist'),
+    path('laboratory/turnaround/', views.lab_tat_report, name='lab_tat_report'),
+    path('laboratory/requests/<int:pk>/report/', views.lab_report_download, name='lab_report_download'),
+    path('laboratory/worklist/next/', views.lab_claim_next, name='lab_claim_next'),
+    path('laboratory/requests/<int:pk>/claim/', views.lab_request_claim, name='lab_request_claim'),
+    path('laboratory/requests/<int:pk>/release/', views.lab_request_release, name='lab_request_release'),
     
     # Billing Management
     path('billing/', views.bill_list, name='bill_list'),
     path('billing/add/', views.bill_add, name='bill_add'),
+    path('billing/compose/', views.bill_compose, name='bill_compose'),
+    path('billing/discharges/', views.bill_discharges, name='bill_discharges'),
+    path('billing/invoices/', views.bill_invoices, name='bill_invoices'),
     path('billing/<int:pk>/', views.bill_detail, name='bill_detail'),
     path('billing/<int:pk>/payment/', views.bill_payment, name='bill_payment'),
     
@@ -73,9 +95,14 @@ urlpatterns = [
     path('staff/add/', views.staff_add, name='staff_add'),
     path('staff/attendance/', views.attendance_list, name='attendance_list'),
     path('staff/attendance/mark/', views.attendance_mark, name='attendance_mark'),
+    path('staff/attendance/bulk/', views.attendance_bulk, name='attendance_bulk'),
+    path('staff/attendance/matrix/', views.attendance_matrix, name='attendance_matrix'),
+    path('staff/roster/', views.staff_roster, name='staff_roster'),
     
     # Reports
     path('reports/', views.reports_dashboard, name='reports_dashboard'),
+    path('reports/analytics/', views.reports_analytics, name='reports_analytics'),
+    path('reports/performance/', views.reports_performance, name='reports_performance'),
     
     # Profile
     path('profile/', views.profile_view, name='profile_view'),
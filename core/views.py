@@ -3,19 +3,26 @@ from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib import messages
-from django.db.models import Sum, Count, Q
-from django.http import HttpResponse, JsonResponse
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Q, Prefetch
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
 from django.utils import timezone
+from django.utils.text import slugify
 from datetime import datetime, timedelta, date
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 from .models import *
 from .decorators import (
     admin_required, doctor_required, receptionist_required,
     nurse_required, pharmacist_required, lab_technician_required,
     patient_required, role_required
 )
+from . import analytics, attendance, billing, census, coverage, discharge, invoices, lab_results, lab_tat, laboratory, performance, pharmacy, revenue, roster, search, stock_alerts, thumbnails
+from .storage import file_response
+import os
 import random
 import string
+import uuid
 
 # Helper function to generate unique IDs
 def generate_unique_id(prefix, length=8):
@@ -109,17 +116,16 @@ def admin_dashboard(request):
     occupied_beds = Bed.objects.filter(status='occupied').count()
     context['available_beds'] = total_beds - occupied_beds
     
-    # Revenue statistics
-    today = timezone.now().date()
-    context['today_revenue'] = Bill.objects.filter(
-        created_at__date=today
-    ).aggregate(total=Sum('total_amount'))['total'] or 0
+    # Revenue statistics, from the daily rollups
+    today = timezone.localdate()
+    today_summary = revenue.revenue_summary(today)
+    context['today_revenue'] = today_summary['billed']
+    context['today_collected'] = today_summary['collected']
     
     # Monthly revenue
-    first_day_month = today.replace(day=1)
-    context['monthly_revenue'] = Bill.objects.filter(
-        created_at__date__gte=first_day_month
-    ).aggregate(total=Sum('total_amount'))['total'] or 0
+    month_summary = revenue.revenue_summary(today.replace(day=1), today)
+    context['monthly_revenue'] = month_summary['billed']
+    context['monthly_collected'] = month_summary['collected']
     
     # Recent appointments
     context['recent_appointments'] = Appointment.objects.select_related(
@@ -129,12 +135,16 @@ def admin_dashboard(request):
     # Pending tasks
     context['pending_appointments'] = Appointment.objects.filter(status='pending').count()
     context['pending_lab_tests'] = LabTestRequest.objects.filter(status='pending').count()
-    context['low_stock_medicines'] = Medicine.objects.filter(
-        stock_quantity__lte=models.F('reorder_level')
-    ).count()
+    alert_counts = stock_alerts.alert_counts()
+    context['low_stock_medicines'] = alert_counts['low_stock']
+    context['expiring_medicines'] = alert_counts['expiring']
     
     # IPD patients
     context['ipd_patients'] = IPDRecord.objects.filter(status='admitted').count()
+    
+    # Staff on duty and shift gaps, from the coverage index
+    context['on_duty'] = coverage.on_duty()
+    context['coverage_gaps'] = coverage.gaps()
     context['user_role'] = 'admin'
     
     return render(request, 'dashboard.html', context)
@@ -180,6 +190,7 @@ def doctor_dashboard(request):
         'recent_appointments': Appointment.objects.filter(
             doctor=doctor
         ).select_related('patient', 'doctor__user').order_by('-created_at')[:5],
+        'abnormal_results': lab_results.abnormal_results(doctor)[:10],
         'today': today,
         'user_role': 'doctor'
     }
@@ -240,6 +251,11 @@ def nurse_dashboard(request):
         'recent_appointments': IPDRecord.objects.filter(
             status='admitted'
         ).select_related('patient', 'doctor__user', 'bed__ward').order_by('-admission_date')[:5],
+        'vitals_alerts': VitalsAlert.objects.select_related(
+            'ipd_record__patient', 'ipd_record__bed__ward'
+        )[:10],
+        'on_duty': coverage.on_duty(),
+        'coverage_gaps': coverage.gaps(),
         'today': today,
         'user_role': 'nurse'
     }
@@ -251,6 +267,7 @@ def nurse_dashboard(request):
 @pharmacist_required
 def pharmacist_dashboard(request):
     today = timezone.now().date()
+    alert_counts = stock_alerts.alert_counts()
     
     context = {
         'total_patients': Patient.objects.count(),
@@ -264,9 +281,8 @@ def pharmacist_dashboard(request):
             status='pending'
         ).count(),
         'pending_lab_tests': 0,
-        'low_stock_medicines': Medicine.objects.filter(
-            stock_quantity__lte=models.F('reorder_level')
-        ).count(),
+        'low_stock_medicines': alert_counts['low_stock'],
+        'expiring_medicines': alert_counts['expiring'],
         'recent_appointments': PharmacyPrescription.objects.select_related(
             'patient', 'doctor__user'
         ).order_by('-created_at')[:5],
@@ -438,6 +454,49 @@ def patient_detail(request, pk):
     }
     return render(request, 'patients/patient_detail.html', context)
 
+@login_required
+@role_required('admin', 'doctor', 'nurse')
+def medical_report_add(request, pk):
+    patient = get_object_or_404(Patient, pk=pk)
+    
+    if request.method == 'POST':
+        if not request.FILES.get('report_file'):
+            messages.error(request, 'Please choose a file to upload.')
+        else:
+            report = MedicalReport.objects.create(
+                patient=patient,
+                report_type=request.POST.get('report_type'),
+                title=request.POST.get('title'),
+                description=request.POST.get('description', ''),
+                report_file=request.FILES['report_file'],
+                uploaded_by=request.user
+            )
+            thumbnails.schedule(report.report_file)
+            messages.success(request, f'Report {report.title} uploaded successfully!')
+            return redirect('patient_detail', pk=patient.pk)
+    
+    context = {
+        'patient': patient,
+        'report_types': MedicalReport.REPORT_TYPE_CHOICES
+    }
+    return render(request, 'patients/medical_report_form.html', context)
+
+@login_required
+@role_required('admin', 'receptionist', 'doctor', 'nurse')
+def medical_report_download(request, pk):
+    report = get_object_or_404(MedicalReport, pk=pk)
+    extension = os.path.splitext(report.report_file.name)[1]
+    return file_response(request, report.report_file, filename=f'{slugify(report.title)}{extension}')
+
+@login_required
+@role_required('admin', 'receptionist', 'doctor', 'nurse')
+def medical_report_preview(request, pk, size):
+    report = get_object_or_404(MedicalReport, pk=pk)
+    preview = thumbnails.thumbnail_file(report.report_file, size)
+    if not preview:
+        raise Http404('No preview has been rendered for this report.')
+    return file_response(request, preview)
+
 @login_required
 @admin_required
 def patient_delete(request, pk):
@@ -662,6 +721,36 @@ def opd_detail(request, pk):
     context = {'opd_record': opd_record}
     return render(request, 'opd/opd_detail.html', context)
 
+@login_required
+@role_required('admin', 'doctor')
+def clinical_search(request):
+    query = request.GET.get('q', '').strip()
+    date_from = request.GET.get('date_from', '')
+    date_to = request.GET.get('date_to', '')
+    doctor_filter = request.GET.get('doctor', '')
+    
+    hits = []
+    if query:
+        try:
+            hits = search.search(
+                query,
+                date_from=date.fromisoformat(date_from) if date_from else None,
+                date_to=date.fromisoformat(date_to) if date_to else None,
+                doctor_id=doctor_filter or None
+            )
+        except ValueError:
+            messages.error(request, 'Invalid search query. Use words, "quoted phrases", AND, OR and NOT.')
+    
+    context = {
+        'hits': hits,
+        'query': query,
+        'date_from': date_from,
+        'date_to': date_to,
+        'doctor_filter': doctor_filter,
+        'doctors': Doctor.objects.select_related('user')
+    }
+    return render(request, 'search/clinical_search.html', context)
+
 # IPD Management Views
 @login_required
 @role_required('admin', 'doctor', 'nurse')
@@ -679,22 +768,29 @@ def ipd_add(request):
     if request.method == 'POST':
         ipd_number = generate_unique_id('IPD')
         bed_id = request.POST.get('bed')
+        try:
+            admission_date = timezone.make_aware(datetime.fromisoformat(request.POST.get('admission_date', '')))
+        except ValueError:
+            messages.error(request, 'Please enter a valid admission date.')
+            return redirect('ipd_add')
         
-        # Update bed status
-        bed = Bed.objects.get(pk=bed_id)
-        bed.status = 'occupied'
-        bed.save()
-        
-        ipd_record = IPDRecord.objects.create(
-            ipd_number=ipd_number,
-            patient_id=request.POST.get('patient'),
-            doctor_id=request.POST.get('doctor'),
-            bed=bed,
-            admission_date=request.POST.get('admission_date'),
-            diagnosis=request.POST.get('diagnosis'),
-            treatment_notes=request.POST.get('treatment_notes', ''),
-            status='admitted'
-        )
+        # The bed, the stay and the ward census change together
+        with transaction.atomic():
+            bed = Bed.objects.get(pk=bed_id)
+            bed.status = 'occupied'
+            bed.save()
+            
+            ipd_record = IPDRecord.objects.create(
+                ipd_number=ipd_number,
+                patient_id=request.POST.get('patient'),
+                doctor_id=request.POST.get('doctor'),
+                bed=bed,
+                admission_date=admission_date,
+                diagnosis=request.POST.get('diagnosis'),
+                treatment_notes=request.POST.get('treatment_notes', ''),
+                status='admitted'
+            )
+            census.record_admission(ipd_record)
         
         messages.success(request, f'Patient admitted with IPD Number {ipd_number}!')
         return redirect('ipd_list')
@@ -709,29 +805,97 @@ def ipd_add(request):
 @login_required
 @role_required('admin', 'doctor', 'nurse')
 def ipd_discharge(request, pk):
-    ipd_record = get_object_or_404(IPDRecord, pk=pk)
+    ipd_record = get_object_or_404(
+        IPDRecord.objects.select_related('patient', 'doctor__user', 'bed__ward'), pk=pk
+    )
     
     if request.method == 'POST':
-        ipd_record.discharge_date = timezone.now()
-        ipd_record.status = 'discharged'
-        ipd_record.save()
-        
-        # Update bed status
-        if ipd_record.bed:
-            ipd_record.bed.status = 'vacant'
-            ipd_record.bed.save()
+        # Closes the stay, frees the bed and composes the final bill together
+        try:
+            bill = discharge.discharge_stay(ipd_record, user=request.user)
+        except discharge.DischargeError as e:
+            messages.error(request, str(e))
+            return redirect('ipd_list')
         
-        messages.success(request, f'Patient discharged from IPD {ipd_record.ipd_number}!')
+        if bill:
+            messages.success(
+                request,
+                f'Patient discharged from IPD {ipd_record.ipd_number}! Final bill {bill.bill_number} '
+                f'for ₹{bill.total_amount} created.'
+            )
+        else:
+            messages.success(request, f'Patient discharged from IPD {ipd_record.ipd_number}!')
         return redirect('ipd_list')
     
-    context = {'ipd_record': ipd_record}
+    # Preview of the final bill if discharged now
+    items = billing.outstanding_charges([ipd_record])[ipd_record.pk]['items'] if ipd_record.status == 'admitted' else []
+    context = {
+        'ipd_record': ipd_record,
+        'charges': items,
+        'charges_total': sum(item.amount for item in items),
+    }
     return render(request, 'ipd/ipd_discharge.html', context)
 
+@login_required
+@role_required('admin', 'doctor', 'nurse')
+def ipd_discharge_bulk(request):
+    if request.method != 'POST':
+        return redirect('ipd_list')
+    
+    ids = [pk for pk in request.POST.getlist('ipd') if pk.isdigit()]
+    if not ids:
+        messages.error(request, 'Please select the patients to discharge.')
+        return redirect('ipd_list')
+    
+    try:
+        discharged, bills = discharge.discharge_stays(IPDRecord.objects.filter(pk__in=ids), user=request.user)
+    except discharge.DischargeError as e:
+        messages.error(request, str(e))
+        return redirect('ipd_list')
+    
+    if discharged:
+        messages.success(request, f'Discharged {len(discharged)} patient(s) and created {len(bills)} final bill(s).')
+    else:
+        messages.info(request, 'The selected patients have already been discharged.')
+    return redirect('ipd_list')
+
+@login_required
+@role_required('admin', 'doctor', 'nurse')
+def ipd_vitals(request, pk):
+    ipd_record = get_object_or_404(IPDRecord, pk=pk)
+    
+    if request.method == 'POST':
+        VitalSign.objects.create(
+            ipd_record=ipd_record,
+            respiratory_rate=request.POST.get('respiratory_rate') or None,
+            spo2=request.POST.get('spo2') or None,
+            systolic_bp=request.POST.get('systolic_bp') or None,
+            pulse=request.POST.get('pulse') or None,
+            temperature=request.POST.get('temperature') or None,
+            recorded_by=request.user
+        )
+        
+        messages.success(request, f'Vitals recorded for IPD {ipd_record.ipd_number}!')
+        return redirect('ipd_vitals', pk=pk)
+    
+    context = {
+        'ipd_record': ipd_record,
+        'vitals': ipd_record.vitals.order_by('-recorded_at')[:20]
+    }
+    return render(request, 'ipd/ipd_vitals.html', context)
+
 # Ward and Bed Management Views
 @login_required
 @admin_required
 def ward_list(request):
-    wards = Ward.objects.all()
+    wards = list(Ward.objects.all())
+    
+    # Census over the last 30 days
+    today = timezone.localdate()
+    stats = census.ward_stats(today - timedelta(days=29), today)
+    for ward in wards:
+        ward.census_stats = stats.get(ward.pk)
+    
     context = {'wards': wards}
     return render(request, 'wards/ward_list.html', context)
 
@@ -784,19 +948,31 @@ def bed_list(request):
 def medicine_list(request):
     medicines = Medicine.objects.all().order_by('medicine_name')
     
-    # Filter expired and low stock
+    # Filter expired, expiring soon and low stock
     show_expired = request.GET.get('expired', '')
     show_low_stock = request.GET.get('low_stock', '')
+    try:
+        expiring_within = int(request.GET.get('expiring', ''))
+    except ValueError:
+        expiring_within = ''
     
+    today = timezone.now().date()
     if show_expired:
-        medicines = medicines.filter(expiry_date__lt=timezone.now().date())
+        medicines = medicines.filter(expiry_date__lt=today)
+    if expiring_within:
+        medicines = medicines.filter(
+            batches__quantity__gt=0,
+            batches__expiry_date__gte=today,
+            batches__expiry_date__lt=today + timedelta(days=expiring_within)
+        ).distinct()
     if show_low_stock:
-        medicines = medicines.filter(stock_quantity__lte=models.F('reorder_level'))
+        medicines = medicines.filter(stock_alerts__alert_type='low_stock')
     
     context = {
         'medicines': medicines,
         'show_expired': show_expired,
-        'show_low_stock': show_low_stock
+        'show_low_stock': show_low_stock,
+        'expiring_within': expiring_within
     }
     return render(request, 'pharmacy/medicine_list.html', context)
 
@@ -804,16 +980,24 @@ def medicine_list(request):
 @pharmacist_required
 def medicine_add(request):
     if request.method == 'POST':
-        medicine = Medicine.objects.create(
-            medicine_name=request.POST.get('medicine_name'),
-            medicine_type=request.POST.get('medicine_type'),
-            manufacturer=request.POST.get('manufacturer'),
-            description=request.POST.get('description', ''),
-            unit_price=request.POST.get('unit_price'),
-            stock_quantity=request.POST.get('stock_quantity', 0),
-            reorder_level=request.POST.get('reorder_level', 10),
-            expiry_date=request.POST.get('expiry_date')
-        )
+        stock_quantity = int(request.POST.get('stock_quantity') or 0)
+        
+        with transaction.atomic():
+            medicine = Medicine.objects.create(
+                medicine_name=request.POST.get('medicine_name'),
+                medicine_type=request.POST.get('medicine_type'),
+                manufacturer=request.POST.get('manufacturer'),
+                description=request.POST.get('description', ''),
+                unit_price=request.POST.get('unit_price'),
+                stock_quantity=0,
+                reorder_level=request.POST.get('reorder_level', 10),
+                expiry_date=request.POST.get('expiry_date')
+            )
+            if stock_quantity:
+                # Opening stock is booked as a batch with the medicine's expiry
+                pharmacy.receive_batch(
+                    medicine.pk, 'OPENING', medicine.expiry_date, stock_quantity, user=request.user
+                )
         
         messages.success(request, f'Medicine {medicine.medicine_name} added successfully!')
         return redirect('medicine_list')
@@ -831,10 +1015,23 @@ def medicine_edit(request, pk):
         medicine.manufacturer = request.POST.get('manufacturer')
         medicine.description = request.POST.get('description', '')
         medicine.unit_price = request.POST.get('unit_price')
-        medicine.stock_quantity = request.POST.get('stock_quantity')
         medicine.reorder_level = request.POST.get('reorder_level')
         medicine.expiry_date = request.POST.get('expiry_date')
-        medicine.save()
+        
+        # Stock is applied as a delta against the quantity shown on the
+        # form so dispenses made in the meantime are not overwritten.
+        original_stock = int(request.POST.get('original_stock_quantity') or medicine.stock_quantity)
+        stock_change = int(request.POST.get('stock_quantity') or 0) - original_stock
+        try:
+            with transaction.atomic():
+                medicine.save(update_fields=[
+                    'medicine_name', 'medicine_type', 'manufacturer', 'description',
+                    'unit_price', 'reorder_level', 'expiry_date', 'updated_at'
+                ])
+                pharmacy.correct_stock(medicine.pk, stock_change, user=request.user)
+        except pharmacy.InsufficientStock as e:
+            messages.error(request, str(e))
+            return redirect('medicine_edit', pk=pk)
         
         messages.success(request, f'Medicine {medicine.medicine_name} updated successfully!')
         return redirect('medicine_list')
@@ -842,6 +1039,138 @@ def medicine_edit(request, pk):
     context = {'medicine': medicine, 'edit_mode': True}
     return render(request, 'pharmacy/medicine_form.html', context)
 
+@login_required
+@role_required('admin', 'pharmacist')
+def medicine_batches(request, pk):
+    medicine = get_object_or_404(Medicine, pk=pk)
+    
+    if request.method == 'POST':
+        try:
+            quantity = int(request.POST.get('quantity'))
+        except (TypeError, ValueError):
+            quantity = 0
+        if quantity <= 0:
+            messages.error(request, 'Enter a positive whole-number quantity.')
+            return redirect('medicine_batches', pk=pk)
+        try:
+            batch = pharmacy.receive_batch(
+                medicine.pk,
+                batch_number=request.POST.get('batch_number'),
+                expiry_date=request.POST.get('expiry_date'),
+                quantity=quantity,
+                user=request.user
+            )
+        except IntegrityError:
+            messages.error(request, 'A batch with this number already exists for this medicine.')
+        else:
+            messages.success(request, f'Batch {batch.batch_number} received successfully!')
+        return redirect('medicine_batches', pk=pk)
+    
+    context = {
+        'medicine': medicine,
+        'batches': medicine.batches.order_by('expiry_date', 'pk'),
+        'today': timezone.now().date()
+    }
+    return render(request, 'pharmacy/medicine_batches.html', context)
+
+@login_required
+@role_required('admin', 'pharmacist')
+def medicine_expiry_report(request):
+    rows = pharmacy.expiry_horizon_report()
+    
+    context = {
+        'rows': rows,
+        'horizons': pharmacy.EXPIRY_HORIZONS,
+        'totals': {
+            key: sum(row[key] for row in rows)
+            for key in ['expired'] + [f'within_{days}' for days in pharmacy.EXPIRY_HORIZONS]
+        }
+    }
+    return render(request, 'pharmacy/expiry_report.html', context)
+
+@login_required
+@role_required('admin', 'pharmacist', 'doctor')
+def prescription_list(request):
+    prescriptions = PharmacyPrescription.objects.select_related(
+        'patient', 'doctor__user'
+    ).all().order_by('-created_at')
+    
+    # Filter by status
+    status_filter = request.GET.get('status', '')
+    if status_filter:
+        prescriptions = prescriptions.filter(status=status_filter)
+    
+    context = {
+        'prescriptions': prescriptions,
+        'status_filter': status_filter
+    }
+    return render(request, 'pharmacy/prescription_list.html', context)
+
+@login_required
+@doctor_required
+def prescription_add(request):
+    opd_record = None
+    if request.GET.get('opd'):
+        opd_record = get_object_or_404(OPDRecord, pk=request.GET.get('opd'))
+    
+    if request.method == 'POST':
+        items = [
+            {
+                'medicine_id': medicine_id,
+                'quantity': quantity,
+                'dosage': dosage,
+                'duration': duration,
+                'instructions': instructions
+            }
+            for medicine_id, quantity, dosage, duration, instructions in zip(
+                request.POST.getlist('medicine'),
+                request.POST.getlist('quantity'),
+                request.POST.getlist('dosage'),
+                request.POST.getlist('duration'),
+                request.POST.getlist('instructions')
+            )
+            if medicine_id
+        ]
+        
+        try:
+            prescription = pharmacy.create_prescription(
+                generate_unique_id('RX'),
+                patient_id=request.POST.get('patient'),
+                doctor_id=request.user.doctor.pk,
+                items=items,
+                opd_record_id=request.POST.get('opd_record') or None
+            )
+        except pharmacy.PharmacyError as e:
+            messages.error(request, str(e))
+        else:
+            messages.success(request, f'Prescription {prescription.prescription_number} created successfully!')
+            return redirect('prescription_list')
+    
+    context = {
+        'opd_record': opd_record,
+        'patients': Patient.objects.all(),
+        'medicines': Medicine.objects.only(
+            'medicine_name', 'medicine_type', 'unit_price', 'stock_quantity'
+        ).order_by('medicine_name'),
+        'item_rows': range(5)
+    }
+    return render(request, 'pharmacy/prescription_form.html', context)
+
+@login_required
+@pharmacist_required
+def prescription_dispense(request, pk):
+    prescription = get_object_or_404(PharmacyPrescription, pk=pk)
+    
+    if request.method == 'POST':
+        try:
+            pharmacy.dispense_prescription(prescription.pk, request.user)
+        except pharmacy.PharmacyError as e:
+            messages.error(request, str(e))
+        else:
+            messages.success(request, f'Prescription {prescription.prescription_number} dispensed!')
+    
+    return redirect('prescription_list')
+
 # Laboratory Management Views
 @login_required
 @admin_required
@@ -867,11 +1196,36 @@ def lab_test_add(request):
     
     return render(request, 'laboratory/lab_test_form.html')
 
+@login_required
+@admin_required
+def lab_panel_list(request):
+    panels = LabPanel.objects.prefetch_related('tests').order_by('panel_name')
+    context = {'panels': panels}
+    return render(request, 'laboratory/lab_panel_list.html', context)
+
+@login_required
+@admin_required
+def lab_panel_add(request):
+    if request.method == 'POST':
+        with transaction.atomic():
+            panel = LabPanel.objects.create(
+                panel_name=request.POST.get('panel_name'),
+                panel_code=request.POST.get('panel_code'),
+                description=request.POST.get('description', '')
+            )
+            panel.tests.set(request.POST.getlist('tests'))
+        
+        messages.success(request, f'Lab Panel {panel.panel_name} added successfully!')
+        return redirect('lab_panel_list')
+    
+    context = {'lab_tests': LabTest.objects.only('test_code', 'test_name').order_by('test_name')}
+    return render(request, 'laboratory/lab_panel_form.html', context)
+
 @login_required
 @role_required('admin', 'doctor', 'lab_technician')
 def lab_request_list(request):
     lab_requests = LabTestRequest.objects.select_related(
-        'patient', 'doctor__user', 'test'
+        'patient', 'doctor__user', 'test', 'technician'
     ).all().order_by('-requested_date')
     
     # Filter by status
@@ -879,9 +1233,17 @@ def lab_request_list(request):
     if status_filter:
         lab_requests = lab_requests.filter(status=status_filter)
     
+    # Abnormal results of the logged-in doctor's requests
+    abnormal_only = request.GET.get('abnormal') == '1' and hasattr(request.user, 'doctor')
+    if abnormal_only:
+        lab_requests = lab_results.abnormal_results(request.user.doctor).select_related('doctor__user')
+        if status_filter:
+            lab_requests = lab_requests.filter(status=status_filter)
+    
     context = {
         'lab_requests': lab_requests,
-        'status_filter': status_filter
+        'status_filter': status_filter,
+        'abnormal_only': abnormal_only
     }
     return render(request, 'laboratory/lab_request_list.html', context)
 
@@ -889,51 +1251,166 @@ def lab_request_list(request):
 @doctor_required
 def lab_request_add(request):
     if request.method == 'POST':
-        request_number = generate_unique_id('LAB')
-        
-        lab_request = LabTestRequest.objects.create(
-            request_number=request_number,
-            patient_id=request.POST.get('patient'),
-            doctor_id=request.POST.get('doctor'),
-            test_id=request.POST.get('test'),
-            status='pending'
-        )
-        
-        messages.success(request, f'Lab Test Request {request_number} created successfully!')
-        return redirect('lab_request_list')
+        try:
+            lab_requests = laboratory.create_order(
+                generate_unique_id('LAB'),
+                patient_id=request.POST.get('patient'),
+                doctor_id=request.user.doctor.pk,
+                test_ids=request.POST.getlist('tests'),
+                panel_ids=request.POST.getlist('panels'),
+                priority=request.POST.get('priority') or 3
+            )
+        except laboratory.LabError as e:
+            messages.error(request, str(e))
+        else:
+            total = sum(lab_request.price for lab_request in lab_requests)
+            messages.success(
+                request,
+                f'Lab Order {lab_requests[0].order_number} created with {len(lab_requests)} test(s), '
+                f'charges ₹{total:.2f}.'
+            )
+            return redirect('lab_request_list')
     
     context = {
-        'patients': Patient.objects.all(),
-        'doctors': Doctor.objects.all(),
-        'lab_tests': LabTest.objects.all()
+        'patients': Patient.objects.only('patient_id', 'first_name', 'last_name').order_by('patient_id'),
+        'lab_tests': LabTest.objects.only('test_code', 'test_name', 'price').order_by('test_name'),
+        'panels': LabPanel.objects.prefetch_related(
+            Prefetch('tests', queryset=LabTest.objects.only('test_name', 'price'))
+        ).order_by('panel_name'),
+        'priority_choices': LabTestRequest.PRIORITY_CHOICES
     }
     return render(request, 'laboratory/lab_request_form.html', context)
 
+@login_required
+@lab_technician_required
+def lab_worklist(request):
+    test_id = request.GET.get('test', '')
+    context = {
+        'queues': laboratory.queue_counts(),
+        'worklist': laboratory.worklist(test_id or None)[:50],
+        'my_work': laboratory.my_open_work(request.user),
+        'test_filter': test_id
+    }
+    return render(request, 'laboratory/lab_worklist.html', context)
+
+@login_required
+@lab_technician_required
+def lab_request_claim(request, pk):
+    if request.method != 'POST':
+        return redirect('lab_worklist')
+    
+    try:
+        lab_request = laboratory.claim_request(pk, request.user)
+    except laboratory.LabError as e:
+        messages.error(request, str(e))
+        return redirect('lab_worklist')
+    
+    messages.success(request, f'Lab Request {lab_request.request_number} claimed.')
+    return redirect('lab_request_update', pk=lab_request.pk)
+
+@login_required
+@lab_technician_required
+def lab_claim_next(request):
+    if request.method != 'POST':
+        return redirect('lab_worklist')
+    
+    lab_request = laboratory.claim_next(request.user, request.POST.get('test') or None)
+    if lab_request is None:
+        messages.info(request, 'The queue is empty.')
+        return redirect('lab_worklist')
+    
+    messages.success(request, f'Lab Request {lab_request.request_number} claimed.')
+    return redirect('lab_request_update', pk=lab_request.pk)
+
+@login_required
+@role_required('admin', 'lab_technician')
+def lab_request_release(request, pk):
+    if request.method == 'POST':
+        try:
+            laboratory.release_request(pk, request.user, any_technician=request.user.profile.role == 'admin')
+            messages.success(request, 'Lab request returned to the queue.')
+        except laboratory.LabError as e:
+            messages.error(request, str(e))
+    return redirect('lab_worklist')
+
 @login_required
 @lab_technician_required
 def lab_request_update(request, pk):
     lab_request = get_object_or_404(LabTestRequest, pk=pk)
     
+    # Only the technician who claimed a request may work on it; one left
+    # without a technician is taken over by whoever saves it
+    if lab_request.status == 'pending':
+        messages.error(request, f'Claim Lab Request {lab_request.request_number} from the worklist first.')
+        return redirect('lab_worklist')
+    unattended = laboratory.is_unattended(lab_request)
+    if lab_request.technician_id != request.user.id and not unattended:
+        messages.error(request, f'Lab Request {lab_request.request_number} is assigned to another technician.')
+        return redirect('lab_worklist')
+    
     if request.method == 'POST':
-        lab_request.status = request.POST.get('status')
+        if unattended:
+            try:
+                laboratory.take_over_request(lab_request.pk, request.user)
+            except laboratory.LabError as e:
+                messages.error(request, str(e))
+                return redirect('lab_worklist')
+            lab_request.refresh_from_db()
+        status = request.POST.get('status')
+        if status not in ('in_progress', 'completed', 'cancelled'):
+            status = lab_request.status
+        lab_request.status = status
         lab_request.result = request.POST.get('result', '')
+        # Left blank, the numeric value is read from the result text when flagging
+        lab_request.numeric_result = lab_results.parse_numeric_result(request.POST.get('numeric_result', ''))
         lab_request.notes = request.POST.get('notes', '')
         
         if request.FILES.get('report_file'):
             lab_request.report_file = request.FILES['report_file']
         
-        if lab_request.status == 'completed':
+        newly_completed = lab_request.status == 'completed' and not lab_request.completed_date
+        if newly_completed:
             lab_request.completed_date = timezone.now()
-            lab_request.technician = request.user
         
-        lab_request.save()
+        with transaction.atomic():
+            lab_request.save()
+            if newly_completed:
+                lab_tat.record_completion(lab_request)
         
         messages.success(request, f'Lab Request {lab_request.request_number} updated successfully!')
-        return redirect('lab_request_list')
+        return redirect('lab_worklist')
     
     context = {'lab_request': lab_request}
     return render(request, 'laboratory/lab_request_update.html', context)
 
+@login_required
+@role_required('admin', 'doctor', 'lab_technician')
+def lab_report_download(request, pk):
+    lab_request = get_object_or_404(LabTestRequest, pk=pk)
+    if not lab_request.report_file:
+        raise Http404('No report uploaded for this request.')
+    extension = os.path.splitext(lab_request.report_file.name)[1]
+    return file_response(request, lab_request.report_file, filename=f'{lab_request.request_number}{extension}')
+
+@login_required
+@role_required('admin', 'lab_technician')
+def lab_tat_report(request):
+    try:
+        days = max(int(request.GET.get('days', 7)), 1)
+    except ValueError:
+        days = 7
+    this_hour = timezone.localtime().replace(minute=0, second=0, microsecond=0)
+    since = this_hour.replace(hour=0) - timedelta(days=days - 1)
+    
+    # Daily rollups for the window, hourly rollups for the last 24 hours
+    context = {
+        'days': days,
+        'by_test': lab_tat.turnaround_summary(since),
+        'by_technician': lab_tat.turnaround_summary(since, by='technician'),
+        'last_24_hours': lab_tat.turnaround_summary(this_hour - timedelta(hours=23), period='hour'),
+    }
+    return render(request, 'laboratory/lab_tat_report.html', context)
+
 # Billing Management Views
 @login_required
 @admin_required
@@ -985,15 +1462,84 @@ def bill_add(request):
     
     context = {
         'patients': Patient.objects.all(),
-        'doctors': Doctor.objects.all()
+        'doctors': Doctor.objects.all(),
+        'unbilled_ipd': IPDRecord.objects.filter(bill__isnull=True).select_related('patient').order_by('-admission_date')[:50],
+        'unbilled_opd': OPDRecord.objects.filter(bill__isnull=True).select_related('patient').order_by('-visit_date')[:50]
     }
     return render(request, 'billing/bill_form.html', context)
 
+@login_required
+@admin_required
+def bill_compose(request):
+    if request.method != 'POST':
+        return redirect('bill_add')
+    
+    kind, _, pk = request.POST.get('encounter', '').partition(':')
+    model = {'ipd': IPDRecord, 'opd': OPDRecord}.get(kind)
+    if model is None or not pk.isdigit():
+        messages.error(request, 'Please select an OPD visit or IPD stay to bill.')
+        return redirect('bill_add')
+    encounter = get_object_or_404(model.objects.select_related('patient'), pk=pk)
+    
+    try:
+        bill = billing.compose_bill(
+            encounter.patient,
+            encounter,
+            created_by=request.user,
+            discount=Decimal(request.POST.get('discount', 0) or 0),
+            tax=Decimal(request.POST.get('tax', 0) or 0),
+            other_charges=Decimal(request.POST.get('other_charges', 0) or 0)
+        )
+    except billing.BillingError as e:
+        messages.error(request, str(e))
+        return redirect('bill_add')
+    
+    messages.success(request, f'Bill {bill.bill_number} created successfully!')
+    return redirect('bill_detail', pk=bill.pk)
+
+@login_required
+@admin_required
+def bill_discharges(request):
+    if request.method == 'POST':
+        bills = billing.compose_discharge_bills(created_by=request.user)
+        if bills:
+            messages.success(request, f'Created {len(bills)} bill(s) for today\'s discharges.')
+        else:
+            messages.info(request, 'Every discharge today has already been billed.')
+    return redirect('bill_list')
+
+@login_required
+@admin_required
+def bill_invoices(request):
+    ids = [int(pk) for pk in request.GET.get('ids', '').split(',') if pk.strip().isdigit()]
+    if ids:
+        bills = Bill.objects.filter(pk__in=ids)
+        filename = 'invoices.zip'
+    else:
+        try:
+            start = date.fromisoformat(request.GET.get('start', ''))
+            end = date.fromisoformat(request.GET.get('end', '') or request.GET.get('start', ''))
+        except ValueError:
+            messages.error(request, 'Please choose a date range or bills to export.')
+            return redirect('bill_list')
+        bills = invoices.bills_between(start, end)
+        filename = f'invoices_{start}_{end}.zip'
+    
+    response = StreamingHttpResponse(
+        invoices.stream_invoice_zip(invoices.invoice_data(bills)), content_type='application/zip'
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
 @login_required
 @admin_required
 def bill_detail(request, pk):
     bill = get_object_or_404(Bill, pk=pk)
-    context = {'bill': bill}
+    context = {
+        'bill': bill,
+        'items': bill.items.order_by('pk'),
+        'payments': bill.payments.select_related('received_by').order_by('received_at', 'pk')
+    }
     return render(request, 'billing/bill_detail.html', context)
 
 @login_required
@@ -1002,15 +1548,28 @@ def bill_payment(request, pk):
     bill = get_object_or_404(Bill, pk=pk)
     
     if request.method == 'POST':
-        amount = Decimal(request.POST.get('amount', 0))
-        bill.amount_paid += amount
-        bill.payment_method = request.POST.get('payment_method')
-        bill.save()
+        try:
+            payment, created = billing.record_payment(
+                bill.pk,
+                Decimal(request.POST.get('amount') or 0),
+                request.POST.get('payment_method'),
+                user=request.user,
+                idempotency_key=request.POST.get('idempotency_key')
+            )
+        except (billing.BillingError, InvalidOperation) as e:
+            messages.error(request, str(e) if isinstance(e, billing.BillingError) else 'Please enter a valid amount.')
+            return redirect('bill_payment', pk=pk)
         
-        messages.success(request, f'Payment of ₹{amount} recorded successfully!')
+        if created:
+            messages.success(request, f'Payment of ₹{payment.amount} recorded successfully!')
+        else:
+            messages.info(request, f'Payment of ₹{payment.amount} was already recorded.')
         return redirect('bill_detail', pk=pk)
     
-    context = {'bill': bill}
+    context = {
+        'bill': bill,
+        'idempotency_key': uuid.uuid4().hex
+    }
     return render(request, 'billing/bill_payment.html', context)
 
 # Staff Management Views
@@ -1073,20 +1632,18 @@ def attendance_list(request):
 @admin_required
 def attendance_mark(request):
     if request.method == 'POST':
-        user_id = request.POST.get('user')
-        date = request.POST.get('date')
-        status = request.POST.get('status')
-        
-        attendance, created = Attendance.objects.update_or_create(
-            user_id=user_id,
-            date=date,
-            defaults={
-                'status': status,
-                'check_in_time': request.POST.get('check_in_time') or None,
-                'check_out_time': request.POST.get('check_out_time') or None,
+        try:
+            attendance.mark([{
+                'user_id': request.POST.get('user'),
+                'date': request.POST.get('date'),
+                'status': request.POST.get('status'),
+                'check_in_time': request.POST.get('check_in_time'),
+                'check_out_time': request.POST.get('check_out_time'),
                 'notes': request.POST.get('notes', '')
-            }
-        )
+            }])
+        except ValueError as e:
+            messages.error(request, str(e))
+            return redirect('attendance_mark')
         
         messages.success(request, 'Attendance marked successfully!')
         return redirect('attendance_list')
@@ -1097,42 +1654,226 @@ def attendance_mark(request):
     }
     return render(request, 'staff/attendance_form.html', context)
 
+@login_required
+@admin_required
+def attendance_bulk(request):
+    role = request.GET.get('role') or request.POST.get('role', '')
+    try:
+        day = date.fromisoformat(request.GET.get('date') or request.POST.get('date') or '')
+    except ValueError:
+        day = timezone.localdate()
+    staff = list(attendance.staff_members(role))
+    
+    if request.method == 'POST':
+        entries = [
+            {
+                'user_id': member.pk,
+                'date': day,
+                'status': request.POST.get(f'status_{member.pk}'),
+                'check_in_time': request.POST.get(f'check_in_{member.pk}'),
+                'check_out_time': request.POST.get(f'check_out_{member.pk}'),
+                'notes': request.POST.get(f'notes_{member.pk}', '')
+            }
+            for member in staff if request.POST.get(f'status_{member.pk}')
+        ]
+        try:
+            count = attendance.mark(entries)
+        except ValueError as e:
+            messages.error(request, str(e))
+        else:
+            messages.success(request, f'Attendance marked for {count} staff member(s) on {day:%b %d, %Y}!')
+            return redirect(f"{reverse('attendance_list')}?date={day}")
+    
+    # Pre-fill what is already marked for the day
+    marked = {
+        record.user_id: record for record in Attendance.objects.filter(date=day, user__in=[m.pk for m in staff])
+    }
+    context = {
+        'rows': [(member, marked.get(member.pk)) for member in staff],
+        'day': day,
+        'role': role,
+        'roles': UserProfile.ROLE_CHOICES,
+        'statuses': Attendance.STATUS_CHOICES,
+    }
+    return render(request, 'staff/attendance_bulk.html', context)
+
+@login_required
+@admin_required
+def attendance_matrix(request):
+    month = attendance.parse_month(request.GET.get('month', ''), timezone.localdate().replace(day=1))
+    role = request.GET.get('role', '')
+    
+    context = {
+        'matrix': attendance.monthly_matrix(month, role),
+        'month': month,
+        'role': role,
+        'roles': UserProfile.ROLE_CHOICES,
+        'statuses': Attendance.STATUS_CHOICES,
+    }
+    return render(request, 'staff/attendance_matrix.html', context)
+
+def _roster_period(params):
+    """First day and number of days from ``start`` and ``days``; tomorrow and 14 by default"""
+    try:
+        start = date.fromisoformat(params.get('start', ''))
+    except ValueError:
+        start = timezone.localdate() + timedelta(days=1)
+    try:
+        days = min(max(int(params.get('days', 14)), 1), 62)
+    except ValueError:
+        days = 14
+    return start, days
+
+@login_required
+@admin_required
+def staff_roster(request):
+    if request.method == 'POST':
+        start, days = _roster_period(request.POST)
+        result = roster.generate_roster(start, days)
+        messages.success(request, f"Rostered {len(result['shifts'])} shift(s) from {start:%b %d, %Y} for {days} day(s)!")
+        if result['deficits']:
+            missing = sum(count for *_, count in result['deficits'])
+            messages.warning(
+                request, f"{len(result['deficits'])} shift(s) are {missing} staff short of their minimum; "
+                         f"there are not enough nurses or doctors free on those days."
+            )
+        return redirect(f"{reverse('staff_roster')}?start={start}&days={days}")
+    
+    start, days = _roster_period(request.GET)
+    role = request.GET.get('role', '')
+    context = {
+        'matrix': roster.roster_matrix(start, days, role if role in roster.ROLES else None),
+        'start': start,
+        'days': days,
+        'role': role,
+        'roles': [(value, label) for value, label in UserProfile.ROLE_CHOICES if value in roster.ROLES],
+        'shift_types': Shift.SHIFT_CHOICES,
+    }
+    return render(request, 'staff/roster.html', context)
+
 # Reports and Analytics Views
+def _analytics_range(request, default_days=30):
+    """Local [start, end) and bucket from ?start=&end=&bucket=; a date-only end includes that day"""
+    today = datetime.combine(timezone.localdate(), datetime.min.time())
+    start_param, end_param = request.GET.get('start', ''), request.GET.get('end', '')
+    start = datetime.fromisoformat(start_param) if start_param else today - timedelta(days=default_days - 1)
+    end = datetime.fromisoformat(end_param) if end_param else today
+    if not end_param or len(end_param) == 10:
+        end += timedelta(days=1)
+    return start.replace(tzinfo=None), end.replace(tzinfo=None), request.GET.get('bucket', 'day')
+
+def _analytics_series(request):
+    try:
+        return analytics.series(*_analytics_range(request)), None
+    except ValueError as e:
+        return None, str(e)
+
+@login_required
+@admin_required
+def reports_analytics(request):
+    data, error = _analytics_series(request)
+    if error:
+        return JsonResponse({'error': error}, status=400)
+    return JsonResponse(data)
+
 @login_required
 @admin_required
 def reports_dashboard(request):
     today = timezone.now().date()
     first_day_month = today.replace(day=1)
+    # Revenue days are local dates
+    local_today = timezone.localdate()
+    today_revenue = revenue.revenue_summary(local_today)
+    month_revenue = revenue.revenue_summary(local_today.replace(day=1), local_today)
     
     context = {
         # Daily stats
         'daily_patients': Patient.objects.filter(registered_date__date=today).count(),
         'daily_appointments': Appointment.objects.filter(appointment_date=today).count(),
-        'daily_revenue': Bill.objects.filter(created_at__date=today).aggregate(
-            total=Sum('total_amount'))['total'] or 0,
+        'daily_revenue': today_revenue['billed'],
+        'daily_collected': today_revenue['collected'],
         
         # Monthly stats
         'monthly_patients': Patient.objects.filter(
             registered_date__date__gte=first_day_month).count(),
         'monthly_appointments': Appointment.objects.filter(
             appointment_date__gte=first_day_month).count(),
-        'monthly_revenue': Bill.objects.filter(
-            created_at__date__gte=first_day_month).aggregate(
-            total=Sum('total_amount'))['total'] or 0,
+        'monthly_revenue': month_revenue['billed'],
+        'monthly_collected': month_revenue['collected'],
+        'collected_by_method': [
+            (label, month_revenue['by_method'].get(method, 0)) for method, label in Bill.PAYMENT_METHOD_CHOICES
+        ],
+        'billed_by_status': [
+            (label, month_revenue['by_status'].get(status, 0)) for status, label in Bill.STATUS_CHOICES
+        ],
         
         # Department wise
         'opd_count': OPDRecord.objects.filter(visit_date__date=today).count(),
         'ipd_count': IPDRecord.objects.filter(status='admitted').count(),
         'lab_tests_today': LabTestRequest.objects.filter(requested_date__date=today).count(),
         
-        # Top doctors
-        'top_doctors': Doctor.objects.annotate(
-            appointment_count=Count('appointments')
+        # Top doctors this month
+        'top_doctors': Doctor.objects.select_related('user').annotate(
+            appointment_count=Count(
+                'appointments', filter=Q(appointments__appointment_date__gte=first_day_month)
+            )
         ).order_by('-appointment_count')[:5]
     }
     
+    # Trends over the chosen range
+    trends, error = _analytics_series(request)
+    if error:
+        messages.error(request, error)
+    elif trends:
+        series = trends['series']
+        appointments = series['appointments']
+        context['trend_rows'] = [
+            {
+                'bucket': datetime.fromisoformat(bucket),
+                'registrations': series['registrations'][i],
+                'appointments': sum(values[i] for values in appointments.values()),
+                'completed': appointments.get('completed', [0] * len(trends['buckets']))[i],
+                'opd_visits': series['opd_visits'][i],
+                'admissions': series['admissions'][i],
+                'lab_requests': series['lab_requests'][i],
+                'billed': series['revenue_billed'][i],
+                'collected': series['revenue_collected'][i],
+            }
+            for i, bucket in enumerate(trends['buckets'])
+        ]
+    context['trend_start'], context['trend_end'], context['trend_bucket'] = (
+        request.GET.get('start', ''), request.GET.get('end', ''), request.GET.get('bucket', 'day')
+    )
+    context['bucket_choices'] = [('hour', 'Hour'), ('day', 'Day'), ('week', 'Week'), ('month', 'Month')]
+    
     return render(request, 'reports/reports_dashboard.html', context)
 
+@login_required
+@admin_required
+def reports_performance(request):
+    source = request.GET.get('source', 'appointment')
+    if source not in dict(PerformanceRollup.SOURCE_CHOICES):
+        source = 'appointment'
+    dimensions = [d for d in performance.DIMENSIONS if d in request.GET.getlist('dim')] or ['specialization', 'month']
+    try:
+        start = date.fromisoformat(request.GET['start']) if request.GET.get('start') else None
+        end = date.fromisoformat(request.GET['end']) if request.GET.get('end') else None
+    except ValueError:
+        messages.error(request, 'Please enter valid dates.')
+        start = end = None
+    
+    context = {
+        'rows': performance.pivot(source, dimensions, start, end),
+        'source': source,
+        'source_choices': PerformanceRollup.SOURCE_CHOICES,
+        'dimensions': dimensions,
+        'dimension_choices': performance.DIMENSIONS,
+        'start': start,
+        'end': end,
+        'stale_days': PerformanceStaleDay.objects.count(),
+    }
+    return render(request, 'reports/performance.html', context)
+
 # Profile Management
 @login_required
 def profile_view(request):
@@ -1164,6 +1905,7 @@ def profile_edit(request):
             profile.profile_picture = request.FILES['profile_picture']
         
         profile.save()
+        thumbnails.schedule(profile.profile_picture)
         
         messages.success(request, 'Profile updated successfully!')
         return redirect('profile_view')
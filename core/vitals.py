@@ -0,0 +1,156 @@
+"""
+Early-warning scan over the vitals of admitted IPD patients.
+
+Recent readings for every admitted patient are packed into one dense
+(patients x readings x parameters) NumPy array and scored in a single
+vectorized pass using NEWS2-style bands plus a trend component.
+"""
+import numpy as np
+from datetime import timedelta
+from django.db import transaction
+from django.utils import timezone
+from .models import VitalSign, VitalsAlert
+
+# Order of the parameter axis of every vitals array
+VITAL_FIELDS = ['respiratory_rate', 'spo2', 'systolic_bp', 'pulse', 'temperature']
+VITAL_LABELS = ['RR', 'SpO2', 'SBP', 'HR', 'Temp']
+
+# NEWS2 bands: upper-inclusive band edges and the score of each band
+SCORE_BANDS = [
+    ([8, 11, 20, 24], [3, 1, 0, 2, 3]),              # respiratory rate
+    ([91, 93, 95], [3, 2, 1, 0]),                    # SpO2
+    ([90, 100, 110, 219], [3, 2, 1, 0, 3]),          # systolic BP
+    ([40, 50, 90, 110, 130], [3, 1, 0, 1, 2, 3]),    # pulse
+    ([35.0, 36.0, 38.0, 39.0], [3, 1, 0, 1, 2]),     # temperature
+]
+
+# Change from the patient's own baseline that adds one point.
+# Positive thresholds flag a rise, negative ones a drop.
+DELTA_THRESHOLDS = np.array([6.0, -3.0, -20.0, 20.0, 1.0])
+
+MEDIUM_RISK_SCORE = 5
+HIGH_RISK_SCORE = 7
+
+DEFAULT_WINDOW = 48
+DEFAULT_HOURS = 24
+
+
+def build_vitals_matrix(record_ids, values, window=DEFAULT_WINDOW):
+    """
+    Pack flat readings into a right-aligned (patients, window, params) array.
+
+    ``record_ids`` must be sorted so that each patient's readings are
+    contiguous and in chronological order. Only the last ``window``
+    readings of each patient are kept; shorter histories are padded
+    with NaN on the left.
+    """
+    record_ids = np.asarray(record_ids)
+    values = np.asarray(values, dtype=float).reshape(len(record_ids), len(VITAL_FIELDS))
+    patients, starts, counts = np.unique(record_ids, return_index=True, return_counts=True)
+
+    group = np.repeat(np.arange(len(patients)), counts)
+    rank = np.arange(len(record_ids)) - np.repeat(starts, counts)
+    slot = rank - np.repeat(counts, counts) + window
+    keep = slot >= 0
+
+    matrix = np.full((len(patients), window, len(VITAL_FIELDS)), np.nan)
+    matrix[group[keep], slot[keep]] = values[keep]
+    return patients, matrix
+
+
+def early_warning_scores(matrix):
+    """
+    Score every patient in ``matrix`` at once.
+
+    Returns ``(totals, param_scores, latest)`` where ``latest`` holds the
+    most recent recorded value of each parameter and ``param_scores``
+    the band plus trend score per parameter.
+    """
+    valid = ~np.isnan(matrix)
+    window = matrix.shape[1]
+
+    # Most recent non-missing value per patient and parameter
+    last_slot = window - 1 - np.argmax(valid[:, ::-1, :], axis=1)
+    latest = np.take_along_axis(matrix, last_slot[:, None, :], axis=1)[:, 0, :]
+
+    param_scores = np.zeros(latest.shape, dtype=np.int64)
+    for k, (edges, scores) in enumerate(SCORE_BANDS):
+        column = latest[:, k]
+        banded = np.asarray(scores)[np.digitize(column, edges, right=True)]
+        param_scores[:, k] = np.where(np.isnan(column), 0, banded)
+
+    # Trend: latest value against the mean of the earlier readings
+    counts = valid.sum(axis=1)
+    totals = np.where(valid, matrix, 0.0).sum(axis=1)
+    has_history = counts > 1
+    latest_filled = np.nan_to_num(latest)
+    baseline = np.divide(totals - latest_filled, counts - 1,
+                         out=np.zeros_like(totals), where=has_history)
+    delta = latest_filled - baseline
+    crossed = np.where(DELTA_THRESHOLDS > 0, delta >= DELTA_THRESHOLDS, delta <= DELTA_THRESHOLDS)
+    param_scores += (crossed & has_history).astype(np.int64)
+
+    return param_scores.sum(axis=1), param_scores, latest
+
+
+def risk_level(total, max_param_score):
+    if total >= HIGH_RISK_SCORE:
+        return 'high'
+    if total >= MEDIUM_RISK_SCORE or max_param_score >= 3:
+        return 'medium'
+    return None
+
+
+def load_recent_vitals(hours=DEFAULT_HOURS, window=DEFAULT_WINDOW):
+    """Load recent vitals of all admitted patients with a single query"""
+    since = timezone.now() - timedelta(hours=hours)
+    rows = VitalSign.objects.filter(
+        ipd_record__status='admitted',
+        recorded_at__gte=since
+    ).order_by('ipd_record_id', 'recorded_at').values_list('ipd_record_id', *VITAL_FIELDS)
+    rows = list(rows)
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty((0, window, len(VITAL_FIELDS)))
+
+    data = np.array(rows, dtype=float)
+    return build_vitals_matrix(data[:, 0].astype(np.int64), data[:, 1:], window)
+
+
+def _summary(param_scores, latest):
+    parts = []
+    for k in np.argsort(-param_scores, kind='stable'):
+        if param_scores[k] == 0:
+            break
+        parts.append(f"{VITAL_LABELS[k]} {latest[k]:g}")
+    return ', '.join(parts)[:200]
+
+
+def scan_vitals(hours=DEFAULT_HOURS, window=DEFAULT_WINDOW):
+    """
+    Score all admitted patients and replace the published alert list.
+
+    Returns the number of alerts published.
+    """
+    record_ids, matrix = load_recent_vitals(hours, window)
+    totals, param_scores, latest = early_warning_scores(matrix)
+    scanned_at = timezone.now()
+
+    alerts = []
+    max_scores = param_scores.max(axis=1) if len(totals) else totals
+    for i in np.argsort(-totals, kind='stable'):
+        risk = risk_level(totals[i], max_scores[i])
+        if risk is None:
+            continue
+        alerts.append(VitalsAlert(
+            ipd_record_id=int(record_ids[i]),
+            score=int(totals[i]),
+            risk=risk,
+            summary=_summary(param_scores[i], latest[i]),
+            scanned_at=scanned_at
+        ))
+
+    with transaction.atomic():
+        VitalsAlert.objects.all().delete()
+        VitalsAlert.objects.bulk_create(alerts)
+
+    return len(alerts)
@@ -80,6 +80,17 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock at BEGIN so concurrent writers queue on the
+            # busy timeout instead of failing mid-transaction.
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # File-backed test database so concurrency tests can use real
+        # SQLite locking across threads.
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -126,11 +137,36 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Uploads are streamed to disk and hashed for the content-addressed report store
+FILE_UPLOAD_HANDLERS = ['core.storage.HashingFileUploadHandler']
+
+# Let the front-end server send report files: None, 'X-Sendfile' or
+# 'X-Accel-Redirect' (the latter also needs REPORT_SENDFILE_URL, an
+# internal location mapped to MEDIA_ROOT)
+REPORT_SENDFILE_HEADER = None
+REPORT_SENDFILE_URL = '/protected-media/'
+
+# Worker processes rendering thumbnails and report previews after upload
+THUMBNAIL_WORKERS = 2
+
+# Worker processes rendering batch invoice PDFs (None: one per CPU)
+INVOICE_WORKERS = None
+
+# Seconds analytics for the current bucket are cached; past buckets never expire
+ANALYTICS_LIVE_TTL = 60
+
+# Seconds a day of the staff coverage index is cached. Writes to shifts and attendance rebuild it
+# sooner, but only in the writing process unless CACHES points at a shared backend
+COVERAGE_TTL = 300
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Pharmacy stock alert digests are written here as email files
+STOCK_ALERT_OUTBOX = BASE_DIR / 'outbox'
+
 # Authentication
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'dashboard'